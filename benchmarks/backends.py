@@ -0,0 +1,50 @@
+import argparse
+
+from omegaconf import OmegaConf
+
+from benchmarks.tokenize_text import SAMPLE, time_ms
+from src.pipelines.token_classification_pipeline import TokenClassificationPipeline
+
+
+def main(config_path: str, repeats: int):
+    config = OmegaConf.load(config_path)
+    config.pipeline = "TokenClassificationPipeline"
+    config.backend = "torch"
+    torch_pipeline = TokenClassificationPipeline(config)
+    config.backend = "onnx"
+    onnx_pipeline = TokenClassificationPipeline(config)
+
+    print("| texts | words/text | torch (ms) | onnx (ms) | same output |")
+    print("|------:|-----------:|-----------:|----------:|:-----------:|")
+    for n_texts in [1, 8, 32]:
+        for n_words in [25, 100]:
+            text = " ".join((SAMPLE * (n_words // len(SAMPLE.split()) + 1)).split()[:n_words])
+            texts = [text] * n_texts
+
+            # Entities and labels must match, scores up to float precision
+            same_output = [
+                [(o["entity_group"], o["start"], o["end"]) for o in output]
+                for output in torch_pipeline(texts)
+            ] == [
+                [(o["entity_group"], o["start"], o["end"]) for o in output]
+                for output in onnx_pipeline(texts)
+            ]
+
+            torch_ms = time_ms(lambda: torch_pipeline(texts), repeats)
+            onnx_ms = time_ms(lambda: onnx_pipeline(texts), repeats)
+            print(
+                "| {} | {} | {:.2f} | {:.2f} | {} |".format(
+                    n_texts, n_words, torch_ms, onnx_ms, same_output
+                )
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the latency of the ONNX Runtime backend against the torch backend"
+    )
+    parser.add_argument("config_path", type=str)
+    parser.add_argument("--repeats", type=int, default=10, help="Number of timed runs")
+    args = parser.parse_args()
+
+    main(config_path=args.config_path, repeats=args.repeats)
@@ -0,0 +1,99 @@
+import argparse
+from typing import List, Optional
+
+from omegaconf import OmegaConf
+
+from benchmarks.quantization import agreement, read_labelled_file, run
+from src.pipelines.cascade import CascadePipeline, cascade_configs
+from src.pipelines.utils import init_pipeline
+
+
+class ModelsCascade(CascadePipeline):
+    """Cascade that records the model that answered each text it runs."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.models: List[str] = []
+
+    def __call__(self, text, return_tokens=False, return_models=False):
+        outputs, models = super().__call__(text, return_tokens=return_tokens, return_models=True)
+        self.models.extend(models)
+        return outputs
+
+
+def main(config_path: str, labelled_path: str, thresholds: List[float], batch_size: int):
+    config = OmegaConf.load(config_path)
+    if config.get("cascade", {}).get("model", None) is None:
+        raise ValueError("Set cascade.model in {}".format(config_path))
+    examples = read_labelled_file(labelled_path)
+    texts = [example["text"] for example in examples]
+
+    # Gold outputs, in the same format as the pipelines
+    gold: Optional[list] = None
+    if examples and "label" in examples[0]:
+        gold = [[{"label": example["label"]}] for example in examples]
+    elif examples and "entities" in examples[0]:
+        gold = [example["entities"] for example in examples]
+
+    small_config, large_config = cascade_configs(config)
+    small = init_pipeline(small_config)
+    large = init_pipeline(large_config)
+
+    results = {}
+    for name, pipeline in [("small", small), ("large", large)]:
+        outputs, latency = run(pipeline, texts, batch_size)
+        results[name] = (outputs, latency, 1.0 if name == "small" else 0.0)
+    for threshold in thresholds:
+        cascade = ModelsCascade(small, large, threshold)
+        outputs, latency = run(cascade, texts, batch_size)
+        # The last models are those of the timed run, after the warm-up batch
+        n_small = cascade.models[-len(texts) :].count(small.model) if texts else 0
+        results["cascade @ {}".format(threshold)] = (
+            outputs,
+            latency,
+            n_small / max(len(texts), 1),
+        )
+
+    reference, large_latency = results["large"][:2]
+    metric = "label match" if config.pipeline == "TextClassificationPipeline" else "span F1"
+    print(
+        "| model | answered by small | {} vs large | {} vs gold | ms/text | speedup vs large |"
+        "".format(metric, metric)
+    )
+    print("|:------|------------------:|-----------:|----------:|--------:|-----------------:|")
+    for name, (outputs, latency, small_share) in results.items():
+        print(
+            "| {} | {:.1%} | {:.4f} | {} | {:.2f} | {:.2f}x |".format(
+                name,
+                small_share,
+                agreement(config, outputs, reference),
+                "{:.4f}".format(agreement(config, outputs, gold)) if gold else "-",
+                latency,
+                large_latency / latency,
+            )
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the cascade of cascade.model and the root model of a config, at "
+        "several thresholds, against each model alone, on a labelled jsonl file"
+    )
+    parser.add_argument("config_path", type=str)
+    parser.add_argument("labelled_path", type=str)
+    parser.add_argument(
+        "--thresholds",
+        type=float,
+        nargs="+",
+        default=[0.5, 0.8, 0.9, 0.95, 0.99],
+        help="Thresholds of the cascade",
+    )
+    parser.add_argument("--batch_size", type=int, default=16, help="Number of texts per batch")
+    args = parser.parse_args()
+
+    main(
+        config_path=args.config_path,
+        labelled_path=args.labelled_path,
+        thresholds=args.thresholds,
+        batch_size=args.batch_size,
+    )
@@ -0,0 +1,124 @@
+import argparse
+import json
+import sys
+from typing import List, Tuple
+
+# Metrics where higher is worse
+LATENCY_METRICS = ["p50_ms", "p95_ms", "p99_ms"]
+
+# Metric reported for baseline cases that are missing from the current results
+MISSING = "missing"
+
+
+def case_key(result: dict) -> Tuple[str, int, int]:
+    """Returns the key of a benchmark case, as (name, words, batch size).
+
+    Args:
+        result (dict): Result of a benchmark case.
+
+    Returns:
+        Tuple[str, int, int]: Key of the case.
+    """
+    return result["name"], result["words"], result["batch_size"]
+
+
+def find_regressions(
+    baseline: dict, current: dict, metrics: List[str], threshold: float
+) -> List[Tuple[Tuple[str, int, int], str, float, float]]:
+    """Returns the cases of the current results that are slower than the
+    baseline by more than threshold, as a fraction, for any of the metrics.
+    Latency metrics regress when they grow, and throughput when it drops.
+    Cases that are not in the baseline are skipped, and baseline cases that
+    are not in the current results are regressions, with metric MISSING and
+    NaN values, so that a case that stops running cannot pass unnoticed.
+
+    Args:
+        baseline (dict): Baseline results, as written by benchmarks.suite.
+        current (dict): Current results, as written by benchmarks.suite.
+        metrics (List[str]): Metrics to compare, e.g. "p50_ms".
+        threshold (float): Maximum relative slowdown, e.g. 0.25 for 25%.
+
+    Returns:
+        List[Tuple[Tuple[str, int, int], str, float, float]]: List with the
+        key, metric, baseline value, and current value of each regression.
+    """
+    baseline_results = {case_key(r): r for r in baseline["results"]}
+    current_keys = {case_key(r) for r in current["results"]}
+    regressions = [
+        (key, MISSING, float("nan"), float("nan"))
+        for key in baseline_results
+        if key not in current_keys
+    ]
+    for result in current["results"]:
+        base = baseline_results.get(case_key(result))
+        if base is None:
+            continue
+        for metric in metrics:
+            if metric in LATENCY_METRICS:
+                slowdown = result[metric] / base[metric] - 1
+            else:
+                slowdown = base[metric] / result[metric] - 1
+            if slowdown > threshold:
+                regressions.append((case_key(result), metric, base[metric], result[metric]))
+    return regressions
+
+
+def main(baseline_path: str, current_path: str, metrics: List[str], threshold: float) -> int:
+    with open(baseline_path, "r") as f:
+        baseline = json.load(f)
+    with open(current_path, "r") as f:
+        current = json.load(f)
+
+    if baseline["environment"] != current["environment"]:
+        print(
+            "Warning: environments differ, baseline {} vs current {}".format(
+                baseline["environment"], current["environment"]
+            )
+        )
+
+    regressions = find_regressions(baseline, current, metrics, threshold)
+    if not regressions:
+        print("No regressions above {:.0%} in {}".format(threshold, ", ".join(metrics)))
+        return 0
+
+    print("| name | words | batch size | metric | baseline | current |")
+    print("|:-----|------:|-----------:|:-------|---------:|--------:|")
+    for (name, words, batch_size), metric, base, value in regressions:
+        if metric == MISSING:
+            print("| {} | {} | {} | {} | - | - |".format(name, words, batch_size, metric))
+            continue
+        print(
+            "| {} | {} | {} | {} | {:.2f} | {:.2f} |".format(
+                name, words, batch_size, metric, base, value
+            )
+        )
+    print("{} regressions above {:.0%}".format(len(regressions), threshold))
+    return 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare benchmark results against a baseline, and fail on regressions"
+    )
+    parser.add_argument("baseline_path", type=str)
+    parser.add_argument("current_path", type=str)
+    parser.add_argument(
+        "--metrics",
+        type=str,
+        nargs="+",
+        default=["p50_ms", "texts_per_s"],
+        help="Metrics to compare",
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=0.25, help="Maximum relative slowdown, e.g. 0.25"
+    )
+    args = parser.parse_args()
+
+    sys.exit(
+        main(
+            baseline_path=args.baseline_path,
+            current_path=args.current_path,
+            metrics=args.metrics,
+            threshold=args.threshold,
+        )
+    )
@@ -0,0 +1,72 @@
+import argparse
+from typing import List
+
+import numpy as np
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from benchmarks.tokenize_text import time_ms
+from src.api.responses import NumpyJSONResponse
+
+
+def ner_output(n_entities: int) -> List[dict]:
+    """Returns a synthetic token classification output, with numpy values as
+    returned by HuggingFace's pipeline.
+
+    Args:
+        n_entities (int): Number of entities.
+
+    Returns:
+        List[dict]: List of dictionaries, each corresponding to a prediction.
+    """
+    return [
+        {
+            "entity_group": "PER",
+            "score": np.float32(0.99),
+            "word": "António Seráfim",
+            "start": np.int64(20 * ix),
+            "end": np.int64(20 * ix + 15),
+        }
+        for ix in range(n_entities)
+    ]
+
+
+def legacy_render(output: List[dict]) -> bytes:
+    """Previous response path: numpy values are mapped with .item() one key
+    at a time, and FastAPI runs jsonable_encoder before the json encoding.
+
+    Args:
+        output (List[dict]): List of dictionaries, each corresponding to a
+        prediction.
+
+    Returns:
+        bytes: Response body.
+    """
+    np_keys = [k for k, v in output[0].items() if "numpy" in str(type(v))]
+    output = [{**o, **{k: o[k].item() for k in np_keys}} for o in output]
+    content = jsonable_encoder({"predictions": output, "type": "NER", "model": "model"})
+    return JSONResponse(content).body
+
+
+def main(repeats: int):
+    print("| entities | legacy (ms) | orjson (ms) |")
+    print("|---------:|------------:|------------:|")
+    for n_entities in [100, 1000, 10000, 100000]:
+        output = ner_output(n_entities)
+
+        legacy = time_ms(lambda: legacy_render(output), repeats)
+        orjson = time_ms(
+            lambda: NumpyJSONResponse({"predictions": output, "type": "NER", "model": "model"}),
+            repeats,
+        )
+        print("| {} | {:.2f} | {:.2f} |".format(n_entities, legacy, orjson))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the json encoding of API responses against the previous path"
+    )
+    parser.add_argument("--repeats", type=int, default=10, help="Number of timed runs")
+    args = parser.parse_args()
+
+    main(repeats=args.repeats)
@@ -0,0 +1,66 @@
+import argparse
+from typing import List
+
+from omegaconf import OmegaConf
+
+from benchmarks.tokenize_text import SAMPLE, time_ms
+from src.pipelines.token_classification_pipeline import TokenClassificationPipeline
+
+
+def legacy_call(pipeline: TokenClassificationPipeline, texts: List[str]) -> List[List[dict]]:
+    """Previous implementation of TokenClassificationPipeline.__call__, which
+    post-processes one dictionary per token: HuggingFace's pipeline builds the
+    dictionaries, "B-" is fixed into "I-" for subwords, entities are grouped
+    with group_entities, and numpy values are mapped with .item().
+
+    Args:
+        pipeline (TokenClassificationPipeline): Token classification pipeline.
+        texts (List[str]): List of input text strings.
+
+    Returns:
+        List[List[dict]]: List of final predictions per input text.
+    """
+    outputs = []
+    for output in pipeline.pipeline(texts, batch_size=len(texts)):
+        for d in output:
+            if pipeline.prefix in d["word"] and "B-" in d["entity"]:
+                d["entity"] = d["entity"].replace("B-", "I-")
+        output = pipeline.pipeline.group_entities(output)
+        if output:
+            np_keys = [k for k, v in output[0].items() if "numpy" in str(type(v))]
+            output = [{**o, **{k: o[k].item() for k in np_keys}} for o in output]
+        outputs.append(output)
+    return outputs
+
+
+def main(config_path: str, n_texts: int, repeats: int):
+    config = OmegaConf.load(config_path)
+    config.pipeline = "TokenClassificationPipeline"
+    pipeline = TokenClassificationPipeline(config)
+
+    print("| words/text | legacy (ms) | arrays (ms) | arrays, post-processing only (ms) |")
+    print("|-----------:|------------:|------------:|----------------------------------:|")
+    for n_words in [25, 50, 100]:
+        text = " ".join((SAMPLE * (n_words // len(SAMPLE.split()) + 1)).split()[:n_words])
+        texts = [text] * n_texts
+        predictions = pipeline._token_predictions(texts)
+
+        legacy = time_ms(lambda: legacy_call(pipeline, texts), repeats)
+        arrays = time_ms(lambda: pipeline(texts), repeats)
+        postprocessing = time_ms(
+            lambda: [pipeline._group_entities(p) for p in predictions], repeats
+        )
+        print("| {} | {:.2f} | {:.2f} | {:.2f} |".format(n_words, legacy, arrays, postprocessing))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the token classification post-processing against the previous "
+        "implementation"
+    )
+    parser.add_argument("config_path", type=str)
+    parser.add_argument("--n_texts", type=int, default=16, help="Number of texts per batch")
+    parser.add_argument("--repeats", type=int, default=10, help="Number of timed runs")
+    args = parser.parse_args()
+
+    main(config_path=args.config_path, n_texts=args.n_texts, repeats=args.repeats)
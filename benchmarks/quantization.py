@@ -0,0 +1,177 @@
+import argparse
+import io
+import json
+import os
+import time
+from typing import List, Optional, Set, Tuple
+
+import torch
+from omegaconf import OmegaConf
+
+from src.pipelines.backends import OnnxBackend
+from src.pipelines.utils import init_pipeline
+
+
+def read_labelled_file(path: str) -> List[dict]:
+    """Reads a labelled jsonl file, with one example per line. Each example
+    has a "text", and optionally its gold "label" (text classification) or
+    "entities" (token classification), as a list of dictionaries with keys
+    "entity_group", "start", and "end".
+
+    Args:
+        path (str): Path to the labelled jsonl file.
+
+    Returns:
+        List[dict]: List of examples.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def entity_spans(entities: List[dict]) -> Set[Tuple[str, int, int]]:
+    """Returns the spans of a list of entities, as (entity_group, start, end).
+
+    Args:
+        entities (List[dict]): List of entities.
+
+    Returns:
+        Set[Tuple[str, int, int]]: Set of entity spans.
+    """
+    return {(e["entity_group"], e["start"], e["end"]) for e in entities}
+
+
+def span_f1(
+    predicted: List[Set[Tuple[str, int, int]]], reference: List[Set[Tuple[str, int, int]]]
+) -> float:
+    """Returns the micro-averaged F1 of exact entity span matches.
+
+    Args:
+        predicted (List[Set[Tuple[str, int, int]]]): Predicted spans per text.
+        reference (List[Set[Tuple[str, int, int]]]): Reference spans per text.
+
+    Returns:
+        float: Entity span F1, between 0 and 1.
+    """
+    true_positives = sum(len(p & r) for p, r in zip(predicted, reference))
+    n_predicted = sum(len(p) for p in predicted)
+    n_reference = sum(len(r) for r in reference)
+    if not n_predicted and not n_reference:
+        return 1.0
+    return 2 * true_positives / (n_predicted + n_reference)
+
+
+def label_match(predicted: List[str], reference: List[str]) -> float:
+    """Returns the fraction of texts with the same label.
+
+    Args:
+        predicted (List[str]): Predicted label per text.
+        reference (List[str]): Reference label per text.
+
+    Returns:
+        float: Label match, between 0 and 1.
+    """
+    return sum(p == r for p, r in zip(predicted, reference)) / max(len(reference), 1)
+
+
+def model_size_mb(pipeline) -> float:
+    """Returns the size of the model weights of a pipeline, in MB, i.e. the
+    size of the ONNX graph, or of the serialized torch state dict.
+
+    Args:
+        pipeline: Instance of "full" pipeline.
+
+    Returns:
+        float: Size of the model, in MB.
+    """
+    if isinstance(pipeline.backend, OnnxBackend):
+        return os.path.getsize(pipeline.backend.path) / 2**20
+    buffer = io.BytesIO()
+    torch.save(pipeline.backend.model.state_dict(), buffer)
+    return buffer.tell() / 2**20
+
+
+def run(pipeline, texts: List[str], batch_size: int) -> Tuple[list, float]:
+    """Runs a pipeline over texts in batches, after a warm-up batch.
+
+    Args:
+        pipeline: Instance of "full" pipeline.
+        texts (List[str]): List of input text strings.
+        batch_size (int): Number of texts per batch.
+
+    Returns:
+        Tuple[list, float]: Outputs per text, and latency per text in ms.
+    """
+    pipeline(texts[:batch_size])
+    outputs = []
+    start = time.perf_counter()
+    for i in range(0, len(texts), batch_size):
+        outputs.extend(pipeline(texts[i : i + batch_size]))
+    return outputs, (time.perf_counter() - start) * 1000 / max(len(texts), 1)
+
+
+def agreement(config, outputs: list, reference: list) -> float:
+    """Returns the agreement of outputs with reference outputs, i.e. the
+    label match for text classification, or the entity span F1 for token
+    classification.
+
+    Args:
+        config: OmegaConf config.
+        outputs (list): Outputs per text.
+        reference (list): Reference outputs per text.
+
+    Returns:
+        float: Agreement, between 0 and 1.
+    """
+    if config.pipeline == "TextClassificationPipeline":
+        return label_match([o[0]["label"] for o in outputs], [r[0]["label"] for r in reference])
+    return span_f1([entity_spans(o) for o in outputs], [entity_spans(r) for r in reference])
+
+
+def main(config_path: str, labelled_path: str, batch_size: int):
+    config = OmegaConf.load(config_path)
+    examples = read_labelled_file(labelled_path)
+    texts = [example["text"] for example in examples]
+
+    # Gold outputs, in the same format as the pipelines
+    gold: Optional[list] = None
+    if examples and "label" in examples[0]:
+        gold = [[{"label": example["label"]}] for example in examples]
+    elif examples and "entities" in examples[0]:
+        gold = [example["entities"] for example in examples]
+
+    results = {}
+    for name, quantize in [("fp32", None), ("dynamic-int8", "dynamic-int8")]:
+        config.quantize = quantize
+        pipeline = init_pipeline(config)
+        outputs, latency = run(pipeline, texts, batch_size)
+        results[name] = (outputs, latency, model_size_mb(pipeline))
+        del pipeline
+
+    metric = "label match" if config.pipeline == "TextClassificationPipeline" else "span F1"
+    print("| model | {} vs fp32 | {} vs gold | ms/text | model size (MB) |".format(metric, metric))
+    print("|:------|----------:|----------:|--------:|----------------:|")
+    for name, (outputs, latency, size) in results.items():
+        print(
+            "| {} | {:.4f} | {} | {:.2f} | {:.1f} |".format(
+                name,
+                agreement(config, outputs, results["fp32"][0]),
+                "{:.4f}".format(agreement(config, outputs, gold)) if gold else "-",
+                latency,
+                size,
+            )
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the dynamic int8 quantized pipeline against the fp32 pipeline, "
+        "on a labelled jsonl file"
+    )
+    parser.add_argument("config_path", type=str)
+    parser.add_argument("labelled_path", type=str)
+    parser.add_argument("--batch_size", type=int, default=16, help="Number of texts per batch")
+    args = parser.parse_args()
+
+    main(
+        config_path=args.config_path, labelled_path=args.labelled_path, batch_size=args.batch_size
+    )
@@ -0,0 +1,279 @@
+import argparse
+import os
+import platform
+import string
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+import torch
+import transformers
+from omegaconf import OmegaConf
+from transformers import BertConfig
+from transformers import BertForSequenceClassification
+from transformers import BertForTokenClassification
+from transformers import BertTokenizerFast
+
+from benchmarks.tokenize_text import SAMPLE
+from src.pipelines.utils import init_pipeline
+from src.serialization import dumps
+
+# Labels of the tiny token and text classifiers
+NER_LABELS = ["O", "B-PER", "I-PER", "B-ORG", "I-ORG", "B-LOC", "I-LOC", "B-MISC", "I-MISC"]
+SENTIMENT_LABELS = ["NEGATIVE", "POSITIVE"]
+
+# Cases of the suite, as words per text and texts per batch
+WORDS_PER_TEXT = [16, 64, 256]
+BATCH_SIZES = [1, 8, 32]
+
+
+def build_tiny_models(directory: str) -> Dict[str, str]:
+    """Builds a tiny, randomly initialized BERT token classifier and text
+    classifier, with a character-level WordPiece vocabulary, and saves them
+    in directory. Nothing is downloaded, and weights are seeded, so that
+    every run measures the same models.
+
+    Args:
+        directory (str): Directory where the models are saved.
+
+    Returns:
+        Dict[str, str]: Path of each model, by pipeline name.
+    """
+    characters = string.ascii_letters + string.digits + "áéíóúãõçêôÁÉÍÓÚ"
+    words = dict.fromkeys(SAMPLE.replace("(", " ").replace(")", " ").split())
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+    vocab += list(characters + string.punctuation)
+    vocab += ["##" + c for c in characters]
+    vocab += [w for w in words if w not in vocab]
+    tokenizer = BertTokenizerFast(
+        vocab={token: ix for ix, token in enumerate(vocab)},
+        do_lower_case=False,
+        model_max_length=512,
+    )
+
+    torch.manual_seed(0)
+    model_config = dict(
+        vocab_size=len(vocab),
+        hidden_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        intermediate_size=128,
+        max_position_embeddings=512,
+    )
+    models = {
+        "TokenClassificationPipeline": BertForTokenClassification(
+            BertConfig(
+                **model_config,
+                id2label=dict(enumerate(NER_LABELS)),
+                label2id={label: ix for ix, label in enumerate(NER_LABELS)},
+            )
+        ),
+        "TextClassificationPipeline": BertForSequenceClassification(
+            BertConfig(
+                **model_config,
+                id2label=dict(enumerate(SENTIMENT_LABELS)),
+                label2id={label: ix for ix, label in enumerate(SENTIMENT_LABELS)},
+            )
+        ),
+    }
+
+    paths = {}
+    for pipeline_name, model in models.items():
+        paths[pipeline_name] = os.path.join(directory, pipeline_name)
+        model.save_pretrained(paths[pipeline_name])
+        tokenizer.save_pretrained(paths[pipeline_name])
+    return paths
+
+
+def sample_texts(n_words: int, n_texts: int) -> List[str]:
+    """Returns n_texts texts of n_words words, taken from SAMPLE at different
+    starting words, so that texts of a batch differ.
+
+    Args:
+        n_words (int): Number of words per text.
+        n_texts (int): Number of texts.
+
+    Returns:
+        List[str]: List of texts.
+    """
+    words = SAMPLE.split()
+    words = words * (n_words // len(words) + 2)
+    return [" ".join(words[ix % len(SAMPLE.split()) :][:n_words]) for ix in range(n_texts)]
+
+
+def measure(fn: Callable, n_texts: int, repeats: int, warmup: int = 2) -> Dict[str, float]:
+    """Returns latency percentiles and throughput of fn, which processes
+    n_texts texts per call.
+
+    Args:
+        fn (Callable): Function without arguments.
+        n_texts (int): Number of texts processed per call.
+        repeats (int): Number of timed runs.
+        warmup (int, optional): Number of untimed runs. Defaults to 2.
+
+    Returns:
+        Dict[str, float]: Dictionary with keys "p50_ms", "p95_ms", "p99_ms",
+        and "texts_per_s".
+    """
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    p50, p95, p99 = np.percentile(np.array(times) * 1000, [50, 95, 99]).tolist()
+    return {
+        "p50_ms": p50,
+        "p95_ms": p95,
+        "p99_ms": p99,
+        "texts_per_s": n_texts * repeats / sum(times),
+    }
+
+
+def benchmark_pipelines(paths: Dict[str, str], repeats: int) -> List[dict]:
+    """Benchmarks tokenize_text and the __call__ of both pipelines, across
+    text lengths and batch sizes.
+
+    Args:
+        paths (Dict[str, str]): Path of each model, by pipeline name.
+        repeats (int): Number of timed runs per case.
+
+    Returns:
+        List[dict]: List of results, one per case.
+    """
+    results = []
+    for pipeline_name, path in paths.items():
+        pipeline = init_pipeline(OmegaConf.create({"pipeline": pipeline_name, "model": path}))
+        for n_words in WORDS_PER_TEXT:
+            for batch_size in BATCH_SIZES:
+                texts = sample_texts(n_words, batch_size)
+                cases = {pipeline_name: lambda: pipeline(texts)}
+                if pipeline_name == "TokenClassificationPipeline":
+                    cases["tokenize_text"] = lambda: pipeline.tokenize_text(texts)
+                for name, fn in cases.items():
+                    results.append(
+                        {
+                            "name": name,
+                            "words": n_words,
+                            "batch_size": batch_size,
+                            **measure(fn, batch_size, repeats),
+                        }
+                    )
+    return results
+
+
+def benchmark_api(paths: Dict[str, str], directory: str, repeats: int) -> List[dict]:
+    """Benchmarks the FastAPI endpoints in-process, with the token
+    classifier, across text lengths and batch sizes. The prediction cache is
+    disabled, so that every request runs the model.
+
+    Args:
+        paths (Dict[str, str]): Path of each model, by pipeline name.
+        directory (str): Directory where the API config is saved.
+        repeats (int): Number of timed runs per case.
+
+    Returns:
+        List[dict]: List of results, one per case.
+    """
+    config = OmegaConf.create(
+        {
+            "pipeline": "TokenClassificationPipeline",
+            "model": paths["TokenClassificationPipeline"],
+            "cache": {"enabled": False},
+        }
+    )
+    config_path = os.path.join(directory, "config.yaml")
+    OmegaConf.save(config, config_path)
+    os.environ["CONFIG_PATH"] = config_path
+
+    # The API reads its config on import
+    from fastapi.testclient import TestClient
+
+    from src.api.api import app
+
+    results = []
+    with TestClient(app) as client:
+        # Wait for the startup warm-up, which would otherwise overlap the first cases
+        while client.get("/readyz").status_code != 200:
+            time.sleep(0.1)
+        for n_words in WORDS_PER_TEXT:
+            for batch_size in BATCH_SIZES:
+                texts = sample_texts(n_words, batch_size)
+                if batch_size == 1:
+                    cases = {
+                        "/predict/": ("/predict/", {"text": texts[0]}),
+                        "/tokenize/": ("/tokenize/", {"text": texts[0]}),
+                    }
+                else:
+                    cases = {
+                        "/predict_batch/": ("/predict_batch/", {"texts": texts}),
+                        "/tokenize_batch/": ("/tokenize_batch/", {"texts": texts}),
+                    }
+                for name, (url, body) in cases.items():
+                    results.append(
+                        {
+                            "name": name,
+                            "words": n_words,
+                            "batch_size": batch_size,
+                            **measure(lambda: client.post(url, json=body), batch_size, repeats),
+                        }
+                    )
+    return results
+
+
+def main(output_path: str, repeats: int, threads: int):
+    # A fixed number of threads keeps results comparable across machines
+    torch.set_num_threads(threads)
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = build_tiny_models(directory)
+        results = benchmark_pipelines(paths, repeats)
+        results += benchmark_api(paths, directory, repeats)
+
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "transformers": transformers.__version__,
+            "machine": platform.machine(),
+            "threads": threads,
+            "repeats": repeats,
+        },
+        "results": results,
+    }
+    with open(output_path, "wb") as f:
+        f.write(dumps(report, indent=True))
+
+    print("| name | words | batch size | p50 (ms) | p95 (ms) | p99 (ms) | texts/s |")
+    print("|:-----|------:|-----------:|---------:|---------:|---------:|--------:|")
+    for r in results:
+        print(
+            "| {} | {} | {} | {:.2f} | {:.2f} | {:.2f} | {:.1f} |".format(
+                r["name"],
+                r["words"],
+                r["batch_size"],
+                r["p50_ms"],
+                r["p95_ms"],
+                r["p99_ms"],
+                r["texts_per_s"],
+            )
+        )
+    print("Results saved in {}".format(output_path), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the latency and throughput of the pipelines and the API, with "
+        "tiny randomly initialized models built locally"
+    )
+    parser.add_argument(
+        "--output", type=str, default="benchmarks/results.json", help="Path of the json results"
+    )
+    parser.add_argument("--repeats", type=int, default=20, help="Number of timed runs per case")
+    parser.add_argument("--threads", type=int, default=1, help="Number of torch threads")
+    args = parser.parse_args()
+
+    main(output_path=args.output, repeats=args.repeats, threads=args.threads)
@@ -0,0 +1,80 @@
+import argparse
+import statistics
+import time
+from typing import Callable, List
+
+from omegaconf import OmegaConf
+
+from src.pipelines.utils import init_pipeline
+
+SAMPLE = (
+    "António Seráfim and Barack Obama met in Lisbon on Tuesday, to discuss the "
+    "2021 report (including ##hashtags and e-mails like someone@example.com)! "
+)
+
+
+def legacy_tokenize_text(pipeline, text: str) -> List[str]:
+    """Previous implementation of BasePipeline.tokenize_text, which joins the
+    subword tokens into a string, and splits it again.
+
+    Args:
+        pipeline: Instance of "full" pipeline.
+        text (str): User input text.
+
+    Returns:
+        List[str]: List of tokens.
+    """
+    input_ids = pipeline.tokenizer(text)["input_ids"]
+    tokens = pipeline.tokenizer.convert_ids_to_tokens(input_ids, skip_special_tokens=True)
+    string = (" ".join(tokens)).replace(" {}".format(pipeline.prefix), "")
+    return string.split()
+
+
+def time_ms(fn: Callable, repeats: int) -> float:
+    """Returns the median wall time of fn, in milliseconds.
+
+    Args:
+        fn (Callable): Function without arguments.
+        repeats (int): Number of timed runs.
+
+    Returns:
+        float: Median time, in milliseconds.
+    """
+    fn()
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main(config_path: str, n_texts: int, repeats: int):
+    pipeline = init_pipeline(OmegaConf.load(config_path))
+
+    print(
+        "| words/text | legacy (ms) | offsets (ms) | offsets, batch of {} (ms/text) |".format(
+            n_texts
+        )
+    )
+    print("|-----------:|------------:|-------------:|----------------------:|")
+    for n_words in [100, 1000, 10000, 50000]:
+        text = " ".join((SAMPLE * (n_words // len(SAMPLE.split()) + 1)).split()[:n_words])
+        texts = [text] * n_texts
+
+        legacy = time_ms(lambda: legacy_tokenize_text(pipeline, text), repeats)
+        offsets = time_ms(lambda: pipeline.tokenize_text(text), repeats)
+        batch = time_ms(lambda: pipeline.tokenize_text(texts), repeats) / n_texts
+        print("| {} | {:.2f} | {:.2f} | {:.2f} |".format(n_words, legacy, offsets, batch))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark BasePipeline.tokenize_text against the previous implementation"
+    )
+    parser.add_argument("config_path", type=str)
+    parser.add_argument("--n_texts", type=int, default=16, help="Number of texts per batch")
+    parser.add_argument("--repeats", type=int, default=10, help="Number of timed runs")
+    args = parser.parse_args()
+
+    main(config_path=args.config_path, n_texts=args.n_texts, repeats=args.repeats)
@@ -1,5 +1,8 @@
 import nox
 
+# The benchmark is slow and host-dependent, so it only runs with nox -s benchmark
+nox.options.sessions = ["lint", "typing", "test"]
+
 
 @nox.session
 def lint(session):
@@ -19,3 +22,17 @@ def test(session):
     session.install("-r", "requirements.txt")
     session.run("coverage", "run", "--source=src/", "-m", "pytest")
     session.run("coverage", "report", "-m")
+
+
+@nox.session
+def benchmark(session):
+    session.install("-r", "requirements.txt")
+    session.run("python", "-m", "benchmarks.suite", "--output", "benchmarks/results.json")
+    session.run(
+        "python",
+        "-m",
+        "benchmarks.compare",
+        "benchmarks/baseline.json",
+        "benchmarks/results.json",
+        *session.posargs,
+    )
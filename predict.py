@@ -1,21 +1,480 @@
 import argparse
+import hashlib
 import json
 import logging
+import multiprocessing
 import sys
 import os
+import time
+from array import array
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple, Union, cast
 
 from omegaconf import OmegaConf
 from omegaconf.dictconfig import DictConfig
 from tqdm import tqdm
 
+from src.api.cache import PredictionCache
+from src.custom_types import FinalPrediction
+from src.pipelines.backends import model_revision
+from src.pipelines.cascade import CascadePipeline
+from src.pipelines.text_classification_pipeline import TextClassificationPipeline
+from src.pipelines.token_classification_pipeline import TokenClassificationPipeline
 from src.pipelines.utils import init_pipeline
+from src.serialization import dumps
 
+logger = logging.getLogger("logger")
 
-def main(config: DictConfig, input_file: str):
+# Checkpoint of a streaming run that has not predicted any line yet
+INITIAL_CHECKPOINT = {"line": 0, "input_offset": 0, "output_offset": 0}
+
+
+def read_batches(
+    fp: BinaryIO, batch_size: int, end_offset: Optional[int] = None
+) -> Iterator[Tuple[List[str], int]]:
+    """Lazily reads a file opened in binary mode, and yields batches of
+    stripped lines, together with the byte offset right after each batch.
+
+    Args:
+        fp (BinaryIO): File opened in binary mode.
+        batch_size (int): Maximum number of lines per batch.
+        end_offset (Optional[int], optional): Byte offset where reading stops.
+        Lines starting before it are read in full. Defaults to None, which
+        reads until the end of the file.
+
+    Yields:
+        Iterator[Tuple[List[str], int]]: Batch of lines, and byte offset of the
+        first line that is not part of the batch.
+    """
+    offset = fp.tell()
+    batch: List[str] = []
+    for raw_line in iter(fp.readline, b""):
+        if end_offset is not None and offset >= end_offset:
+            break
+        offset += len(raw_line)
+        batch.append(raw_line.decode("utf-8").strip())
+        if len(batch) == batch_size:
+            yield batch, offset
+            batch = []
+    if batch:
+        yield batch, offset
+
+
+def load_checkpoint(checkpoint_path: str) -> Dict[str, int]:
+    """Returns the checkpoint of a streaming run, or the initial checkpoint if
+    there is none.
+
+    Args:
+        checkpoint_path (str): Path to the checkpoint json file.
+
+    Returns:
+        Dict[str, int]: Dictionary with keys "line", "input_offset", and
+        "output_offset", with the corresponding values being the index of the
+        next line to predict, and its byte offsets in the input and output
+        files.
+    """
+    if not os.path.isfile(checkpoint_path):
+        return dict(INITIAL_CHECKPOINT)
+    with open(checkpoint_path, encoding="utf-8") as checkpoint_fp:
+        return json.load(checkpoint_fp)
+
+
+def save_checkpoint(checkpoint_path: str, checkpoint: Dict[str, int]) -> None:
+    """Atomically saves the checkpoint of a streaming run, so that a crash
+    never leaves a partially written checkpoint behind.
+
+    Args:
+        checkpoint_path (str): Path to the checkpoint json file.
+        checkpoint (Dict[str, int]): Checkpoint, as returned by load_checkpoint.
+    """
+    tmp_checkpoint_path = checkpoint_path + ".tmp"
+    with open(tmp_checkpoint_path, "w", encoding="utf-8") as checkpoint_fp:
+        json.dump(checkpoint, checkpoint_fp)
+    os.replace(tmp_checkpoint_path, checkpoint_path)
+
+
+def log_padding_efficiency(padding_stats: Dict[str, int]) -> None:
+    """Logs the padding efficiency of batched predictions, i.e. the number of
+    real tokens divided by the number of computed tokens, including padding.
+
+    Args:
+        padding_stats (Dict[str, int]): Dictionary with keys "real_tokens"
+        and "computed_tokens", as in BasePipeline.padding_stats.
+    """
+    if padding_stats["computed_tokens"]:
+        logger.info(
+            "Padding efficiency: {:.3f} ({} real tokens / {} computed tokens)".format(
+                padding_stats["real_tokens"] / padding_stats["computed_tokens"],
+                padding_stats["real_tokens"],
+                padding_stats["computed_tokens"],
+            )
+        )
+
+
+def predict_stream(
+    pipeline: Union[TextClassificationPipeline, TokenClassificationPipeline, CascadePipeline],
+    input_file: str,
+    batch_size: int,
+    resume: bool,
+) -> str:
+    """Runs batched predictions over an input file, reading it lazily and
+    writing one json line per input line, as {"line": ix, "predictions": [...]}.
+    Memory stays flat regardless of the input size. After each batch, the
+    output is flushed and a checkpoint with the line index and byte offsets is
+    saved, so that an interrupted run can be resumed where it stopped.
+
+    Args:
+        pipeline (Union[TextClassificationPipeline,
+        TokenClassificationPipeline, CascadePipeline]): Instance of
+        "full" pipeline.
+        input_file (str): Path to the input file, with one text per line.
+        batch_size (int): Number of lines run through the model at once.
+        resume (bool): Whether to resume from the last checkpoint, instead of
+        starting over.
+
+    Returns:
+        str: Path to the output jsonl file.
+    """
+    out_jsonl_file_path = os.path.splitext(input_file)[0] + ".jsonl"
+    checkpoint_path = out_jsonl_file_path + ".ckpt"
+
+    # Nothing to resume from without previous output
+    resume = resume and os.path.isfile(out_jsonl_file_path)
+    if resume:
+        checkpoint = load_checkpoint(checkpoint_path)
+        logger.info("Resuming from line {}".format(checkpoint["line"]))
+    else:
+        checkpoint = dict(INITIAL_CHECKPOINT)
+
+    with open(input_file, "rb") as in_fp, open(
+        out_jsonl_file_path, "r+b" if resume else "wb"
+    ) as out_fp:
+        # Drop output written after the checkpoint, which may be incomplete
+        in_fp.seek(checkpoint["input_offset"])
+        out_fp.seek(checkpoint["output_offset"])
+        out_fp.truncate()
+
+        progress_bar = tqdm(initial=checkpoint["line"], unit="lines")
+        for lines, input_offset in read_batches(in_fp, batch_size):
+            for predictions in pipeline(lines):
+                prediction = {"line": checkpoint["line"], "predictions": predictions}
+                out_fp.write(dumps(prediction) + b"\n")
+                checkpoint["line"] += 1
+            out_fp.flush()
+            os.fsync(out_fp.fileno())
+
+            checkpoint["input_offset"] = input_offset
+            checkpoint["output_offset"] = out_fp.tell()
+            save_checkpoint(checkpoint_path, checkpoint)
+            progress_bar.update(len(lines))
+        progress_bar.close()
+
+    log_padding_efficiency(pipeline.padding_stats)
+
+    return out_jsonl_file_path
+
+
+def memo_hash(
+    config: DictConfig,
+    pipeline: Union[TextClassificationPipeline, TokenClassificationPipeline, CascadePipeline],
+) -> str:
+    """Returns the hash of a model config and of the revision of its models,
+    which keys the predictions in a memo, so that a memo is not reused with
+    other model options (e.g. quantize) or with an updated model.
+
+    Args:
+        config (DictConfig): OmegaConf config.
+        pipeline (Union[TextClassificationPipeline,
+        TokenClassificationPipeline, CascadePipeline]): Instance of
+        "full" pipeline of the config.
+
+    Returns:
+        str: Hex digest of the config and revisions.
+    """
+    models = (
+        [pipeline.small, pipeline.large] if isinstance(pipeline, CascadePipeline) else [pipeline]
+    )
+    revisions = [model_revision(p.pipeline.model) for p in models]
+    return hashlib.sha256(
+        "\0".join([PredictionCache.config_hash(config)] + revisions).encode("utf-8")
+    ).hexdigest()
+
+
+def predict_deduped(
+    pipeline: Union[TextClassificationPipeline, TokenClassificationPipeline, CascadePipeline],
+    input_file: str,
+    batch_size: int,
+    memo: Optional[PredictionCache] = None,
+    config_hash: str = "",
+) -> Tuple[str, Dict[str, float]]:
+    """Runs batched predictions over the unique texts of an input file, and
+    writes one json line per input line, as in predict_stream. Lines are
+    hashed after normalization (as keys of PredictionCache), each unique
+    text is run through the model once, and its predictions are fanned out
+    to every line with the same key. Unique texts are sorted by length
+    before batching, to minimise padding. With a memo, texts found in it
+    are not run through the model, and new predictions are added to it, so
+    that later runs reuse them. Unique texts and their predictions are kept
+    in memory.
+
+    Args:
+        pipeline (Union[TextClassificationPipeline,
+        TokenClassificationPipeline, CascadePipeline]): Instance of
+        "full" pipeline.
+        input_file (str): Path to the input file, with one text per line.
+        batch_size (int): Number of unique texts run through the model at
+        once.
+        memo (Optional[PredictionCache], optional): Persistent store of
+        predictions, reused across runs. Defaults to None.
+        config_hash (str, optional): Hash of the model config and revision,
+        as given by memo_hash, so that the predictions of a memo are only
+        reused with the same model. Defaults to "".
+
+    Returns:
+        Tuple[str, Dict[str, float]]: Path to the output jsonl file, and
+        dictionary with keys "lines", "unique", "memo_hits", "predicted",
+        "dedupe_ratio" (fraction of duplicate lines), "predict_seconds", and
+        "saved_seconds" (estimated from the time per predicted text, or 0
+        when no text was predicted).
+    """
+    out_jsonl_file_path = os.path.splitext(input_file)[0] + ".jsonl"
+
+    # Map each line to the index of its unique text
+    keys: Dict[str, int] = {}
+    texts: List[str] = []
+    line_ids = array("q")
+    with open(input_file, "rb") as in_fp:
+        for lines, _ in read_batches(in_fp, batch_size):
+            for line in lines:
+                key = PredictionCache.key(
+                    pipeline.model, pipeline.pipeline_type, line, config_hash=config_hash
+                )
+                if key not in keys:
+                    keys[key] = len(texts)
+                    texts.append(line)
+                line_ids.append(keys[key])
+
+    predictions: List[Optional[List]] = [None] * len(texts)
+    if memo is not None:
+        for key, memo_predictions in memo.get_many(list(keys)).items():
+            predictions[keys[key]] = memo_predictions
+    memo_hits = len(texts) - predictions.count(None)
+
+    # Run the remaining texts sorted by length, so that batches need little padding
+    missing = sorted(
+        (ix for ix, p in enumerate(predictions) if p is None), key=lambda ix: len(texts[ix])
+    )
+    key_list = list(keys)
+    start = time.perf_counter()
+    for batch_start in tqdm(range(0, len(missing), batch_size), unit="batches"):
+        batch = missing[batch_start : batch_start + batch_size]
+        batch_predictions = cast(
+            List[List[FinalPrediction]], pipeline([texts[ix] for ix in batch])
+        )
+        for ix, text_predictions in zip(batch, batch_predictions):
+            predictions[ix] = text_predictions
+        if memo is not None:
+            memo.set_many({key_list[ix]: p for ix, p in zip(batch, batch_predictions)})
+    predict_seconds = time.perf_counter() - start
+
+    with open(out_jsonl_file_path, "wb") as out_fp:
+        for line_ix, text_ix in enumerate(line_ids):
+            out_fp.write(dumps({"line": line_ix, "predictions": predictions[text_ix]}) + b"\n")
+
+    stats = {
+        "lines": len(line_ids),
+        "unique": len(texts),
+        "memo_hits": memo_hits,
+        "predicted": len(missing),
+        "dedupe_ratio": 1 - len(texts) / len(line_ids) if line_ids else 0.0,
+        "predict_seconds": predict_seconds,
+        "saved_seconds": (
+            predict_seconds / len(missing) * (len(line_ids) - len(missing)) if missing else 0.0
+        ),
+    }
+    logger.info(
+        "Predicted {predicted} of {lines} lines ({unique} unique, {dedupe_ratio:.1%} "
+        "duplicates, {memo_hits} in memo) in {predict_seconds:.1f}s".format(**stats)
+    )
+    # The time saved is only estimated when some texts were predicted
+    if missing:
+        logger.info(
+            "Estimated time saved: {saved_seconds:.1f}s ({:.1f}ms per predicted text)".format(
+                1000 * predict_seconds / len(missing), **stats
+            )
+        )
+    log_padding_efficiency(pipeline.padding_stats)
+
+    return out_jsonl_file_path, stats
+
+
+def shard_byte_ranges(input_file: str, n_shards: int) -> List[Tuple[int, int]]:
+    """Splits a file into contiguous byte ranges of roughly the same size,
+    with each range starting at the beginning of a line.
+
+    Args:
+        input_file (str): Path to the input file.
+        n_shards (int): Number of shards.
+
+    Returns:
+        List[Tuple[int, int]]: List with the (start, end) byte offsets of each
+        shard, in file order. Shards may be empty for files with few lines.
+    """
+    file_size = os.path.getsize(input_file)
+    boundaries = [0]
+    with open(input_file, "rb") as fp:
+        for i in range(1, n_shards):
+            # Move each boundary forward to the start of the next line
+            fp.seek(max(i * file_size // n_shards - 1, boundaries[-1]))
+            fp.readline()
+            boundaries.append(max(min(fp.tell(), file_size), boundaries[-1]))
+    boundaries.append(file_size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def predict_shard(
+    config: Dict,
+    input_file: str,
+    byte_range: Tuple[int, int],
+    out_shard_path: str,
+    batch_size: int,
+    n_threads: int,
+) -> Tuple[int, Dict[str, int]]:
+    """Runs batched predictions over a byte range of an input file, in a
+    worker process, and writes the predictions of each line as a json line.
+
+    Args:
+        config (Dict): Config, as a python dictionary.
+        input_file (str): Path to the input file, with one text per line.
+        byte_range (Tuple[int, int]): Start and end byte offsets of the shard.
+        out_shard_path (str): Path to the shard output file.
+        batch_size (int): Number of lines run through the model at once.
+        n_threads (int): Number of torch intra-op threads of this process.
+
+    Returns:
+        Tuple[int, Dict[str, int]]: Number of predicted lines, and padding
+        stats of the shard's pipeline.
+    """
+    import torch
+
+    # Pin threads, so that processes do not oversubscribe cores
+    torch.set_num_threads(n_threads)
+    torch.set_num_interop_threads(1)
+
+    pipeline = init_pipeline(OmegaConf.create(config))
+
+    n_lines = 0
+    with open(input_file, "rb") as in_fp, open(out_shard_path, "wb") as out_fp:
+        in_fp.seek(byte_range[0])
+        for lines, _ in read_batches(in_fp, batch_size, end_offset=byte_range[1]):
+            for predictions in pipeline(lines):
+                out_fp.write(dumps(predictions) + b"\n")
+            n_lines += len(lines)
+    return n_lines, pipeline.padding_stats
+
+
+def predict_sharded(config: DictConfig, input_file: str, workers: int, batch_size: int) -> str:
+    """Runs batched predictions over an input file with several processes.
+    The file is split into one byte range per process, each process runs its
+    own pipeline with an even share of the cpu cores, and the results are
+    merged into a jsonl file in input order, as in predict_stream.
+
+    Args:
+        config (DictConfig): OmegaConf config.
+        input_file (str): Path to the input file, with one text per line.
+        workers (int): Number of worker processes.
+        batch_size (int): Number of lines run through the model at once.
+
+    Returns:
+        str: Path to the output jsonl file.
+    """
+    out_jsonl_file_path = os.path.splitext(input_file)[0] + ".jsonl"
+    n_threads = max(1, multiprocessing.cpu_count() // workers)
+    byte_ranges = shard_byte_ranges(input_file, workers)
+    out_shard_paths = [
+        "{}.shard{}".format(out_jsonl_file_path, i) for i in range(len(byte_ranges))
+    ]
+    logger.info("Running {} workers with {} threads each".format(workers, n_threads))
+
+    # Spawn, so that workers do not inherit torch state from the parent
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(workers) as pool:
+        shard_stats = pool.starmap(
+            predict_shard,
+            [
+                (
+                    OmegaConf.to_container(config),
+                    input_file,
+                    byte_range,
+                    out_shard_path,
+                    batch_size,
+                    n_threads,
+                )
+                for byte_range, out_shard_path in zip(byte_ranges, out_shard_paths)
+            ],
+        )
+    logger.info("Predicted {} lines per shard".format([n_lines for n_lines, _ in shard_stats]))
+    log_padding_efficiency(
+        {
+            key: sum(padding_stats[key] for _, padding_stats in shard_stats)
+            for key in ["real_tokens", "computed_tokens"]
+        }
+    )
+
+    # Merge shards in input order
+    line_ix = 0
+    with open(out_jsonl_file_path, "w", encoding="utf-8") as out_fp:
+        for out_shard_path in out_shard_paths:
+            with open(out_shard_path, encoding="utf-8") as shard_fp:
+                for predictions in shard_fp:
+                    out_fp.write(
+                        '{{"line": {}, "predictions": {}}}\n'.format(
+                            line_ix, predictions.rstrip("\n")
+                        )
+                    )
+                    line_ix += 1
+            os.remove(out_shard_path)
+
+    return out_jsonl_file_path
+
+
+def main(
+    config: DictConfig,
+    input_file: str,
+    stream: bool = False,
+    batch_size: int = 32,
+    resume: bool = False,
+    workers: int = 1,
+    dedupe: bool = False,
+    memo_path: Optional[str] = None,
+):
+
+    # Shard predictions across processes, each with its own pipeline
+    if workers > 1:
+        predict_sharded(config, input_file, workers=workers, batch_size=batch_size)
+        return
 
     # Initialize pipeline
     pipeline = init_pipeline(config)
 
+    # Run each unique text once, and fan its predictions out to a jsonl file
+    if dedupe:
+        memo = None
+        if memo_path is not None:
+            memo = PredictionCache(memo_path, max_entries=sys.maxsize, ttl_seconds=float("inf"))
+        predict_deduped(
+            pipeline,
+            input_file,
+            batch_size=batch_size,
+            memo=memo,
+            config_hash=memo_hash(config, pipeline) if memo is not None else "",
+        )
+        return
+
+    # Stream batched predictions to a jsonl file
+    if stream:
+        predict_stream(pipeline, input_file, batch_size=batch_size, resume=resume)
+        return
+
     # Get all predictions for a given input file
     predictions = {}
     for ix, line in tqdm(enumerate(open(input_file))):
@@ -24,14 +483,52 @@ def main(config: DictConfig, input_file: str):
 
     # Save predictions to json file
     out_json_file_path = os.path.splitext(input_file)[0] + ".json"
-    with open(out_json_file_path, "w", encoding="utf-8") as out_fp:
-        json.dump(predictions, out_fp, ensure_ascii=False, indent=4)
+    with open(out_json_file_path, "wb") as out_fp:
+        out_fp.write(dumps(predictions, indent=True))
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("config_path", type=str)
     parser.add_argument("input_file", type=str)
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Read the input lazily, and write batched predictions to a jsonl file",
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=32,
+        help="Number of lines per batch, with --stream, --dedupe, or --workers",
+    )
+    parser.add_argument(
+        "--resume", action="store_true", help="Resume from the last checkpoint, with --stream"
+    )
+    parser.add_argument(
+        "--bucketing",
+        action="store_true",
+        help="Sort each batch by token length, and run it in sub-batches of similar lengths, "
+        "with --stream, --dedupe, or --workers",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes, each predicting a shard of the input into a jsonl file",
+    )
+    parser.add_argument(
+        "--dedupe",
+        action="store_true",
+        help="Run each unique (normalized) line once, and write batched predictions to a jsonl "
+        "file",
+    )
+    parser.add_argument(
+        "--memo",
+        type=str,
+        default=None,
+        help="Path to a SQLite file of predictions reused across runs, with --dedupe",
+    )
     args = parser.parse_args()
 
     # Assert that files exist
@@ -41,8 +538,25 @@ if __name__ == "__main__":
     if not os.path.isfile(args.input_file):
         raise ValueError(('input_file "{}" does not exist').format(args.input_file))
 
+    if args.workers < 1:
+        raise ValueError("workers must be at least 1")
+
+    if args.workers > 1 and args.resume:
+        raise ValueError("resume is not supported with more than one worker")
+
+    if args.dedupe and (args.workers > 1 or args.stream or args.resume):
+        raise ValueError("dedupe is not supported with more than one worker, stream, or resume")
+
+    if args.memo is not None and not args.dedupe:
+        raise ValueError("memo is only supported with dedupe")
+
+    # Lines are predicted one at a time otherwise, so there is nothing to bucket
+    if args.bucketing and not (args.stream or args.dedupe or args.workers > 1):
+        raise ValueError(
+            "bucketing is only supported with stream, dedupe, or more than one worker"
+        )
+
     # Set logger
-    logger = logging.getLogger("logger")
     log_formatter = logging.Formatter("[%(asctime)s] - %(name)s - %(levelname)s - %(message)s")
 
     # Set logger - console handler
@@ -54,6 +568,17 @@ if __name__ == "__main__":
     logger.setLevel(logging.DEBUG)
 
     # Read config
-    config = OmegaConf.load(args.config_path)
+    config = cast(DictConfig, OmegaConf.load(args.config_path))
+    if args.bucketing:
+        OmegaConf.update(config, "bucketing.enabled", True)
 
-    main(config=config, input_file=args.input_file)
+    main(
+        config=config,
+        input_file=args.input_file,
+        stream=args.stream,
+        batch_size=args.batch_size,
+        resume=args.resume,
+        workers=args.workers,
+        dedupe=args.dedupe,
+        memo_path=args.memo,
+    )
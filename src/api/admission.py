@@ -0,0 +1,201 @@
+import asyncio
+from contextlib import contextmanager
+from typing import Any, Awaitable, Iterator, List, Optional
+
+from fastapi import HTTPException, Request
+
+from src.metrics import QUEUED_TEXTS, REJECTED_REQUESTS, TRUNCATED_TEXTS
+
+# Header with the time budget of a request, in milliseconds since its arrival
+DEADLINE_HEADER = "X-Deadline-Ms"
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_queued_texts: Optional[int] = 512,
+        retry_after_seconds: int = 1,
+        default_deadline_ms: Optional[float] = None,
+        max_text_chars: Optional[int] = 100000,
+        truncate_long_texts: bool = False,
+        max_batch_texts: Optional[int] = 1024,
+        max_stream_texts: Optional[int] = 100000,
+    ):
+        """Initializes an instance of AdmissionController. It bounds the work
+        a worker accepts: requests are rejected while too many texts are
+        waiting for (or running) inference, inference that is still waiting
+        when the deadline of its request passes is dropped, and pathological
+        inputs are rejected (or truncated) before tokenization.
+
+        Args:
+            max_queued_texts (Optional[int], optional): Maximum number of
+            texts waiting for or running inference in the worker, above which
+            requests are rejected with status code 503. A request is always
+            admitted when nothing is queued. Defaults to 512. None disables
+            the limit.
+            retry_after_seconds (int, optional): Value of the Retry-After
+            header of rejected requests. Defaults to 1.
+            default_deadline_ms (Optional[float], optional): Time budget of
+            requests without a DEADLINE_HEADER, in milliseconds. Defaults to
+            None, i.e. no deadline.
+            max_text_chars (Optional[int], optional): Maximum number of
+            characters per text. Defaults to 100000. None disables the limit.
+            truncate_long_texts (bool, optional): Whether to truncate longer
+            texts to max_text_chars, instead of rejecting them with status
+            code 413. Defaults to False.
+            max_batch_texts (Optional[int], optional): Maximum number of texts
+            per batch request, above which it is rejected with status code
+            413. Defaults to 1024. None disables the limit.
+            max_stream_texts (Optional[int], optional): Maximum number of
+            texts per streamed batch request, as max_batch_texts. Defaults to
+            100000. None disables the limit.
+        """
+        self.max_queued_texts = max_queued_texts
+        self.retry_after_seconds = retry_after_seconds
+        self.default_deadline_ms = default_deadline_ms
+        self.max_text_chars = max_text_chars
+        self.truncate_long_texts = truncate_long_texts
+        self.max_batch_texts = max_batch_texts
+        self.max_stream_texts = max_stream_texts
+
+        # Number of texts waiting for or running inference
+        self.queued_texts = 0
+
+    def limit_texts(self, texts: List[str], stream: bool = False) -> List[str]:
+        """Checks the number and length of input texts, before tokenization.
+
+        Args:
+            texts (List[str]): Input texts of a request.
+            stream (bool, optional): Whether the texts are a streamed batch,
+            limited to max_stream_texts texts instead of max_batch_texts.
+            Defaults to False.
+
+        Raises:
+            HTTPException: Raises error with status code 413 when there are
+            more than max_batch_texts (or max_stream_texts) texts, or a text
+            is longer than max_text_chars characters and truncate_long_texts
+            is False.
+
+        Returns:
+            List[str]: Input texts, truncated to max_text_chars characters
+            with truncate_long_texts.
+        """
+        max_texts = self.max_stream_texts if stream else self.max_batch_texts
+        if max_texts is not None and len(texts) > max_texts:
+            REJECTED_REQUESTS.labels("too_many_texts").inc()
+            raise HTTPException(
+                status_code=413, detail="At most {} texts per request".format(max_texts)
+            )
+        if self.max_text_chars is None or all(len(t) <= self.max_text_chars for t in texts):
+            return texts
+        if not self.truncate_long_texts:
+            REJECTED_REQUESTS.labels("text_too_long").inc()
+            raise HTTPException(
+                status_code=413,
+                detail="At most {} characters per text".format(self.max_text_chars),
+            )
+        TRUNCATED_TEXTS.inc(sum(len(t) > self.max_text_chars for t in texts))
+        return [t[: self.max_text_chars] for t in texts]
+
+    def check(self, n_texts: int) -> None:
+        """Checks that the worker has room in its queue for more texts.
+
+        Args:
+            n_texts (int): Number of texts of the request.
+
+        Raises:
+            HTTPException: Raises error with status code 503, and a
+            Retry-After header, when the queue is full.
+        """
+        if (
+            self.max_queued_texts is not None
+            and self.queued_texts > 0
+            and self.queued_texts + n_texts > self.max_queued_texts
+        ):
+            REJECTED_REQUESTS.labels("overloaded").inc()
+            raise HTTPException(
+                status_code=503,
+                detail="Too many queued texts, retry later",
+                headers={"Retry-After": str(self.retry_after_seconds)},
+            )
+
+    @contextmanager
+    def admit(self, n_texts: int, check: bool = True) -> Iterator[None]:
+        """Context manager that counts texts as queued until it exits, and
+        rejects them if the worker already has too many queued texts.
+
+        Args:
+            n_texts (int): Number of texts of the request.
+            check (bool, optional): Whether to reject the texts when the
+            queue is full, as check. Streamed requests are checked once,
+            before the response starts, and their later sub-batches are
+            only counted. Defaults to True.
+
+        Raises:
+            HTTPException: Raises error with status code 503, and a
+            Retry-After header, when the queue is full.
+        """
+        if check:
+            self.check(n_texts)
+        self.queued_texts += n_texts
+        QUEUED_TEXTS.inc(n_texts)
+        try:
+            yield
+        finally:
+            self.queued_texts -= n_texts
+            QUEUED_TEXTS.dec(n_texts)
+
+    def deadline(self, request: Request) -> Optional[float]:
+        """Returns the deadline of a request, from its DEADLINE_HEADER, or
+        default_deadline_ms. Call it when the request arrives, since the time
+        budget starts then.
+
+        Args:
+            request (Request): Starlette request.
+
+        Raises:
+            HTTPException: Raises error with status code 400 when the header
+            is not a positive number.
+
+        Returns:
+            Optional[float]: Deadline, as given by the event loop's time(), or
+            None without deadline.
+        """
+        deadline_ms = request.headers.get(DEADLINE_HEADER, self.default_deadline_ms)
+        if deadline_ms is None:
+            return None
+        try:
+            deadline_ms = float(deadline_ms)
+        except ValueError:
+            deadline_ms = 0
+        if not deadline_ms > 0:
+            raise HTTPException(
+                status_code=400, detail="{} must be a positive number".format(DEADLINE_HEADER)
+            )
+        return asyncio.get_event_loop().time() + deadline_ms / 1000
+
+    async def wait(self, awaitable: Awaitable, deadline: Optional[float]) -> Any:
+        """Waits for an awaitable until a deadline. If the deadline passes
+        first, the awaitable is cancelled, so that queued work it is waiting
+        for is dropped. Work that is already running in the thread pool
+        cannot be interrupted, and runs to completion.
+
+        Args:
+            awaitable (Awaitable): Awaitable with the inference result.
+            deadline (Optional[float]): Deadline, as returned by deadline.
+
+        Raises:
+            HTTPException: Raises error with status code 504 when the
+            deadline passes before the result is ready.
+
+        Returns:
+            Any: Result of the awaitable.
+        """
+        if deadline is None:
+            return await awaitable
+        timeout = deadline - asyncio.get_event_loop().time()
+        try:
+            return await asyncio.wait_for(awaitable, max(timeout, 0))
+        except asyncio.TimeoutError:
+            REJECTED_REQUESTS.labels("deadline_exceeded").inc()
+            raise HTTPException(status_code=504, detail="Deadline exceeded")
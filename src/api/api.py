@@ -1,16 +1,35 @@
+import asyncio
 import logging
 import os
-from typing import Dict, List, Union
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union, cast
 
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse
 from omegaconf import OmegaConf
+from omegaconf.dictconfig import DictConfig
 from pydantic import BaseModel
 
-from src.custom_types import FinalPrediction
-from src.pipelines.utils import init_pipeline
+from src.api.admission import AdmissionController
+from src.api.cache import PredictionCache
+from src.api.coalescing import SingleFlight
+from src.api.executor import InferenceExecutor, cancel_on_disconnect
+from src.api.registry import DEFAULT_MODEL, ModelEntry, ModelRegistry
+from src.api.responses import NDJSONResponse, NumpyJSONResponse
+from src.api.startup import Startup
+from src.custom_types import FinalPrediction, WordToken
+from src.metrics import CONTENT_TYPE_LATEST
+from src.metrics import IN_FLIGHT_REQUESTS
+from src.metrics import REQUEST_SECONDS
+from src.metrics import REQUESTS
+from src.metrics import latest_metrics
+from src.pipelines.cascade import CascadePipeline
 
 app = FastAPI()
 
+# Track the startup phases of the worker, and whether it is ready
+startup = Startup()
+
 # Set logger
 logger = logging.getLogger("logger")
 log_formatter = logging.Formatter("[%(asctime)s] - %(name)s - %(levelname)s - %(message)s")
@@ -23,53 +42,690 @@ logger.addHandler(console_handler)
 # Set logger - logging levels
 logger.setLevel(logging.DEBUG)
 
-# Initialize config
+# Initialize config, from CONFIG_PATH if set
 root_path = os.path.dirname(os.path.abspath(__file__)).split("src")[0]
-config = OmegaConf.load(os.path.join(root_path, "config.yaml"))
+with startup.phase("config"):
+    config_path = os.getenv("CONFIG_PATH", os.path.join(root_path, "config.yaml"))
+    config = cast(DictConfig, OmegaConf.load(config_path))
+
+# Initialize inference executor, shared by all models
+inference_config = config.get("inference", {})
+executor = InferenceExecutor(max_workers=inference_config.get("executor_workers", 1))
+
+# Initialize model registry, with a batching scheduler per model. Models are
+# loaded on startup (see start_up) or on their first request
+registry = ModelRegistry(config, executor=executor)
+
+# With preloading (see gunicorn_conf.py), the root model is loaded now, in the
+# master process, so that workers share its weights
+if os.getenv("PRELOAD_APP", "false").lower() in ("1", "true", "yes"):
+    with startup.phase("load:{}".format(DEFAULT_MODEL)):
+        registry.load(DEFAULT_MODEL)
+
+# Initialize coalescing of identical /predict/ requests in flight
+coalescing_config = config.get("coalescing", {})
+coalescer: Optional[SingleFlight] = None
+if coalescing_config.get("enabled", True):
+    coalescer = SingleFlight()
+
+# Initialize admission control: bounded queue, deadlines and input limits
+admission_config = config.get("admission", {})
+admission = AdmissionController(
+    max_queued_texts=admission_config.get("max_queued_texts", 512),
+    retry_after_seconds=admission_config.get("retry_after_seconds", 1),
+    default_deadline_ms=admission_config.get("default_deadline_ms", None),
+    max_text_chars=admission_config.get("max_text_chars", 100000),
+    truncate_long_texts=admission_config.get("truncate_long_texts", False),
+    max_batch_texts=admission_config.get("max_batch_texts", 1024),
+    max_stream_texts=admission_config.get("max_stream_texts", 100000),
+)
+
+# Define sub-batches of streamed batch predictions
+streaming_config = config.get("streaming", {})
+stream_batch_size = streaming_config.get("batch_size", 32)
+
+# Define warm-up of the worker on startup
+startup_config = config.get("startup", {})
+
+# Initialize prediction cache, shared by all workers on the host. Its SQLite
+# calls run in a dedicated thread, so that they do not block the event loop
+cache_config = config.get("cache", {})
+cache: Optional[PredictionCache] = None
+cache_executor = InferenceExecutor(max_workers=1, thread_name_prefix="cache")
+if cache_config.get("enabled", False):
+    cache = PredictionCache(
+        path=cache_config.get("path", "/dev/shm/hf_pipelines_cache.sqlite"),
+        max_entries=cache_config.get("max_entries", 100000),
+        ttl_seconds=cache_config.get("ttl_seconds", 3600),
+    )
+
+
+@app.on_event("startup")
+async def start_up() -> None:
+    """Loads the root model and warms up the models of startup.warm_up_models
+    in the background, so that the worker answers /healthz meanwhile, and
+    /readyz once they are done."""
+    startup.start(
+        registry,
+        executor,
+        models=startup_config.get("warm_up_models", [DEFAULT_MODEL]),
+        batch_sizes=startup_config.get("warm_up_batch_sizes", [1, 8]),
+        n_tokens=startup_config.get("warm_up_tokens", [16, 128]),
+    )
+
+
+@app.on_event("shutdown")
+def shutdown_executor() -> None:
+    """Cancels the warm-up, if still running, and shuts down the inference
+    and cache executors when the worker stops."""
+    startup.cancel()
+    executor.shutdown()
+    cache_executor.shutdown()
+
+
+@app.middleware("http")
+async def track_requests(request: Request, call_next) -> Response:
+    """Counts requests by endpoint and status code, and observes their
+    latency and the number of requests in flight. Paths that do not match
+    any route are counted as "other", to bound the number of series.
+
+    Args:
+        request (Request): Starlette request.
+        call_next: Next handler of the request.
+
+    Returns:
+        Response: Response of the endpoint.
+    """
+    if request.url.path == "/metrics":
+        return await call_next(request)
+
+    IN_FLIGHT_REQUESTS.inc()
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        IN_FLIGHT_REQUESTS.dec()
+        route = request.scope.get("route")
+        endpoint = route.path if route is not None else "other"
+        REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - start)
+        REQUESTS.labels(endpoint, str(status_code)).inc()
 
-# Initialize pipeline model
-pipeline = init_pipeline(config)
 
 # Define input types
 class PredictInput(BaseModel):
     text: str
+    return_tokens: bool = False
+
+
+class PredictBatchInput(BaseModel):
+    texts: List[str]
+
+
+def check_model(model_name: str) -> None:
+    """Checks that a model is in the registry.
+
+    Args:
+        model_name (str): Name of the model.
+
+    Raises:
+        HTTPException: Raises error with status code 404 when the model is
+        not in the registry.
+    """
+    if model_name not in registry.names():
+        raise HTTPException(status_code=404, detail="Model {} not found".format(model_name))
+
+
+async def run_pipeline(
+    pipeline: Any, texts: List[str]
+) -> Tuple[List[List[FinalPrediction]], List[Optional[str]]]:
+    """Runs a list of texts through a pipeline in the executor, as a single
+    batch.
+
+    Args:
+        pipeline (Any): Instance of "full" pipeline.
+        texts (List[str]): List of input text strings.
+
+    Returns:
+        Tuple[List[List[FinalPrediction]], List[Optional[str]]]: Final
+        predictions of each text, and the model that answered each text, for
+        cascades, or None.
+    """
+    if isinstance(pipeline, CascadePipeline):
+        return await executor.run(pipeline, texts, return_models=True)
+    return await executor.run(pipeline, texts), [None] * len(texts)
+
+
+def split_answered_by(entry: ModelEntry, result: Any) -> Tuple[Any, Optional[str]]:
+    """Splits the result of the batching scheduler of a model into the
+    output of the pipeline and the model that answered, which only cascades
+    return.
+
+    Args:
+        entry (ModelEntry): Loaded model.
+        result (Any): Result of the batching scheduler.
+
+    Returns:
+        Tuple[Any, Optional[str]]: Output of the pipeline, and the model that
+        answered, or None.
+    """
+    if entry.scheduler.return_models:
+        return result[0], result[1]
+    return result, None
+
+
+def to_cached(predictions: List[FinalPrediction], answered_by: Optional[str]) -> Any:
+    """Returns the cached value of the final predictions of a text, which
+    also has the model that answered, for cascades.
+
+    Args:
+        predictions (List[FinalPrediction]): Final predictions of a text.
+        answered_by (Optional[str]): Model that answered, or None.
+
+    Returns:
+        Any: Final predictions, or dictionary with keys "predictions" and
+        "answered_by".
+    """
+    if answered_by is None:
+        return predictions
+    return {"predictions": predictions, "answered_by": answered_by}
+
+
+def from_cached(value: Any) -> Tuple[List[FinalPrediction], Optional[str]]:
+    """Returns the final predictions of a text, and the model that answered,
+    from their cached value, as stored by to_cached.
+
+    Args:
+        value (Any): Cached value.
+
+    Returns:
+        Tuple[List[FinalPrediction], Optional[str]]: Final predictions, and
+        the model that answered, or None.
+    """
+    if isinstance(value, dict):
+        return value["predictions"], value["answered_by"]
+    return value, None
 
 
-@app.post("/predict/")
+@app.post("/predict/", response_class=NumpyJSONResponse)
 async def predict(
     request: PredictInput,
-) -> Dict[str, Union[str, List[FinalPrediction]]]:
+    http_request: Request,
+) -> NumpyJSONResponse:
+    """Returns the predictions of the root model, as /predict/{model_name}.
+
+    Args:
+        request (PredictInput): Pydantic class with text string, and whether
+        to return tokens.
+        http_request (Request): Starlette request, used to detect client
+        disconnects.
+
+    Returns:
+        NumpyJSONResponse: Response with a dictionary (serialized with
+        orjson) with keys "predictions", "type", "model", and, with
+        return_tokens, "tokens".
+    """
+    return await predict_model(DEFAULT_MODEL, request, http_request)
+
+
+@app.post("/predict/{model_name}", response_class=NumpyJSONResponse)
+async def predict_model(
+    model_name: str,
+    request: PredictInput,
+    http_request: Request,
+) -> NumpyJSONResponse:
     """Returns dictionary with a list of final predictions, and information
-    about the type of pipeline and model.
+    about the type of pipeline and model. The model is loaded on its first
+    request. Concurrent requests are grouped into batches by the batching
+    scheduler of the model, and requests identical to one in flight wait for
+    its result instead. Inference runs in the executor, and is dropped from
+    the queue if every client waiting for it disconnects, or its deadline
+    passes. Requests are rejected when the worker has too many queued texts,
+    and long texts are rejected or truncated before tokenization, as set in
+    the admission config. Cached predictions skip inference entirely. When
+    requested, the full-word tokens of the text and their character offsets
+    are also returned, from the same pipeline pass, so that clients do not
+    need to call /tokenize/.
 
     Args:
-        request (PredictInput): Pydantic class with text string.
+        model_name (str): Name of the model in the registry.
+        request (PredictInput): Pydantic class with text string, and whether
+        to return tokens.
+        http_request (Request): Starlette request, used to detect client
+        disconnects.
+
+    Raises:
+        HTTPException: Raises error with status code 404 when the model is
+        not in the registry, 413 when the text is too long, 503 when the
+        worker is overloaded, or 504 when the deadline passes.
 
     Returns:
-        Dict[str, Union[str, List[FinalPrediction]]]: Dictionary with keys
-        "predictions", "type", and "model", with the corresponding values
-        being a list of final predictions, the type of pipeline (e.g. "Text
-        Classification Pipeline"), and model (e.g. "dslim/bert-base-NER").
+        NumpyJSONResponse: Response with a dictionary (serialized with
+        orjson) with keys "predictions", "type", and "model", with the
+        corresponding values being a list of final predictions, the type of
+        pipeline (e.g. "Text Classification Pipeline"), and model (e.g.
+        "dslim/bert-base-NER"). With return_tokens, it also has key "tokens",
+        with a list of dictionaries with keys "word", "start", and "end".
     """
-    output = pipeline(request.text)
-    return {
+    deadline = admission.deadline(http_request)
+    check_model(model_name)
+    (text,) = admission.limit_texts([request.text])
+    async with registry.use(model_name) as entry:
+        pipeline = entry.pipeline
+        key = PredictionCache.key(
+            pipeline.model, pipeline.pipeline_type, text, config_hash=entry.config_hash
+        )
+
+        # Cached predictions have no tokens
+        cached = None
+        if cache and not request.return_tokens:
+            cached = await cache_executor.run(cache.get, key)
+        if cached is not None:
+            output, answered_by = from_cached(cached)
+        else:
+
+            async def infer() -> Any:
+                with admission.admit(1):
+                    result = await entry.scheduler.submit(
+                        text, return_tokens=request.return_tokens
+                    )
+                if cache:
+                    output, answered_by = split_answered_by(entry, result)
+                    predictions = output[0] if request.return_tokens else output
+                    await cache_executor.run(cache.set, key, to_cached(predictions, answered_by))
+                return result
+
+            # Tokens have the character offsets of the text itself, so requests
+            # with tokens are only coalesced with those of the exact same text
+            if coalescer is not None:
+                if request.return_tokens:
+                    inference = coalescer.run((model_name, text, True), infer)
+                else:
+                    inference = coalescer.run((model_name, key, False), infer)
+            else:
+                inference = infer()
+            result = await admission.wait(cancel_on_disconnect(http_request, inference), deadline)
+            output, answered_by = split_answered_by(entry, result)
+            if request.return_tokens:
+                output, tokens = output
+
+    response: Dict[str, Union[str, List[FinalPrediction], List[WordToken]]] = {
         "predictions": output,
         "type": pipeline.pipeline_type,
         "model": pipeline.model,
     }
+    if answered_by is not None:
+        response["answered_by"] = answered_by
+    if request.return_tokens:
+        response["tokens"] = tokens
+    return NumpyJSONResponse(response)
 
 
-@app.post("/tokenize/")
-async def tokenize(request: PredictInput) -> Dict[str, List[str]]:
-    """Returns a dictionary with a list of full-word tokens, using the pipeline
-    tokenizer.
+@app.post("/predict_batch/", response_class=NumpyJSONResponse)
+async def predict_batch(
+    request: PredictBatchInput,
+    http_request: Request,
+) -> NumpyJSONResponse:
+    """Returns the predictions of the root model for a list of texts, as
+    /predict_batch/{model_name}.
+
+    Args:
+        request (PredictBatchInput): Pydantic class with list of text strings.
+        http_request (Request): Starlette request, used to detect client
+        disconnects.
+
+    Returns:
+        NumpyJSONResponse: Response with a dictionary (serialized with orjson)
+        with keys "predictions", "type", and "model".
+    """
+    return await predict_batch_model(DEFAULT_MODEL, request, http_request)
+
+
+@app.post("/predict_batch/{model_name}", response_class=NumpyJSONResponse)
+async def predict_batch_model(
+    model_name: str,
+    request: PredictBatchInput,
+    http_request: Request,
+) -> NumpyJSONResponse:
+    """Returns dictionary with a list of final predictions per input text,
+    and information about the type of pipeline and model. The model is
+    loaded on its first request. All texts are run through the model as a
+    single batch, in the executor. Texts with cached predictions are left
+    out of the batch. Admission control applies as in /predict/{model_name},
+    with every text of the batch counted as queued.
+
+    Args:
+        model_name (str): Name of the model in the registry.
+        request (PredictBatchInput): Pydantic class with list of text strings.
+        http_request (Request): Starlette request, used to detect client
+        disconnects.
+
+    Raises:
+        HTTPException: Raises error with status code 404 when the model is
+        not in the registry, 413 when there are too many texts or a text is
+        too long, 503 when the worker is overloaded, or 504 when the deadline
+        passes.
+
+    Returns:
+        NumpyJSONResponse: Response with a dictionary (serialized with orjson)
+        with keys "predictions", "type", and "model", with the corresponding
+        values being a list with the final predictions of each input text (in
+        the same order), the type of pipeline, and model.
+    """
+    deadline = admission.deadline(http_request)
+    check_model(model_name)
+    texts = admission.limit_texts(request.texts)
+    async with registry.use(model_name) as entry:
+        pipeline = entry.pipeline
+        keys = [
+            PredictionCache.key(
+                pipeline.model, pipeline.pipeline_type, t, config_hash=entry.config_hash
+            )
+            for t in texts
+        ]
+        found = await cache_executor.run(cache.get_many, keys) if cache else {}
+        output: List[Optional[List[FinalPrediction]]] = [None] * len(texts)
+        answered_by: List[Optional[str]] = [None] * len(texts)
+        for ix, key in enumerate(keys):
+            if key in found:
+                output[ix], answered_by[ix] = from_cached(found[key])
+
+        missing = [ix for ix, key in enumerate(keys) if key not in found]
+        if missing:
+            with admission.admit(len(missing)):
+                missing_output, missing_models = await admission.wait(
+                    cancel_on_disconnect(
+                        http_request, run_pipeline(pipeline, [texts[ix] for ix in missing])
+                    ),
+                    deadline,
+                )
+            for ix, predictions, model in zip(missing, missing_output, missing_models):
+                output[ix], answered_by[ix] = predictions, model
+            if cache:
+                await cache_executor.run(
+                    cache.set_many,
+                    {
+                        keys[ix]: to_cached(predictions, model)
+                        for ix, predictions, model in zip(missing, missing_output, missing_models)
+                    },
+                )
+
+    response: Dict[str, Any] = {
+        "predictions": output,
+        "type": pipeline.pipeline_type,
+        "model": pipeline.model,
+    }
+    if isinstance(pipeline, CascadePipeline):
+        response["answered_by"] = answered_by
+    return NumpyJSONResponse(response)
+
+
+async def stream_batch_predictions(
+    model_name: str, texts: List[str], deadline: Optional[float]
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """Yields the final predictions of a list of texts, one sub-batch of
+    stream_batch_size texts at a time, as soon as each sub-batch is done.
+    Texts with cached predictions are left out of the sub-batches. The next
+    sub-batch runs while the current one is sent, and no more than these two
+    sub-batches of predictions are held in memory. If the deadline passes,
+    the stream ends with an error line.
+
+    Args:
+        model_name (str): Name of the model in the registry.
+        texts (List[str]): List of input text strings.
+        deadline (Optional[float]): Deadline of the request, as returned by
+        AdmissionController.deadline.
+
+    Returns:
+        AsyncIterator[List[Dict[str, Any]]]: Async iterator with a list of
+        dictionaries per sub-batch, with keys "index" (of the input text) and
+        "predictions", or, when the stream fails, a single dictionary with
+        keys "error" and "status_code".
+    """
+    async with registry.use(model_name) as entry:
+        pipeline = entry.pipeline
+
+        async def predict_sub_batch(start: int) -> List[Dict[str, Any]]:
+            sub_batch = texts[start : start + stream_batch_size]
+            keys = [
+                PredictionCache.key(
+                    pipeline.model, pipeline.pipeline_type, t, config_hash=entry.config_hash
+                )
+                for t in sub_batch
+            ]
+            found = await cache_executor.run(cache.get_many, keys) if cache else {}
+            results = {key: from_cached(value) for key, value in found.items()}
+            missing = [ix for ix, key in enumerate(keys) if key not in found]
+            if missing:
+                # The stream was checked for room in the queue when admitted
+                with admission.admit(len(missing), check=False):
+                    missing_output, missing_models = await run_pipeline(
+                        pipeline, [sub_batch[ix] for ix in missing]
+                    )
+                missing_results = {
+                    keys[ix]: (predictions, model)
+                    for ix, predictions, model in zip(missing, missing_output, missing_models)
+                }
+                if cache:
+                    await cache_executor.run(
+                        cache.set_many,
+                        {key: to_cached(*result) for key, result in missing_results.items()},
+                    )
+                results.update(missing_results)
+
+            lines = []
+            for ix, key in enumerate(keys):
+                predictions, answered_by = results[key]
+                line: Dict[str, Any] = {"index": start + ix, "predictions": predictions}
+                if answered_by is not None:
+                    line["answered_by"] = answered_by
+                lines.append(line)
+            return lines
+
+        task: Optional[asyncio.Future] = None
+        try:
+            for start in range(0, len(texts), stream_batch_size):
+                if task is None:
+                    task = asyncio.ensure_future(predict_sub_batch(start))
+                lines = await admission.wait(task, deadline)
+                task = None
+                if start + stream_batch_size < len(texts):
+                    task = asyncio.ensure_future(predict_sub_batch(start + stream_batch_size))
+                yield lines
+        except HTTPException as e:
+            yield [{"error": e.detail, "status_code": e.status_code}]
+        finally:
+            if task is not None:
+                task.cancel()
+
+
+@app.post("/predict_batch_stream/", response_class=NDJSONResponse)
+async def predict_batch_stream(
+    request: PredictBatchInput,
+    http_request: Request,
+) -> NDJSONResponse:
+    """Streams the predictions of the root model for a list of texts, as
+    /predict_batch_stream/{model_name}.
+
+    Args:
+        request (PredictBatchInput): Pydantic class with list of text strings.
+        http_request (Request): Starlette request, with the deadline header.
+
+    Returns:
+        NDJSONResponse: Streaming response, with a json line per input text,
+        with keys "index" and "predictions".
+    """
+    return await predict_batch_stream_model(DEFAULT_MODEL, request, http_request)
+
+
+@app.post("/predict_batch_stream/{model_name}", response_class=NDJSONResponse)
+async def predict_batch_stream_model(
+    model_name: str,
+    request: PredictBatchInput,
+    http_request: Request,
+) -> NDJSONResponse:
+    """Streams the final predictions of a list of texts as newline-delimited
+    json, in sub-batches of streaming.batch_size texts, which are sent as
+    soon as they are done, so that the first results arrive before the whole
+    batch is done, and the server does not hold all the predictions. Each
+    line has the index of its input text, and lines come in input order. The
+    model is loaded, and the request admitted, before the response starts.
+    The stream is cancelled when the client disconnects, and ends with a
+    line with keys "error" and "status_code" when the deadline passes.
+
+    Args:
+        model_name (str): Name of the model in the registry.
+        request (PredictBatchInput): Pydantic class with list of text strings.
+        http_request (Request): Starlette request, with the deadline header.
+
+    Raises:
+        HTTPException: Raises error with status code 404 when the model is
+        not in the registry, 413 when there are too many texts or a text is
+        too long, or 503 when the worker is overloaded.
+
+    Returns:
+        NDJSONResponse: Streaming response, with a json line per input text,
+        with keys "index" and "predictions", with the corresponding values
+        being the index of the input text, and its list of final predictions.
+    """
+    deadline = admission.deadline(http_request)
+    check_model(model_name)
+    texts = admission.limit_texts(request.texts, stream=True)
+    admission.check(min(len(texts), stream_batch_size))
+    await registry.get(model_name)
+    return NDJSONResponse(stream_batch_predictions(model_name, texts, deadline))
+
+
+@app.post("/tokenize/", response_class=NumpyJSONResponse)
+async def tokenize(request: PredictInput, http_request: Request) -> NumpyJSONResponse:
+    """Returns a dictionary with a list of full-word tokens, using the
+    tokenizer of the root model. Tokenization runs in the executor, with the
+    admission control of /predict/.
 
     Args:
         request (PredictInput): Pydantic class, with text string.
+        http_request (Request): Starlette request, used to detect client
+        disconnects.
+
+    Returns:
+        NumpyJSONResponse: Response with a dictionary (serialized with orjson)
+        with key "tokens", with the corresponding value being a list of
+        tokens.
+    """
+    deadline = admission.deadline(http_request)
+    (text,) = admission.limit_texts([request.text])
+    async with registry.use(DEFAULT_MODEL) as entry:
+        with admission.admit(1):
+            tokens = await admission.wait(
+                cancel_on_disconnect(
+                    http_request, executor.run(entry.pipeline.tokenize_text, text)
+                ),
+                deadline,
+            )
+    return NumpyJSONResponse({"tokens": tokens})
+
+
+@app.post("/tokenize_batch/", response_class=NumpyJSONResponse)
+async def tokenize_batch(request: PredictBatchInput, http_request: Request) -> NumpyJSONResponse:
+    """Returns a dictionary with a list of full-word tokens per input text,
+    using the tokenizer of the root model. All texts are tokenized as a single
+    batch, in the executor, with the admission control of /predict_batch/.
+
+    Args:
+        request (PredictBatchInput): Pydantic class with list of text strings.
+        http_request (Request): Starlette request, used to detect client
+        disconnects.
+
+    Returns:
+        NumpyJSONResponse: Response with a dictionary (serialized with orjson)
+        with key "tokens", with the corresponding value being a list with the
+        tokens of each input text (in the same order).
+    """
+    deadline = admission.deadline(http_request)
+    texts = admission.limit_texts(request.texts)
+    async with registry.use(DEFAULT_MODEL) as entry:
+        with admission.admit(len(texts)):
+            tokens = await admission.wait(
+                cancel_on_disconnect(
+                    http_request, executor.run(entry.pipeline.tokenize_text, texts)
+                ),
+                deadline,
+            )
+    return NumpyJSONResponse({"tokens": tokens})
+
+
+@app.get("/cache_stats/")
+async def cache_stats() -> Dict[str, Union[bool, int, None]]:
+    """Returns the hit and miss counters of the prediction cache in this
+    worker, and the number of entries shared by all workers.
+
+    Returns:
+        Dict[str, Union[bool, int, None]]: Dictionary with key "enabled", and,
+        when the cache is enabled, keys "hits", "misses", and "entries" (None
+        when the cache cannot be read).
+    """
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **(await cache_executor.run(cache.stats))}
+
+
+@app.get("/models/")
+async def models() -> Dict[str, Union[List[str], float, None]]:
+    """Returns the models in the registry, and those loaded in this worker.
+
+    Returns:
+        Dict[str, Union[List[str], float, None]]: Dictionary with keys
+        "models", "loaded" (from least to most recently used), "memory_mb"
+        (estimated memory of the loaded models), and "memory_budget_mb".
+    """
+    return {
+        "models": registry.names(),
+        "loaded": registry.loaded(),
+        "memory_mb": registry.memory_bytes() / 1024**2,
+        "memory_budget_mb": (
+            registry.memory_budget / 1024**2 if registry.memory_budget is not None else None
+        ),
+    }
+
+
+@app.get("/healthz")
+async def healthz() -> Dict[str, str]:
+    """Returns whether the worker is alive, i.e. its event loop answers
+    requests, even while models are loading.
+
+    Returns:
+        Dict[str, str]: Dictionary with key "status".
+    """
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz() -> JSONResponse:
+    """Returns whether the worker is ready to serve traffic, i.e. the root
+    model is loaded and the startup warm-up is done, together with the time
+    spent in each startup phase so far.
+
+    Returns:
+        JSONResponse: Response with status code 200 when ready, or 503
+        otherwise, and a dictionary with keys "ready", "error" (set when the
+        startup failed), and "startup_seconds".
+    """
+    return JSONResponse(
+        {"ready": startup.ready, "error": startup.error, "startup_seconds": startup.timings},
+        status_code=200 if startup.ready else 503,
+    )
+
+
+@app.get("/metrics")
+async def metrics() -> Response:
+    """Returns the metrics of the API in the Prometheus text format, with the
+    time spent in each stage of a prediction, request counts and latencies,
+    input token lengths, requests in flight, queued texts, and rejected
+    requests. Under gunicorn, metrics are aggregated across all workers.
 
     Returns:
-        Dict[str, List[str]]: Dictionary with key "tokens", with the
-        corresponding value being a list of tokens.
+        Response: Response with the metrics.
     """
-    tokens = pipeline.tokenize_text(request.text)
-    return {"tokens": tokens}
+    return Response(latest_metrics(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,251 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, List, NamedTuple, Optional, Set, Tuple, Union
+
+from src.api.executor import InferenceExecutor
+from src.custom_types import FinalPrediction, WordToken
+from src.metrics import STAGE_SECONDS
+
+# Pipelines are only imported for type checking, so that importing the API
+# does not import transformers, and workers answer health checks sooner
+if TYPE_CHECKING:
+    from src.pipelines.cascade import CascadePipeline
+    from src.pipelines.text_classification_pipeline import TextClassificationPipeline
+    from src.pipelines.token_classification_pipeline import TokenClassificationPipeline
+
+logger = logging.getLogger("logger")
+
+
+class BatchItem(NamedTuple):
+    text: str
+    n_tokens: int
+    return_tokens: bool
+    future: asyncio.Future
+    queued_at: float
+
+
+class BatchScheduler:
+    def __init__(
+        self,
+        pipeline: Union[TextClassificationPipeline, TokenClassificationPipeline, CascadePipeline],
+        executor: Optional[InferenceExecutor] = None,
+        max_batch_size: int = 32,
+        max_batch_tokens: int = 8192,
+        max_wait_ms: float = 5.0,
+        return_models: bool = False,
+    ):
+        """Initializes an instance of BatchScheduler. Requests submitted to
+        the scheduler are queued, grouped into batches, run through the
+        pipeline as a single padded batch, and split back out to each caller.
+
+        Args:
+            pipeline (Union[TextClassificationPipeline,
+            TokenClassificationPipeline, CascadePipeline]): Instance of
+            "full" pipeline.
+            executor (Optional[InferenceExecutor], optional): Executor where
+            batches are run, with up to one batch in flight per executor
+            worker. Defaults to None, which creates a single-worker executor.
+            max_batch_size (int, optional): Maximum number of texts per batch.
+            Defaults to 32.
+            max_batch_tokens (int, optional): Maximum number of padded tokens
+            per batch, i.e. batch size times the longest text in the batch,
+            as estimated by the pipeline's estimate_tokens. A single text
+            longer than the budget is still run on its own. Defaults to 8192.
+            max_wait_ms (float, optional): Maximum time, in milliseconds, that
+            the first request of a batch waits for other requests to arrive.
+            Defaults to 5.0.
+            return_models (bool, optional): Whether the pipeline returns the
+            model that answered each text, as cascades do with return_models,
+            in which case each result comes with it. Defaults to False.
+        """
+        self.pipeline = pipeline
+        self.executor = executor if executor is not None else InferenceExecutor()
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_wait = max_wait_ms / 1000
+        self.return_models = return_models
+
+        # Created lazily, since they must belong to the running event loop
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._running: Set[asyncio.Task] = set()
+
+        # Item taken from the queue that did not fit in the previous batch
+        self._carry_over: Optional[BatchItem] = None
+
+    async def submit(self, text: str, return_tokens: bool = False) -> Union[
+        List[FinalPrediction],
+        Tuple[List[FinalPrediction], List[WordToken]],
+        Tuple[Union[List[FinalPrediction], Tuple[List[FinalPrediction], List[WordToken]]], str],
+    ]:
+        """Queues a text to be run through the pipeline, and waits for the
+        batch it is assigned to.
+
+        Args:
+            text (str): Input text string.
+            return_tokens (bool, optional): Whether to also return the
+            full-word tokens of the text. Defaults to False.
+
+        Returns:
+            Union[List[FinalPrediction], Tuple[List[FinalPrediction],
+            List[WordToken]], Tuple[Union[List[FinalPrediction],
+            Tuple[List[FinalPrediction], List[WordToken]]], str]]: List of
+            dictionaries, each corresponding to a final prediction, and, with
+            return_tokens, the list of tokens. With return_models, the output
+            comes in a tuple, together with the model that answered the text.
+        """
+        loop, queue = self._ensure_started()
+        future = loop.create_future()
+        # Estimated from the length of the text, since tokenizing it here would
+        # block the event loop, and tokenize the text twice
+        n_tokens = self.pipeline.estimate_tokens(text)
+        await queue.put(BatchItem(text, n_tokens, return_tokens, future, time.perf_counter()))
+        return await future
+
+    def close(self) -> None:
+        """Stops the background task that builds and runs batches. Requests
+        that are still queued are not run, so the scheduler should only be
+        closed when no requests are waiting, e.g. when its model is evicted.
+        It starts again on the next submit."""
+        if self._worker is not None and self._loop is not None and not self._loop.is_closed():
+            self._worker.cancel()
+        self._worker = None
+
+    def _ensure_started(self) -> Tuple[asyncio.AbstractEventLoop, asyncio.Queue]:
+        """Starts the background task that builds and runs batches, if it is
+        not already running on the current event loop.
+
+        Returns:
+            Tuple[asyncio.AbstractEventLoop, asyncio.Queue]: Current event
+            loop, and the queue of the background task.
+        """
+        loop = asyncio.get_event_loop()
+        if (
+            self._loop is loop
+            and self._queue is not None
+            and self._worker is not None
+            and not self._worker.done()
+        ):
+            return loop, self._queue
+        queue: asyncio.Queue = asyncio.Queue()
+        slots = asyncio.Semaphore(self.executor.max_workers)
+        self._loop, self._queue = loop, queue
+        self._carry_over = None
+        self._worker = loop.create_task(self._run(loop, queue, slots))
+        return loop, queue
+
+    async def _run(
+        self, loop: asyncio.AbstractEventLoop, queue: asyncio.Queue, slots: asyncio.Semaphore
+    ) -> None:
+        """Builds batches until the event loop is closed. A new batch is only
+        collected once an executor worker is free to run it, so that requests
+        keep accumulating in the queue while all workers are busy.
+
+        Args:
+            loop (asyncio.AbstractEventLoop): Event loop of the task.
+            queue (asyncio.Queue): Queue of submitted items.
+            slots (asyncio.Semaphore): Free executor workers.
+        """
+        while True:
+            await slots.acquire()
+            batch = await self._collect_batch(loop, queue)
+            if batch:
+                task = loop.create_task(self._run_batch(batch, slots))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+            else:
+                slots.release()
+
+    async def _collect_batch(
+        self, loop: asyncio.AbstractEventLoop, queue: asyncio.Queue
+    ) -> List[BatchItem]:
+        """Waits for the first request, and then collects requests until the
+        batch is full, the token budget is exceeded, or the maximum wait time
+        has passed.
+
+        Args:
+            loop (asyncio.AbstractEventLoop): Event loop of the task.
+            queue (asyncio.Queue): Queue of submitted items.
+
+        Returns:
+            List[BatchItem]: Batch of queued items, whose callers are still
+            waiting for a result.
+        """
+        if self._carry_over is not None:
+            first, self._carry_over = self._carry_over, None
+        else:
+            first = await queue.get()
+
+        batch = [first]
+        max_tokens = first.n_tokens
+        deadline = loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            if queue.empty():
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            else:
+                item = queue.get_nowait()
+
+            if item.future.done():
+                continue
+
+            if max(max_tokens, item.n_tokens) * (len(batch) + 1) > self.max_batch_tokens:
+                self._carry_over = item
+                break
+
+            batch.append(item)
+            max_tokens = max(max_tokens, item.n_tokens)
+
+        return [item for item in batch if not item.future.done()]
+
+    async def _run_batch(self, batch: List[BatchItem], slots: asyncio.Semaphore) -> None:
+        """Runs a batch through the pipeline in the executor, and sets the
+        result of each caller's future.
+
+        Args:
+            batch (List[BatchItem]): Batch of queued items.
+            slots (asyncio.Semaphore): Free executor workers, released once
+            the batch has run.
+        """
+        logger.debug("Running batch of {} texts".format(len(batch)))
+        started_at = time.perf_counter()
+        for item in batch:
+            STAGE_SECONDS.labels("queue").observe(started_at - item.queued_at)
+
+        # Tokens are returned for the whole batch if any caller needs them
+        return_tokens = any(item.return_tokens for item in batch)
+        kwargs = {"return_tokens": return_tokens}
+        if self.return_models:
+            kwargs["return_models"] = True
+        try:
+            outputs = await self.executor.run(
+                self.pipeline, [item.text for item in batch], **kwargs
+            )
+        except Exception as e:
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_exception(e)
+            return
+        finally:
+            slots.release()
+
+        models: List[Optional[str]] = [None] * len(batch)
+        if self.return_models:
+            outputs, models = outputs
+        for item, output, model in zip(batch, outputs, models):
+            if return_tokens and not item.return_tokens:
+                output = output[0]
+            if self.return_models:
+                output = (output, model)
+            if not item.future.done():
+                item.future.set_result(output)
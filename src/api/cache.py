@@ -0,0 +1,270 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from typing import Dict, List, Optional
+
+from omegaconf import OmegaConf
+from omegaconf.dictconfig import DictConfig
+
+from src.custom_types import FinalPrediction
+from src.serialization import dumps, loads
+
+logger = logging.getLogger("logger")
+
+# Number of insertions between size-based evictions
+EVICTION_INTERVAL = 100
+
+# Maximum number of keys per query, below SQLite's limit of host parameters
+MAX_QUERY_KEYS = 500
+
+# Config sections that only change how predictions are served, and not the
+# predictions themselves
+SERVING_KEYS = [
+    "registry",
+    "snapshots_dir",
+    "startup",
+    "inference",
+    "batching",
+    "coalescing",
+    "admission",
+    "streaming",
+    "cache",
+]
+
+
+class PredictionCache:
+    def __init__(self, path: str, max_entries: int = 100000, ttl_seconds: float = 3600):
+        """Initializes an instance of PredictionCache. Predictions are stored
+        in a SQLite file, so that all gunicorn workers on a host share the
+        same cache (placing it in /dev/shm keeps it in memory). Entries
+        expire after ttl_seconds, and the oldest entries are evicted once
+        there are more than max_entries. Hit and miss counters are kept in
+        memory, per process, so that reads do not write to the file. Calls
+        block on SQLite, so the API runs them in a dedicated thread.
+
+        Args:
+            path (str): Path to the SQLite file.
+            max_entries (int, optional): Maximum number of cached predictions.
+            Defaults to 100000.
+            ttl_seconds (float, optional): Time, in seconds, after which a
+            cached prediction expires. Defaults to 3600.
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        # Connections cannot be shared with forked processes, so each
+        # process opens its own connection on first use
+        self._connection: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._n_insertions = 0
+
+        # Hits and misses of the current process
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def config_hash(config: DictConfig) -> str:
+        """Returns a hash of the options of a model config that can change its
+        predictions (e.g. model, backend, quantize, windowing), i.e. without
+        the SERVING_KEYS sections.
+
+        Args:
+            config (DictConfig): OmegaConf config of the model.
+
+        Returns:
+            str: Hex digest of the config.
+        """
+        options = OmegaConf.to_container(
+            OmegaConf.masked_copy(
+                config, [str(k) for k in config.keys() if k not in SERVING_KEYS]
+            ),
+            resolve=True,
+        )
+        return hashlib.sha256(dumps(options, sort_keys=True)).hexdigest()
+
+    @staticmethod
+    def key(model: str, pipeline_type: str, text: str, config_hash: str = "") -> str:
+        """Returns the cache key of a text. For text classification, the text
+        is normalized by collapsing whitespace, since it does not change the
+        prediction. For token classification, the text is used as is, since
+        predictions include character offsets.
+
+        Args:
+            model (str): Model name.
+            pipeline_type (str): Type of pipeline.
+            text (str): Input text string.
+            config_hash (str, optional): Hash of the model config, as returned
+            by config_hash, so that models with different options do not
+            share predictions. Defaults to "".
+
+        Returns:
+            str: Hex digest identifying the (model, pipeline, text, config)
+            quadruplet.
+        """
+        if pipeline_type == "Text Classification Pipeline":
+            text = " ".join(text.split())
+        return hashlib.sha256(
+            "\0".join([model, pipeline_type, text, config_hash]).encode("utf-8")
+        ).hexdigest()
+
+    def get(self, key: str) -> Optional[List[FinalPrediction]]:
+        """Returns the cached predictions of a key, or None on a miss. Errors
+        accessing the cache are logged and counted as misses.
+
+        Args:
+            key (str): Cache key.
+
+        Returns:
+            Optional[List[FinalPrediction]]: List of dictionaries, each
+            corresponding to a final prediction, or None.
+        """
+        try:
+            connection = self._connect()
+            row = connection.execute(
+                "SELECT value FROM cache WHERE key = ? AND created > ?",
+                (key, time.time() - self.ttl_seconds),
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("Prediction cache read failed: {}".format(e))
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return loads(row[0])
+
+    def set(self, key: str, predictions: List[FinalPrediction]) -> None:
+        """Caches the predictions of a key, and periodically evicts expired
+        entries and the oldest entries above max_entries. Errors accessing the
+        cache are logged and ignored.
+
+        Args:
+            key (str): Cache key.
+            predictions (List[FinalPrediction]): List of dictionaries, each
+            corresponding to a final prediction.
+        """
+        try:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, created) VALUES (?, ?, ?)",
+                    (key, dumps(predictions).decode("utf-8"), time.time()),
+                )
+            self._n_insertions += 1
+            if self._n_insertions % EVICTION_INTERVAL == 0:
+                self.evict()
+        except sqlite3.Error as e:
+            logger.warning("Prediction cache write failed: {}".format(e))
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[FinalPrediction]]:
+        """Returns the cached predictions of several keys, with one query per
+        MAX_QUERY_KEYS keys. Errors accessing the cache are logged, and the
+        remaining keys are counted as misses.
+
+        Args:
+            keys (List[str]): Cache keys.
+
+        Returns:
+            Dict[str, List[FinalPrediction]]: Cached predictions by key, for
+            the keys that were found.
+        """
+        found: Dict[str, List[FinalPrediction]] = {}
+        keys = list(dict.fromkeys(keys))
+        try:
+            connection = self._connect()
+            for start in range(0, len(keys), MAX_QUERY_KEYS):
+                chunk = keys[start : start + MAX_QUERY_KEYS]
+                rows = connection.execute(
+                    "SELECT key, value FROM cache WHERE created > ? AND key IN ({})".format(
+                        ", ".join("?" * len(chunk))
+                    ),
+                    (time.time() - self.ttl_seconds, *chunk),
+                ).fetchall()
+                found.update((key, loads(value)) for key, value in rows)
+        except sqlite3.Error as e:
+            logger.warning("Prediction cache read failed: {}".format(e))
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def set_many(self, predictions: Dict[str, List[FinalPrediction]]) -> None:
+        """Caches the predictions of several keys in a single transaction, as
+        set. Errors accessing the cache are logged and ignored.
+
+        Args:
+            predictions (Dict[str, List[FinalPrediction]]): Predictions by
+            key.
+        """
+        try:
+            connection = self._connect()
+            created = time.time()
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO cache (key, value, created) VALUES (?, ?, ?)",
+                    [(k, dumps(v).decode("utf-8"), created) for k, v in predictions.items()],
+                )
+            n_evictions = self._n_insertions // EVICTION_INTERVAL
+            self._n_insertions += len(predictions)
+            if self._n_insertions // EVICTION_INTERVAL > n_evictions:
+                self.evict()
+        except sqlite3.Error as e:
+            logger.warning("Prediction cache write failed: {}".format(e))
+
+    def evict(self) -> None:
+        """Deletes expired entries, and the oldest entries above max_entries."""
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                "DELETE FROM cache WHERE created <= ?", (time.time() - self.ttl_seconds,)
+            )
+            connection.execute(
+                "DELETE FROM cache WHERE key IN "
+                "(SELECT key FROM cache ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def stats(self) -> Dict[str, Optional[int]]:
+        """Returns the number of hits and misses of the current process, and
+        the number of entries of the cache, shared by all processes. Errors
+        accessing the cache are logged, and the entries are then None.
+
+        Returns:
+            Dict[str, Optional[int]]: Dictionary with keys "hits", "misses",
+            and "entries".
+        """
+        entries = None
+        try:
+            entries = self._connect().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        except sqlite3.Error as e:
+            logger.warning("Prediction cache stats failed: {}".format(e))
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+    def _connect(self) -> sqlite3.Connection:
+        """Returns the SQLite connection of the current process, creating it
+        and the cache tables when necessary.
+
+        Returns:
+            sqlite3.Connection: SQLite connection.
+        """
+        if self._connection is not None and self._pid == os.getpid():
+            return self._connection
+
+        # The API uses the cache from a single dedicated thread, one call at
+        # a time, rather than from the event loop
+        connection = sqlite3.connect(self.path, timeout=0.5, check_same_thread=False)
+        # Write-ahead logging lets workers read while another one writes
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=OFF")
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS cache_created ON cache (created)")
+
+        self._connection = connection
+        self._pid = os.getpid()
+        return connection
@@ -0,0 +1,77 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from src.metrics import COALESCED_REQUESTS
+
+
+class InFlightCall:
+    def __init__(self, task: asyncio.Task):
+        """Initializes an instance of InFlightCall, a call shared by all the
+        requests waiting for its result.
+
+        Args:
+            task (asyncio.Task): Task of the call.
+        """
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        """Initializes an instance of SingleFlight. It coalesces concurrent
+        calls with the same key: while a call is in flight, later calls with
+        the same key wait for its result (or exception), instead of starting
+        their own. Results are not kept once the call is done, so this is
+        independent of any result cache."""
+        self._calls: Dict[Hashable, InFlightCall] = {}
+
+    async def run(self, key: Hashable, fn: Callable[[], Awaitable]) -> Any:
+        """Returns the result of fn(), or of the call in flight with the same
+        key. If every caller waiting for a call is cancelled (e.g. all the
+        clients disconnected), the call is cancelled too, so that queued work
+        is dropped.
+
+        Args:
+            key (Hashable): Key of the call, e.g. model and text.
+            fn (Callable[[], Awaitable]): Function without arguments that
+            starts the call.
+
+        Returns:
+            Any: Result of the call.
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = InFlightCall(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+        else:
+            COALESCED_REQUESTS.inc()
+
+        call.waiters += 1
+        try:
+            # Shielded, so that a cancelled caller does not cancel the others
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                self._forget(key, call)
+                call.task.cancel()
+
+    def in_flight(self) -> int:
+        """Returns the number of calls in flight.
+
+        Returns:
+            int: Number of calls.
+        """
+        return len(self._calls)
+
+    def _forget(self, key: Hashable, call: InFlightCall) -> None:
+        """Removes a call, so that later calls with its key start a new one.
+
+        Args:
+            key (Hashable): Key of the call.
+            call (InFlightCall): Call to remove, unless a newer call with the
+            same key replaced it.
+        """
+        if self._calls.get(key) is call:
+            del self._calls[key]
@@ -0,0 +1,82 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable
+
+from fastapi import HTTPException, Request
+
+# Non-standard status code (used by nginx) for requests closed by the client
+CLIENT_CLOSED_REQUEST = 499
+
+
+class InferenceExecutor:
+    def __init__(self, max_workers: int = 1, thread_name_prefix: str = "inference"):
+        """Initializes an instance of InferenceExecutor. It runs synchronous
+        inference calls in a dedicated thread pool, so that the event loop is
+        free to accept connections and answer other requests meanwhile.
+
+        Args:
+            max_workers (int, optional): Number of threads in the pool, i.e.
+            maximum number of concurrent inference calls. Defaults to 1.
+            thread_name_prefix (str, optional): Prefix of the names of the
+            threads. Defaults to "inference".
+        """
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=thread_name_prefix
+        )
+
+    async def run(self, fn: Callable, *args: Any, **kwargs: Any) -> Any:
+        """Runs fn(*args, **kwargs) in the thread pool, and waits for its
+        result.
+
+        Args:
+            fn (Callable): Synchronous function.
+            *args (Any): Positional arguments of fn.
+            **kwargs (Any): Keyword arguments of fn.
+
+        Returns:
+            Any: Value returned by fn.
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    def shutdown(self) -> None:
+        """Shuts down the thread pool, without waiting for running calls."""
+        self.executor.shutdown(wait=False)
+
+
+async def cancel_on_disconnect(
+    request: Request, awaitable: Awaitable, poll_interval: float = 0.1
+) -> Any:
+    """Waits for an awaitable, while polling whether the client is still
+    connected. If the client disconnects first, the awaitable is cancelled,
+    so that queued work it is waiting for is dropped. Work that is already
+    running in the thread pool cannot be interrupted, and runs to completion.
+
+    Args:
+        request (Request): Starlette request.
+        awaitable (Awaitable): Awaitable with the inference result.
+        poll_interval (float, optional): Time, in seconds, between checks of
+        the client connection. Defaults to 0.1.
+
+    Raises:
+        HTTPException: Raises error with status code 499 when the client
+        disconnects before the result is ready.
+
+    Returns:
+        Any: Result of the awaitable.
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                raise HTTPException(
+                    status_code=CLIENT_CLOSED_REQUEST, detail="Client disconnected"
+                )
+    finally:
+        if not task.done():
+            task.cancel()
@@ -1,9 +1,12 @@
 # Copied/Adapted from:
 # https://github.com/tiangolo/uvicorn-gunicorn-docker/blob/master/docker-images/gunicorn_conf.py
 
+import gc
+import glob
 import json
 import multiprocessing
 import os
+from typing import List, Optional
 
 # Define/Read network related variables
 host = os.getenv("HOST", "0.0.0.0")
@@ -19,8 +22,20 @@ workers_per_core = float(os.getenv("WORKERS_PER_CORE", "1"))
 max_workers_str = os.getenv("MAX_WORKERS", None)
 use_max_workers = int(max_workers_str) if max_workers_str else None
 web_concurrency_str = os.getenv("WEB_CONCURRENCY", None)
+threads_per_worker_str = os.getenv("THREADS_PER_WORKER", None)
+use_threads_per_worker = int(threads_per_worker_str) if threads_per_worker_str else None
+pin_workers_str = os.getenv("PIN_WORKERS", "true")
 
-default_web_concurrency = workers_per_core * multiprocessing.cpu_count()
+# Cores this process may run on (e.g. restricted by docker --cpuset-cpus)
+if hasattr(os, "sched_getaffinity"):
+    available_cpus = sorted(os.sched_getaffinity(0))
+else:
+    available_cpus = list(range(multiprocessing.cpu_count()))
+
+default_web_concurrency = workers_per_core * len(available_cpus)
+if use_threads_per_worker:
+    assert use_threads_per_worker > 0
+    default_web_concurrency /= use_threads_per_worker
 if web_concurrency_str:
     web_concurrency = int(web_concurrency_str)
     assert web_concurrency > 0
@@ -29,6 +44,83 @@ else:
     if use_max_workers:
         web_concurrency = min(web_concurrency, use_max_workers)
 
+
+def plan_worker_cpus(
+    cpus: List[int], n_workers: int, threads_per_worker: Optional[int] = None
+) -> List[List[int]]:
+    """Splits cores between workers, e.g. 4 workers with 4 cores each on 16
+    cores, so that torch threads of different workers do not compete for the
+    same cores. Without a number of threads per worker, cores are split
+    evenly, with at least one per worker. When there are more threads than
+    cores, core sets wrap around and are shared.
+
+    Args:
+        cpus (List[int]): Ids of the available cores.
+        n_workers (int): Number of workers.
+        threads_per_worker (Optional[int], optional): Number of torch threads
+        (and cores) per worker. Defaults to None.
+
+    Returns:
+        List[List[int]]: Core ids assigned to each worker.
+    """
+    threads = threads_per_worker or max(1, len(cpus) // n_workers)
+    return [
+        [cpus[(ix * threads + j) % len(cpus)] for j in range(threads)] for ix in range(n_workers)
+    ]
+
+
+def n_core_sets(cpus: List[int], threads_per_worker: Optional[int] = None) -> int:
+    """Returns the number of disjoint core sets of the available cores, i.e.
+    the number of workers that can be pinned without sharing cores.
+
+    Args:
+        cpus (List[int]): Ids of the available cores.
+        threads_per_worker (Optional[int], optional): Number of torch threads
+        (and cores) per worker. Defaults to None, i.e. one core per worker.
+
+    Returns:
+        int: Number of disjoint core sets, at least 1.
+    """
+    return max(1, len(cpus) // (threads_per_worker or 1))
+
+
+# Define CPU layout of workers. Each worker uses as many torch threads as cores
+# in its core set, and is pinned to it, on Linux, unless PIN_WORKERS is false.
+# Pinned workers are capped at the number of disjoint core sets, so that they
+# do not share cores, unless WEB_CONCURRENCY sets them. Either way, it warns
+use_pin_workers = pin_workers_str.lower() in ("1", "true", "yes") and hasattr(
+    os, "sched_setaffinity"
+)
+max_pinned_workers = n_core_sets(available_cpus, use_threads_per_worker)
+if use_pin_workers and web_concurrency > max_pinned_workers:
+    if web_concurrency_str:
+        print(
+            "Warning: {} workers pinned to {} disjoint core sets share cores".format(
+                web_concurrency, max_pinned_workers
+            )
+        )
+    else:
+        print(
+            "Warning: {} workers capped at {} to pin them to disjoint core sets".format(
+                web_concurrency, max_pinned_workers
+            )
+        )
+        web_concurrency = max_pinned_workers
+worker_cpus = plan_worker_cpus(available_cpus, web_concurrency, use_threads_per_worker)
+
+# Define/Read preloading related variables. With preloading, the app (and the
+# model) is loaded once in the master process, and forked workers share its
+# memory pages copy-on-write, instead of each loading their own copy
+preload_app_str = os.getenv("PRELOAD_APP", "false")
+use_preload_app = preload_app_str.lower() in ("1", "true", "yes")
+
+# Define/Read metrics related variables. With a metrics directory, workers
+# write their metrics to files in it, and /metrics aggregates them. It is set
+# by start.sh, since it must be in the environment before the app is imported
+metrics_dir = os.getenv("PROMETHEUS_MULTIPROC_DIR", None)
+if metrics_dir:
+    os.makedirs(metrics_dir, exist_ok=True)
+
 # Define/Read log related variables
 use_loglevel = os.getenv("LOG_LEVEL", "info")
 accesslog_var = os.getenv("ACCESS_LOG", "-")
@@ -43,6 +135,7 @@ bind = use_bind
 errorlog = use_errorlog
 worker_tmp_dir = "/dev/shm"
 accesslog = use_accesslog
+preload_app = use_preload_app
 
 # For debugging and testing
 log_data = {
@@ -54,10 +147,88 @@ log_data = {
     "keepalive": keepalive,
     "errorlog": errorlog,
     "accesslog": accesslog,
+    "preload_app": preload_app,
+    "metrics_dir": metrics_dir,
     # Additional, non-gunicorn variables
     "workers_per_core": workers_per_core,
+    "threads_per_worker": len(worker_cpus[0]),
+    "pin_workers": use_pin_workers,
+    "worker_cpus": worker_cpus,
     "use_max_workers": use_max_workers,
     "host": host,
     "port": port,
 }
 print(json.dumps(log_data))
+
+
+def on_starting(server):
+    """Gunicorn hook, called in the master process when the server starts.
+    Metrics files of previous runs are removed, so that counters start from
+    zero.
+
+    Args:
+        server (gunicorn.arbiter.Arbiter): Gunicorn master process.
+    """
+    if metrics_dir:
+        for path in glob.glob(os.path.join(metrics_dir, "*.db")):
+            os.remove(path)
+
+
+def child_exit(server, worker):
+    """Gunicorn hook, called in the master process when a worker exits. The
+    worker is removed from the live gauges, e.g. requests in flight.
+
+    Args:
+        server (gunicorn.arbiter.Arbiter): Gunicorn master process.
+        worker (gunicorn.workers.base.Worker): Exited worker.
+    """
+    if metrics_dir:
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
+
+
+def pre_fork(server, worker):
+    """Gunicorn hook, called in the master process before forking a worker.
+    The worker is assigned a core set of the CPU layout. Objects created so
+    far (i.e. the preloaded app and model) are moved to the permanent
+    generation of the garbage collector, so that collections in the workers
+    do not write to their memory pages, which would copy them.
+
+    Args:
+        server (gunicorn.arbiter.Arbiter): Gunicorn master process.
+        worker (gunicorn.workers.base.Worker): Worker about to be forked.
+    """
+    # Assign the lowest core set not used by a live worker, so that restarted
+    # workers take over the cores of the worker they replace
+    used_slots = {getattr(w, "cpu_slot", None) for w in server.WORKERS.values()}
+    worker.cpu_slot = min(set(range(len(worker_cpus))) - used_slots, default=0)
+
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    """Gunicorn hook, called in the worker process after forking. It sets the
+    number of torch threads of the worker to the size of its core set, and
+    pins the worker to that core set, unless PIN_WORKERS is false.
+
+    Args:
+        server (gunicorn.arbiter.Arbiter): Gunicorn master process.
+        worker (gunicorn.workers.base.Worker): Forked worker.
+    """
+    import torch
+
+    cpus = worker_cpus[worker.cpu_slot]
+    if use_pin_workers:
+        os.sched_setaffinity(0, set(cpus))
+    torch.set_num_threads(len(cpus))
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Inter-op threads were already started, e.g. by the preloaded app
+        pass
+    server.log.info(
+        "Worker {} using {} torch threads on cores {}{}".format(
+            worker.pid, len(cpus), cpus, " (pinned)" if use_pin_workers else ""
+        )
+    )
@@ -0,0 +1,342 @@
+from __future__ import annotations
+
+import asyncio
+import gc
+import logging
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, List, Optional, Union, cast
+
+from omegaconf import OmegaConf
+from omegaconf.dictconfig import DictConfig
+
+from src.api.batching import BatchScheduler
+from src.api.cache import PredictionCache
+from src.api.executor import InferenceExecutor
+from src.pipelines.cascade import CascadePipeline
+
+# Pipelines (and torch) are imported when the first model loads, so that
+# importing the API does not import transformers
+if TYPE_CHECKING:
+    from src.pipelines.text_classification_pipeline import TextClassificationPipeline
+    from src.pipelines.token_classification_pipeline import TokenClassificationPipeline
+
+logger = logging.getLogger("logger")
+
+# Name of the model given by the root pipeline and model of the config
+DEFAULT_MODEL = "default"
+
+# Options of the root config that are not inherited by the registry models
+REGISTRY_KEYS = ["registry"]
+
+
+def pipeline_memory_bytes(
+    pipeline: Union[TextClassificationPipeline, TokenClassificationPipeline, CascadePipeline],
+) -> int:
+    """Returns an estimate of the memory taken by the model of a pipeline, as
+    the size of its weights (quantized or not), plus the size of its ONNX
+    graph when it runs with ONNX Runtime. A cascade takes the memory of both
+    its models.
+
+    Args:
+        pipeline (Union[TextClassificationPipeline,
+        TokenClassificationPipeline, CascadePipeline]): Instance of "full"
+        pipeline.
+
+    Returns:
+        int: Number of bytes.
+    """
+    import torch
+
+    if isinstance(pipeline, CascadePipeline):
+        return pipeline_memory_bytes(pipeline.small) + pipeline_memory_bytes(pipeline.large)
+
+    def size(value: Any) -> int:
+        if isinstance(value, torch.Tensor):
+            return value.numel() * value.element_size()
+        if isinstance(value, (tuple, list)):
+            return sum(size(v) for v in value)
+        return 0
+
+    n_bytes = sum(size(value) for value in pipeline.pipeline.model.state_dict().values())
+    graph_path = getattr(pipeline.backend, "path", None)
+    if graph_path is not None:
+        n_bytes += os.path.getsize(graph_path)
+    return n_bytes
+
+
+class ModelEntry:
+    def __init__(
+        self,
+        name: str,
+        pipeline: Union[TextClassificationPipeline, TokenClassificationPipeline, CascadePipeline],
+        scheduler: BatchScheduler,
+        config_hash: str = "",
+    ):
+        """Initializes an instance of ModelEntry, a model loaded by the
+        registry, with its own batching scheduler.
+
+        Args:
+            name (str): Name of the model in the registry.
+            pipeline (Union[TextClassificationPipeline,
+            TokenClassificationPipeline, CascadePipeline]): Instance of
+            "full" pipeline.
+            scheduler (BatchScheduler): Batching scheduler of the pipeline.
+            config_hash (str, optional): Hash of the config of the model, as
+            returned by PredictionCache.config_hash, which keys its cached
+            predictions. Defaults to "".
+        """
+        self.name = name
+        self.pipeline = pipeline
+        self.scheduler = scheduler
+        self.config_hash = config_hash
+        self.memory_bytes = pipeline_memory_bytes(pipeline)
+
+        # Number of requests using the model, which is not evicted meanwhile
+        self.in_use = 0
+
+
+class ModelRegistry:
+    def __init__(
+        self,
+        config: DictConfig,
+        executor: Optional[InferenceExecutor] = None,
+    ):
+        """Initializes an instance of ModelRegistry. It serves the root
+        pipeline and model of the config, as DEFAULT_MODEL, and the models
+        listed under registry.models, by name. Each model inherits the root
+        options (e.g. backend, batching), which its entry may override.
+
+        Models are loaded on their first request, in a background thread, and
+        concurrent requests for a model that is loading wait for that single
+        load. When the models loaded exceed registry.memory_budget_mb, the
+        least recently used ones are evicted, except those in use by a
+        request and the most recently used one.
+
+        Args:
+            config (DictConfig): OmegaConf config.
+            executor (Optional[InferenceExecutor], optional): Executor where
+            the batches of every model are run. Defaults to None, which
+            creates a single-worker executor.
+
+        Raises:
+            ValueError: Raises error when a registry model is named
+            DEFAULT_MODEL.
+        """
+        registry_config = config.get("registry", {})
+        budget_mb = registry_config.get("memory_budget_mb", None)
+        self.memory_budget = budget_mb * 1024**2 if budget_mb is not None else None
+        self.executor = executor if executor is not None else InferenceExecutor()
+
+        # Config of each model, i.e. the root config merged with its entry
+        root_config = OmegaConf.masked_copy(
+            config, [str(key) for key in config.keys() if key not in REGISTRY_KEYS]
+        )
+        self.configs: Dict[str, DictConfig] = {DEFAULT_MODEL: root_config}
+        for name, model_config in registry_config.get("models", {}).items():
+            if name == DEFAULT_MODEL:
+                raise ValueError(
+                    "Model name {} is reserved for the root model".format(DEFAULT_MODEL)
+                )
+            self.configs[name] = cast(DictConfig, OmegaConf.merge(root_config, model_config))
+
+        # Loaded models, from least to most recently used
+        self._entries: "OrderedDict[str, ModelEntry]" = OrderedDict()
+
+        # Loads in progress, awaited by every request for the model
+        self._loading: Dict[str, asyncio.Task] = {}
+
+    def names(self) -> List[str]:
+        """Returns the names of the models in the registry.
+
+        Returns:
+            List[str]: List of model names.
+        """
+        return list(self.configs)
+
+    def loaded(self) -> List[str]:
+        """Returns the names of the loaded models, from least to most
+        recently used.
+
+        Returns:
+            List[str]: List of model names.
+        """
+        return list(self._entries)
+
+    def memory_bytes(self) -> int:
+        """Returns the estimated memory taken by the loaded models.
+
+        Returns:
+            int: Number of bytes.
+        """
+        return sum(entry.memory_bytes for entry in self._entries.values())
+
+    def load(self, name: str) -> ModelEntry:
+        """Loads a model synchronously, if it is not loaded yet, e.g. at
+        startup, before the event loop runs.
+
+        Args:
+            name (str): Name of the model.
+
+        Raises:
+            KeyError: Raises error when the model is not in the registry.
+
+        Returns:
+            ModelEntry: Loaded model.
+        """
+        if name not in self.configs:
+            raise KeyError(name)
+        if name not in self._entries:
+            self._add(name, self._init_pipeline(name))
+        return self._touch(name)
+
+    async def get(self, name: str) -> ModelEntry:
+        """Returns a model, and loads it in a background thread if it is not
+        loaded yet. Concurrent calls for a model that is loading wait for the
+        same load.
+
+        Args:
+            name (str): Name of the model.
+
+        Raises:
+            KeyError: Raises error when the model is not in the registry.
+
+        Returns:
+            ModelEntry: Loaded model.
+        """
+        if name not in self.configs:
+            raise KeyError(name)
+        # A model that is evicted right after its load, before this request
+        # resumes, is loaded again
+        while name not in self._entries:
+            task = self._loading.get(name)
+            if task is None:
+                task = asyncio.ensure_future(self._load(name))
+                self._loading[name] = task
+                task.add_done_callback(lambda _: self._loading.pop(name, None))
+            # Shielded, so that a cancelled request does not cancel the load
+            await asyncio.shield(task)
+        return self._touch(name)
+
+    @asynccontextmanager
+    async def use(self, name: str) -> AsyncIterator[ModelEntry]:
+        """Context manager that returns a model, as get, and keeps it from
+        being evicted until the context exits.
+
+        Args:
+            name (str): Name of the model.
+
+        Raises:
+            KeyError: Raises error when the model is not in the registry.
+
+        Yields:
+            ModelEntry: Loaded model.
+        """
+        entry = await self.get(name)
+        entry.in_use += 1
+        try:
+            yield entry
+        finally:
+            entry.in_use -= 1
+            self._evict()
+
+    async def _load(self, name: str) -> None:
+        """Loads a model in a background thread, and adds it to the loaded
+        models.
+
+        Args:
+            name (str): Name of the model.
+        """
+        loop = asyncio.get_event_loop()
+        pipeline = await loop.run_in_executor(None, self._init_pipeline, name)
+        self._add(name, pipeline)
+
+    def _init_pipeline(
+        self, name: str
+    ) -> Union[TextClassificationPipeline, TokenClassificationPipeline, CascadePipeline]:
+        """Initializes the pipeline of a model.
+
+        Args:
+            name (str): Name of the model.
+
+        Returns:
+            Union[TextClassificationPipeline, TokenClassificationPipeline,
+            CascadePipeline]: Instance of "full" pipeline.
+        """
+        from src.pipelines.utils import init_pipeline
+
+        start = time.perf_counter()
+        pipeline = init_pipeline(self.configs[name])
+        logger.info("Loaded model {} in {:.1f}s".format(name, time.perf_counter() - start))
+        return pipeline
+
+    def _add(
+        self,
+        name: str,
+        pipeline: Union[TextClassificationPipeline, TokenClassificationPipeline, CascadePipeline],
+    ) -> None:
+        """Adds a loaded pipeline, with its own batching scheduler, as the
+        most recently used model, and evicts models over the memory budget.
+
+        Args:
+            name (str): Name of the model.
+            pipeline (Union[TextClassificationPipeline,
+            TokenClassificationPipeline, CascadePipeline]): Instance of
+            "full" pipeline.
+        """
+        batching_config = self.configs[name].get("batching", {})
+        scheduler = BatchScheduler(
+            pipeline,
+            executor=self.executor,
+            max_batch_size=batching_config.get("max_batch_size", 32),
+            max_batch_tokens=batching_config.get("max_batch_tokens", 8192),
+            max_wait_ms=batching_config.get("max_wait_ms", 5.0),
+            return_models=isinstance(pipeline, CascadePipeline),
+        )
+        self._entries[name] = ModelEntry(
+            name, pipeline, scheduler, config_hash=PredictionCache.config_hash(self.configs[name])
+        )
+        self._evict()
+
+    def _touch(self, name: str) -> ModelEntry:
+        """Marks a loaded model as the most recently used.
+
+        Args:
+            name (str): Name of the model.
+
+        Returns:
+            ModelEntry: Loaded model.
+        """
+        self._entries.move_to_end(name)
+        return self._entries[name]
+
+    def _evict(self) -> None:
+        """Evicts the least recently used models that are not in use, until
+        the loaded models fit in the memory budget. The most recently used
+        model is never evicted, so a model larger than the budget can still
+        be served."""
+        if self.memory_budget is None:
+            return
+
+        memory_bytes = self.memory_bytes()
+        evicted = []
+        for name, entry in list(self._entries.items())[:-1]:
+            if memory_bytes <= self.memory_budget:
+                break
+            if entry.in_use:
+                continue
+            del self._entries[name]
+            entry.scheduler.close()
+            memory_bytes -= entry.memory_bytes
+            evicted.append(name)
+
+        if evicted:
+            # Free the evicted weights now, rather than at the next collection
+            gc.collect()
+            logger.info(
+                "Evicted models {}, {:.1f}MB of {:.1f}MB budget in use".format(
+                    evicted, memory_bytes / 1024**2, self.memory_budget / 1024**2
+                )
+            )
@@ -0,0 +1,66 @@
+from typing import Any, AsyncIterator, List
+
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from src.metrics import time_stage
+from src.serialization import dumps
+
+
+class NumpyJSONResponse(JSONResponse):
+    """JSON response serialized with orjson, which handles the numpy values
+    of the pipeline outputs directly. Endpoints return it as is, so that
+    FastAPI skips validating and encoding the content with
+    jsonable_encoder."""
+
+    def render(self, content: Any) -> bytes:
+        """Serializes the content of the response.
+
+        Args:
+            content (Any): Response content.
+
+        Returns:
+            bytes: UTF-8 encoded json.
+        """
+        with time_stage("serialize"):
+            return dumps(content)
+
+
+class NDJSONResponse(StreamingResponse):
+    """Streaming response of newline-delimited json, i.e. one json object
+    per line, serialized with orjson. Each chunk of objects is sent as soon
+    as it is produced, so the content is never held in memory as a whole."""
+
+    media_type = "application/x-ndjson"
+
+    def __init__(self, content: AsyncIterator[List[Any]], **kwargs):
+        """Initializes an instance of NDJSONResponse.
+
+        Args:
+            content (AsyncIterator[List[Any]]): Async iterator of chunks,
+            each a list of objects, which are sent together.
+            **kwargs: Arguments of StreamingResponse, e.g. status_code.
+        """
+        super().__init__(self._render_lines(content), **kwargs)
+
+    @staticmethod
+    async def _render_lines(content: AsyncIterator[List[Any]]) -> AsyncIterator[bytes]:
+        """Serializes each chunk of objects as json lines, and closes the
+        content when done, or when the response stops early.
+
+        Args:
+            content (AsyncIterator[List[Any]]): Async iterator of chunks.
+
+        Returns:
+            AsyncIterator[bytes]: Async iterator of UTF-8 encoded json lines,
+            one item per chunk.
+        """
+        try:
+            async for chunk in content:
+                with time_stage("serialize"):
+                    yield b"".join(dumps(obj) + b"\n" for obj in chunk)
+        finally:
+            # Closes the content right away when the client disconnects, so
+            # that work it started is cancelled
+            aclose = getattr(content, "aclose", None)
+            if aclose is not None:
+                await aclose()
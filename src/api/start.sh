@@ -4,4 +4,7 @@ set -e
 GUNICORN_CONF_PATH=src/api/gunicorn_conf.py
 API_MODULE=src.api.api:app
 
+# Directory where workers write their metrics, aggregated by /metrics
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/dev/shm/hf_pipelines_metrics}
+
 exec gunicorn -k uvicorn.workers.UvicornWorker -c "$GUNICORN_CONF_PATH" "$API_MODULE"
\ No newline at end of file
@@ -0,0 +1,103 @@
+import asyncio
+import json
+import logging
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from src.api.executor import InferenceExecutor
+from src.api.registry import DEFAULT_MODEL, ModelRegistry
+
+logger = logging.getLogger("logger")
+
+
+class Startup:
+    def __init__(self):
+        """Initializes an instance of Startup. It tracks the startup of a
+        worker, i.e. the time spent in each phase, and whether the worker is
+        ready to serve traffic."""
+        self.started_at = time.perf_counter()
+        self.timings: Dict[str, float] = {}
+        self.ready = False
+        self.error: Optional[str] = None
+        self.task: Optional[asyncio.Task] = None
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Context manager that records the time spent in a startup phase.
+
+        Args:
+            name (str): Name of the phase, e.g. "load:default".
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = time.perf_counter() - start
+
+    def start(
+        self,
+        registry: ModelRegistry,
+        executor: InferenceExecutor,
+        models: List[str],
+        batch_sizes: List[int],
+        n_tokens: List[int],
+    ) -> None:
+        """Starts warming up the worker in the background, as run, so that
+        the worker answers health checks meanwhile.
+
+        Args:
+            registry (ModelRegistry): Model registry.
+            executor (InferenceExecutor): Executor where warm-up batches run.
+            models (List[str]): Names of the models to warm up.
+            batch_sizes (List[int]): Batch sizes of the warm-up batches.
+            n_tokens (List[int]): Approximate number of tokens per text of
+            the warm-up batches.
+        """
+        self.task = asyncio.ensure_future(
+            self.run(registry, executor, models, batch_sizes, n_tokens)
+        )
+
+    async def run(
+        self,
+        registry: ModelRegistry,
+        executor: InferenceExecutor,
+        models: List[str],
+        batch_sizes: List[int],
+        n_tokens: List[int],
+    ) -> None:
+        """Loads the root model and the models to warm up, if they are not
+        loaded yet, runs the warm-up batches through the latter in the
+        executor, and then marks the worker as ready. Errors are logged, and
+        leave the worker not ready. The time spent in each phase is logged
+        at the end.
+
+        Args:
+            registry (ModelRegistry): Model registry.
+            executor (InferenceExecutor): Executor where warm-up batches run.
+            models (List[str]): Names of the models to warm up.
+            batch_sizes (List[int]): Batch sizes of the warm-up batches.
+            n_tokens (List[int]): Approximate number of tokens per text of
+            the warm-up batches.
+        """
+        try:
+            for name in dict.fromkeys([DEFAULT_MODEL] + list(models)):
+                # Models loaded on import (e.g. with preloading) keep that timing
+                if name not in registry.loaded():
+                    with self.phase("load:{}".format(name)):
+                        await registry.get(name)
+                if name in models:
+                    async with registry.use(name) as entry:
+                        with self.phase("warm_up:{}".format(name)):
+                            await executor.run(entry.pipeline.warm_up, batch_sizes, n_tokens)
+            self.ready = True
+        except Exception as e:
+            self.error = repr(e)
+            logger.exception("Worker startup failed")
+        self.timings["total"] = time.perf_counter() - self.started_at
+        logger.info("Startup timings (seconds): {}".format(json.dumps(self.timings)))
+
+    def cancel(self) -> None:
+        """Cancels the warm-up, if it is still running."""
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
@@ -7,3 +7,6 @@ import numpy as np
 # Pipeline related types
 FinalPrediction = NewType("FinalPrediction", Dict[str, Union[int, float, str]])
 RawPrediction = NewType("RawPrediction", Dict[str, Union[np.int64, np.float64, str]])
+
+# Tokenizer related types
+WordToken = NewType("WordToken", Dict[str, Union[int, str]])
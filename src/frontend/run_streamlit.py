@@ -1,7 +1,7 @@
 import argparse
 import json
 import requests
-from typing import Dict, List, Union
+from typing import Any, Dict, List, Union
 
 import streamlit as st
 from matplotlib import cm
@@ -27,19 +27,22 @@ def text_input() -> str:
     return text_input
 
 
-def get_prediction(url: str, text: str) -> List[Dict[str, Union[int, float, str]]]:
+def get_prediction(url: str, text: str, return_tokens: bool = False) -> Dict[str, Any]:
     """Get prediction by calling the desired API endpoint using the
     user's input.
 
     Args:
         url (str): API's post url.
         text (str): User input string.
+        return_tokens (bool, optional): Whether to request the full-word
+            tokens and their character offsets. Defaults to False.
 
     Returns:
-        FinalPrediction: List of dictionaries, each corresponding
-            to a final prediction.
+        Dict[str, Any]: Response of the API, with the list of final
+            predictions, the pipeline type and model, and, when requested,
+            the tokens.
     """
-    data = json.dumps({"text": text})
+    data = json.dumps({"text": text, "return_tokens": return_tokens})
     response = requests.post(url, data=data)
     json_response = response.json()
     return json_response
@@ -62,7 +65,7 @@ def print_predictions(
     text: str,
     pipeline_type: str,
     predictions: List[Dict[str, Union[int, float, str]]],
-    tokens: List[str],
+    tokens: List[Dict[str, Union[int, str]]],
 ) -> None:
     """Prints each prediction and a prettier version depending on the
     pipeline_type. For the "Token Classification Pipeline" it uses
@@ -73,6 +76,9 @@ def print_predictions(
         pipeline_type (str): Type of pipeline.
         predictions (List[Dict[str, Union[int, float, str]]]):  List of
         dictionaries, each corresponding to a final prediction.
+        tokens (List[Dict[str, Union[int, str]]]): List of dictionaries, each
+        with the "word", "start", and "end" of a full-word token. Only used,
+        and only requested, for the "Token Classification Pipeline".
     """
 
     if predictions:
@@ -80,17 +86,12 @@ def print_predictions(
 
         if pipeline_type == "Token Classification Pipeline":
             # Init spacy's Doc
-            doc = Doc(Vocab(strings=tokens), words=tokens)
+            words = [token["word"] for token in tokens]
+            doc = Doc(Vocab(strings=words), words=words)
 
             # Get ranges mapping
-            starts = {}
-            ends = {}
-            i = -1
-            for ix, token in enumerate(tokens):
-                start = text.find(token, i + 1)
-                i = start
-                starts[start] = ix
-                ends[start + len(token)] = ix
+            starts = {token["start"]: ix for ix, token in enumerate(tokens)}
+            ends = {token["end"]: ix for ix, token in enumerate(tokens)}
 
             # Set entities in spacy's doc, and collect labels
             labels = []
@@ -129,29 +130,31 @@ def print_predictions(
         st.write("No predictions")
 
 
-def main(predict_endpoint: str, tokenize_endpoint: str) -> None:
+def main(predict_endpoint: str) -> None:
     write_header()
     text = text_input()
 
-    pipeline_needs_tokens = ["Token Classification Pipeline"]
-
     if text:
-        prediction_response = get_prediction(predict_endpoint, text)
+        # Tokens are only displayed for token classification, and come from
+        # the same server pass as the predictions. Requests without tokens
+        # can be answered from the prediction cache of the API. The pipeline
+        # type is remembered across reruns, so that it is only guessed once
+        pipeline_type = st.session_state.get("pipeline_type", None)
+        return_tokens = pipeline_type == "Token Classification Pipeline"
+        prediction_response = get_prediction(predict_endpoint, text, return_tokens=return_tokens)
         pipeline_type = prediction_response["type"]
+        st.session_state["pipeline_type"] = pipeline_type
+        if pipeline_type == "Token Classification Pipeline" and not return_tokens:
+            prediction_response = get_prediction(predict_endpoint, text, return_tokens=True)
         predictions = prediction_response["predictions"]
         model = prediction_response["model"]
         print_pipeline_info(pipeline_type=pipeline_type, model=model)
 
-        # Call tokenize endpoint when necessary
-        if pipeline_type in pipeline_needs_tokens:
-            tokenize_response = get_prediction(tokenize_endpoint, text)
-            tokens = tokenize_response["tokens"]
-
         print_predictions(
             text=text,
             pipeline_type=pipeline_type,
             predictions=predictions,
-            tokens=tokens if pipeline_type in pipeline_needs_tokens else None,
+            tokens=prediction_response.get("tokens", []),
         )
 
 
@@ -163,5 +166,4 @@ if __name__ == "__main__":
 
     url_base = "http://{}:{}/{}/"
     predict_endpoint = url_base.format(args.ip, args.port, "predict")
-    tokenize_endpoint = url_base.format(args.ip, args.port, "tokenize")
-    main(predict_endpoint=predict_endpoint, tokenize_endpoint=tokenize_endpoint)
+    main(predict_endpoint=predict_endpoint)
@@ -0,0 +1,107 @@
+import os
+from typing import ContextManager
+
+from prometheus_client import CONTENT_TYPE_LATEST
+from prometheus_client import REGISTRY
+from prometheus_client import CollectorRegistry
+from prometheus_client import Counter
+from prometheus_client import Gauge
+from prometheus_client import Histogram
+from prometheus_client import generate_latest
+from prometheus_client import multiprocess
+
+# Metrics are aggregated across processes (e.g. gunicorn workers) when this
+# environment variable points to a directory shared by all of them. It must
+# be set before prometheus_client is imported, which picks the mode on import
+MULTIPROC_DIR_ENV = "PROMETHEUS_MULTIPROC_DIR"
+MULTIPROCESS = bool(os.getenv(MULTIPROC_DIR_ENV))
+
+# Stages of a prediction, in order:
+# "queue": wait in the batching scheduler queue, until the batch runs.
+# "tokenize": tokenization of the input texts.
+# "windowing": split of long texts into overlapping windows.
+# "forward": padding of each batch, and model forward pass.
+# "postprocess": labels and scores from the logits.
+# "group_entities": grouping of token predictions into entities.
+# "word_tokens": full-word tokens, when requested.
+# "serialize": json encoding of the response.
+STAGES = [
+    "queue",
+    "tokenize",
+    "windowing",
+    "forward",
+    "postprocess",
+    "group_entities",
+    "word_tokens",
+    "serialize",
+]
+
+STAGE_SECONDS = Histogram(
+    "hf_pipelines_stage_seconds",
+    "Time spent in each stage of a prediction, per call",
+    ["stage"],
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+REQUESTS = Counter("hf_pipelines_requests", "Number of API requests", ["endpoint", "status_code"])
+REQUEST_SECONDS = Histogram(
+    "hf_pipelines_request_seconds", "Latency of API requests", ["endpoint"]
+)
+INPUT_TOKENS = Histogram(
+    "hf_pipelines_input_tokens",
+    "Number of tokens of each text run through the model, including special tokens",
+    buckets=(8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096),
+)
+COALESCED_REQUESTS = Counter(
+    "hf_pipelines_coalesced_requests",
+    "Number of /predict/ requests that waited for an identical request in flight",
+)
+IN_FLIGHT_REQUESTS = Gauge(
+    "hf_pipelines_in_flight_requests",
+    "Number of API requests being handled",
+    multiprocess_mode="livesum",
+)
+QUEUED_TEXTS = Gauge(
+    "hf_pipelines_queued_texts",
+    "Number of texts admitted for inference, waiting in a queue or running",
+    multiprocess_mode="livesum",
+)
+# Reasons: "overloaded" (503), "deadline_exceeded" (504), "text_too_long" and
+# "too_many_texts" (413)
+REJECTED_REQUESTS = Counter(
+    "hf_pipelines_rejected_requests", "Number of API requests rejected", ["reason"]
+)
+TRUNCATED_TEXTS = Counter(
+    "hf_pipelines_truncated_texts", "Number of input texts truncated to the maximum length"
+)
+CASCADE_TEXTS = Counter(
+    "hf_pipelines_cascade_texts",
+    'Number of texts answered by each stage of a model cascade, "small" or "large"',
+    ["stage"],
+)
+
+
+def time_stage(stage: str) -> ContextManager:
+    """Returns a context manager that observes the time spent in a stage.
+
+    Args:
+        stage (str): Name of the stage, one of STAGES.
+
+    Returns:
+        ContextManager: Timer of the stage.
+    """
+    return STAGE_SECONDS.labels(stage).time()
+
+
+def latest_metrics() -> bytes:
+    """Returns the current metrics in the Prometheus text format. With a
+    multiprocess directory, the metrics of all processes are aggregated, so
+    that any worker returns the same totals.
+
+    Returns:
+        bytes: Metrics, with content type CONTENT_TYPE_LATEST.
+    """
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
@@ -0,0 +1,333 @@
+import fnmatch
+import hashlib
+import inspect
+import logging
+import os
+import threading
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Union
+
+import numpy as np
+import torch
+from huggingface_hub import try_to_load_from_cache
+from torch.ao.quantization import quantize_dynamic
+from transformers import PreTrainedModel
+
+# ONNX Runtime is only imported with the "onnx" backend, to keep startup fast
+if TYPE_CHECKING:
+    import onnxruntime as ort
+
+logger = logging.getLogger("logger")
+
+# Backends that run the model of a pipeline, selected with "backend" in the config
+BACKENDS = ["torch", "onnx"]
+
+# Quantization modes of the model, selected with "quantize" in the config
+QUANTIZATION_MODES = ["dynamic-int8"]
+
+# ONNX opset of the exported graphs
+ONNX_OPSET = 14
+
+# Files of a local model that define its graph, and are hashed as its revision
+LOCAL_MODEL_FILES = ["config.json", "*.safetensors", "*.bin"]
+
+
+def local_revision(path: str) -> str:
+    """Returns the revision of a model saved in a local directory (e.g. a
+    snapshot), as a hash of its config and weight files, since it has no
+    revision from the HuggingFace Hub.
+
+    Args:
+        path (str): Directory of the model.
+
+    Returns:
+        str: Revision of the model, e.g. "local-1b2c3d4e5f607182".
+    """
+    digest = hashlib.sha256()
+    for filename in sorted(os.listdir(path)):
+        if not any(fnmatch.fnmatch(filename, pattern) for pattern in LOCAL_MODEL_FILES):
+            continue
+        digest.update(filename.encode("utf-8") + b"\0")
+        with open(os.path.join(path, filename), "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return "local-{}".format(digest.hexdigest()[:16])
+
+
+def model_revision(model: PreTrainedModel) -> str:
+    """Returns the revision of a model. Models from the HuggingFace Hub use
+    their commit hash, and models loaded from a local directory (e.g. a
+    snapshot) use a hash of their config and weight files, as given by
+    local_revision.
+
+    Args:
+        model (PreTrainedModel): HuggingFace model.
+
+    Returns:
+        str: Revision of the model, or "local" when it is unknown.
+    """
+    revision = getattr(model.config, "_commit_hash", None)
+    if revision is not None:
+        return revision
+    path = getattr(model, "name_or_path", "")
+    if os.path.isdir(path):
+        return local_revision(path)
+    # Without a commit hash in the config (e.g. with transformers >= 5), the
+    # files of a Hub model are read from the snapshot of its commit in the
+    # HuggingFace cache, which is named after the commit hash
+    try:
+        config_path = try_to_load_from_cache(path, "config.json")
+    except ValueError:
+        # Not a valid Hub model id
+        config_path = None
+    if isinstance(config_path, str):
+        return os.path.basename(os.path.dirname(config_path))
+    return "local"
+
+
+def model_input_names(model: PreTrainedModel, tokenizer_input_names: List[str]) -> List[str]:
+    """Returns the names of the tokenizer outputs that the model takes, in
+    the order of the arguments of its forward method, which is the order in
+    which the exported graph takes them.
+
+    Args:
+        model (PreTrainedModel): HuggingFace model.
+        tokenizer_input_names (List[str]): Names of the model inputs given
+        by the tokenizer, e.g. "input_ids" and "attention_mask".
+
+    Returns:
+        List[str]: Names of the model inputs.
+    """
+    return [
+        name
+        for name in inspect.signature(model.forward).parameters
+        if name in tokenizer_input_names
+    ]
+
+
+class TorchBackend:
+    def __init__(
+        self, model: PreTrainedModel, input_names: List[str], quantize: Optional[str] = None
+    ):
+        """Initializes an instance of TorchBackend, which runs the PyTorch
+        model of a HuggingFace pipeline. With "dynamic-int8" quantization,
+        the weights of the linear layers of the model are quantized to int8
+        in place, and their activations are quantized on the fly, on CPU.
+
+        Args:
+            model (PreTrainedModel): HuggingFace model.
+            input_names (List[str]): Names of the model inputs.
+            quantize (Optional[str], optional): Quantization mode, one of
+            QUANTIZATION_MODES. Defaults to None.
+        """
+        if quantize == "dynamic-int8":
+            model = quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        self.model = model
+        self.input_names = input_names
+
+    def __call__(self, model_inputs: Dict[str, np.ndarray]) -> np.ndarray:
+        """Runs the model over a padded batch, and returns its logits.
+
+        Args:
+            model_inputs (Dict[str, np.ndarray]): Padded model inputs, with
+            one row per text.
+
+        Returns:
+            np.ndarray: Logits, as float32.
+        """
+        inputs = {
+            k: torch.from_numpy(model_inputs[k]).to(self.model.device) for k in self.input_names
+        }
+        with torch.inference_mode():
+            return self.model(**inputs).logits.float().cpu().numpy()
+
+
+class OnnxBackend:
+    def __init__(
+        self,
+        model: PreTrainedModel,
+        input_names: List[str],
+        model_name: str,
+        cache_dir: str,
+        quantize: Optional[str] = None,
+    ):
+        """Initializes an instance of OnnxBackend, which runs the model of a
+        HuggingFace pipeline with ONNX Runtime, on CPU. The model is exported
+        to ONNX on first use, and the graph is cached in cache_dir, so that
+        later runs (and other workers) load it from disk. With "dynamic-int8"
+        quantization, the exported graph is quantized with ONNX Runtime's
+        dynamic quantization, and cached next to it.
+
+        The ONNX Runtime session is only created on the first call, in the
+        process that runs it. Its thread pool does not survive a fork (e.g.
+        with gunicorn's preload_app), and its number of threads follows the
+        torch threads of the process at that point.
+
+        Args:
+            model (PreTrainedModel): HuggingFace model.
+            input_names (List[str]): Names of the model inputs, in the order
+            of the arguments of the model forward method.
+            model_name (str): Name of the model in the HuggingFace Hub, or
+            path to a local model.
+            cache_dir (str): Directory of the exported graphs.
+            quantize (Optional[str], optional): Quantization mode, one of
+            QUANTIZATION_MODES. Defaults to None.
+        """
+        self.input_names = input_names
+        self.path = self.graph_path(model, model_name, cache_dir)
+        if not os.path.exists(self.path):
+            self.export(model, self.path)
+
+        if quantize == "dynamic-int8":
+            fp32_path, self.path = self.path, self.path.replace(".onnx", "-int8.onnx")
+            if not os.path.exists(self.path):
+                self.quantize(fp32_path, self.path)
+
+        self.session: Optional["ort.InferenceSession"] = None
+        self.session_lock = threading.Lock()
+
+    @staticmethod
+    def graph_path(model: PreTrainedModel, model_name: str, cache_dir: str) -> str:
+        """Returns the path of the exported graph of a model. It depends on
+        the model revision, as given by model_revision, so that an updated
+        model is exported again.
+
+        Args:
+            model (PreTrainedModel): HuggingFace model.
+            model_name (str): Name of the model in the HuggingFace Hub, or
+            path to a local model.
+            cache_dir (str): Directory of the exported graphs.
+
+        Returns:
+            str: Path of the graph.
+        """
+        name = model_name.strip(os.sep).replace(os.sep, "--")
+        filename = "{}-opset{}.onnx".format(model_revision(model), ONNX_OPSET)
+        return os.path.join(os.path.expanduser(cache_dir), name, filename)
+
+    def export(self, model: PreTrainedModel, path: str) -> None:
+        """Exports the model to ONNX, with dynamic batch and sequence axes.
+        The graph is traced with a padded batch, so that it keeps the
+        attention mask, and it is written to a temporary file first, so that
+        workers exporting at the same time never read a partial graph.
+
+        Args:
+            model (PreTrainedModel): HuggingFace model.
+            path (str): Path of the graph.
+        """
+        logger.info("Exporting model to ONNX at {}...".format(path))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        dummy_inputs = {k: torch.zeros((2, 8), dtype=torch.long) for k in self.input_names}
+        if "attention_mask" in dummy_inputs:
+            dummy_inputs["attention_mask"][0] = 1
+            dummy_inputs["attention_mask"][1, :4] = 1
+        dynamic_axes = {k: {0: "batch", 1: "sequence"} for k in self.input_names + ["logits"]}
+
+        # The TorchScript exporter is selected explicitly where the exporter can
+        # be chosen (torch >= 2.5), since newer versions default to TorchDynamo
+        kwargs: Dict[str, Any] = {}
+        if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+            kwargs["dynamo"] = False
+
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        was_training = model.training
+        model.eval()
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                tuple(dummy_inputs[k].to(model.device) for k in self.input_names),
+                tmp_path,
+                input_names=self.input_names,
+                output_names=["logits"],
+                dynamic_axes=dynamic_axes,
+                opset_version=ONNX_OPSET,
+                **kwargs,
+            )
+        model.train(was_training)
+        os.replace(tmp_path, path)
+
+    def quantize(self, fp32_path: str, path: str) -> None:
+        """Quantizes the weights of an exported graph to int8, with dynamic
+        quantization of the activations. As with the export, the graph is
+        written to a temporary file first.
+
+        Args:
+            fp32_path (str): Path of the exported graph.
+            path (str): Path of the quantized graph.
+        """
+        from onnxruntime.quantization import QuantType
+        from onnxruntime.quantization import quantize_dynamic as quantize_onnx_dynamic
+
+        logger.info("Quantizing ONNX model at {}...".format(path))
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        quantize_onnx_dynamic(fp32_path, tmp_path, weight_type=QuantType.QInt8)
+        os.replace(tmp_path, path)
+
+    def get_session(self) -> "ort.InferenceSession":
+        """Returns the ONNX Runtime session, creating it on the first call.
+
+        Returns:
+            ort.InferenceSession: ONNX Runtime session of the exported graph.
+        """
+        import onnxruntime as ort
+
+        with self.session_lock:
+            if self.session is None:
+                options = ort.SessionOptions()
+                options.intra_op_num_threads = torch.get_num_threads()
+                options.inter_op_num_threads = 1
+                self.session = ort.InferenceSession(
+                    self.path, sess_options=options, providers=["CPUExecutionProvider"]
+                )
+            return self.session
+
+    def __call__(self, model_inputs: Dict[str, np.ndarray]) -> np.ndarray:
+        """Runs the exported graph over a padded batch, and returns its
+        logits.
+
+        Args:
+            model_inputs (Dict[str, np.ndarray]): Padded model inputs, with
+            one row per text.
+
+        Returns:
+            np.ndarray: Logits, as float32.
+        """
+        inputs = {k: model_inputs[k].astype(np.int64, copy=False) for k in self.input_names}
+        return self.get_session().run(["logits"], inputs)[0]
+
+
+def init_backend(
+    backend: str,
+    model: PreTrainedModel,
+    input_names: List[str],
+    model_name: str,
+    cache_dir: str,
+    quantize: Optional[str] = None,
+) -> Union[TorchBackend, OnnxBackend]:
+    """Returns the backend that runs the model of a pipeline.
+
+    Args:
+        backend (str): Name of the backend, one of BACKENDS.
+        model (PreTrainedModel): HuggingFace model.
+        input_names (List[str]): Names of the model inputs, in the order of
+        the arguments of the model forward method.
+        model_name (str): Name of the model in the HuggingFace Hub, or path
+        to a local model.
+        cache_dir (str): Directory of the exported ONNX graphs.
+        quantize (Optional[str], optional): Quantization mode, one of
+        QUANTIZATION_MODES. Defaults to None.
+
+    Raises:
+        ValueError: If the backend or the quantization mode is not supported.
+
+    Returns:
+        Union[TorchBackend, OnnxBackend]: Backend of the model.
+    """
+    if quantize is not None and quantize not in QUANTIZATION_MODES:
+        raise ValueError(
+            "Quantization {} is not supported, use one of {}".format(quantize, QUANTIZATION_MODES)
+        )
+    if backend == "torch":
+        return TorchBackend(model, input_names, quantize)
+    if backend == "onnx":
+        return OnnxBackend(model, input_names, model_name, cache_dir, quantize)
+    raise ValueError("Backend {} is not supported, use one of {}".format(backend, BACKENDS))
@@ -1,13 +1,19 @@
-from typing import Any, Dict, List, Union
+import copy
+import threading
+from typing import List, Tuple, Union, cast
 
+import numpy as np
 from omegaconf.dictconfig import DictConfig
-from omegaconf.listconfig import ListConfig
+from transformers import BatchEncoding
+from transformers import PreTrainedTokenizerBase
 from transformers import pipeline
 
-from src.custom_types import (
-    FinalPrediction,
-    RawPrediction,
-)
+from src.custom_types import WordToken
+from src.metrics import INPUT_TOKENS
+from src.metrics import time_stage
+from src.pipelines.backends import init_backend
+from src.pipelines.backends import model_input_names
+from src.pipelines.snapshots import snapshot_path
 
 # The task defining which pipeline will be returned. Currently accepted tasks are:
 # "feature-extraction": will return a FeatureExtractionPipeline.
@@ -26,100 +32,280 @@ PIPELINE_TO_TASK_MAP = {
     "TextClassificationPipeline": "sentiment-analysis",
 }
 
+# Average number of characters per token, used to estimate the number of tokens
+# of a text without tokenizing it (about 4 for English text)
+CHARS_PER_TOKEN = 4
+
 
 class BasePipeline:
-    def __init__(self, config: Union[DictConfig, ListConfig]):
+    def __init__(self, config: DictConfig):
         """Initializes an instance of BasePipeline. It initializes an
-        HuggingFace pipeline, and an empty list of numpy keys.
+        HuggingFace pipeline (from the local snapshot of the model, if there
+        is one in config.snapshots_dir), the backend that runs its model
+        (quantized, if set in the config), and the length bucketing options
+        of batched inputs.
 
         Args:
-            config (Union[DictConfig, ListConfig]): OmegaConf config.
+            config (DictConfig): OmegaConf config.
         """
         self.model = config.model
         self.hf_pipeline = config.pipeline
 
-        # Init pipeline
-        self.pipeline = pipeline(task=PIPELINE_TO_TASK_MAP[self.hf_pipeline], model=self.model)
+        # Init pipeline, from the local snapshot of the model if there is one
+        path = snapshot_path(self.model, config.get("snapshots_dir", None))
+        self.pipeline = pipeline(
+            task=PIPELINE_TO_TASK_MAP[self.hf_pipeline], model=path or self.model
+        )
 
-        # Get tokenizer
-        self.tokenizer = self.pipeline.tokenizer
+        # Get tokenizer, with a copy per thread (see tokenizer). Copies are made
+        # from an unused template, since the tokenizer may be in use meanwhile
+        self._thread_tokenizers = threading.local()
+        self._thread_tokenizers.tokenizer = self.pipeline.tokenizer
+        self._tokenizer_template = copy.deepcopy(self.pipeline.tokenizer)
+        self._tokenizer_lock = threading.Lock()
 
         # Get tokenizer prefix
         self.prefix = self.pipeline.tokenizer._tokenizer.decoder.prefix
 
-        # Define numpy keys to be mapped
-        self.np_keys: List[str] = []
+        # Get the special tokens and maximum length of each text, to estimate
+        # the number of tokens of texts (see estimate_tokens)
+        self.num_special_tokens = self.tokenizer.num_special_tokens_to_add()
+        self.max_length = min(
+            self.tokenizer.model_max_length,
+            getattr(self.pipeline.model.config, "max_position_embeddings", 512),
+        )
+
+        # Init model backend, i.e. PyTorch or ONNX Runtime, optionally quantized
+        self.backend_name = config.get("backend", "torch")
+        self.backend = init_backend(
+            self.backend_name,
+            self.pipeline.model,
+            model_input_names(self.pipeline.model, self.tokenizer.model_input_names),
+            self.model,
+            config.get("onnx", {}).get("cache_dir", "~/.cache/hf_pipelines/onnx"),
+            config.get("quantize", None),
+        )
+
+        # Define length bucketing of batched inputs
+        bucketing_config = config.get("bucketing", {})
+        self.bucketing = bucketing_config.get("enabled", False)
+        self.bucket_batch_size = bucketing_config.get("batch_size", 16)
+
+        # Define token counts of batched inputs, to measure padding efficiency
+        self.padding_stats = {"real_tokens": 0, "computed_tokens": 0}
+
+    @property
+    def tokenizer(self) -> PreTrainedTokenizerBase:
+        """Returns the tokenizer of the current thread. Fast tokenizers keep
+        mutable state between calls (e.g. truncation), so threads sharing one
+        (e.g. executor workers, the event loop) would corrupt each other's
+        encodings. The thread that initialized the pipeline uses the tokenizer
+        of the HuggingFace pipeline, and other threads use their own copy of
+        it, made on first use.
+
+        Returns:
+            PreTrainedTokenizerBase: Tokenizer of the current thread.
+        """
+        tokenizer = getattr(self._thread_tokenizers, "tokenizer", None)
+        if tokenizer is None:
+            with self._tokenizer_lock:
+                tokenizer = copy.deepcopy(self._tokenizer_template)
+            self._thread_tokenizers.tokenizer = tokenizer
+        return tokenizer
+
+    def tokenize_text(self, text: Union[str, List[str]]) -> Union[List[str], List[List[str]]]:
+        """Tokenize text into full-word tokens, by slicing the text with the
+        character offsets of each word, as given by the fast tokenizer.
 
-    def tokenize_text(self, text: str) -> List[str]:
-        """Tokenize text, by first getting the input_ids, converting them into
-        tokens, and then joining together the subtokens.
+        Args:
+            text (Union[str, List[str]]): User input text, or list of user
+            input texts, which are tokenized as a batch.
+
+        Returns:
+            Union[List[str], List[List[str]]]: List of tokens, or one list of
+            tokens per input text.
+        """
+        if isinstance(text, str):
+            return cast(List[List[str]], self.tokenize_text([text]))[0]
+        return [
+            [t[start:end] for start, end in spans]
+            for t, spans in zip(text, self._word_spans(text))
+        ]
+
+    def estimate_tokens(self, text: str) -> int:
+        """Returns an estimate of the number of tokens the model will see for
+        a given text, including special tokens and up to the maximum length of
+        the model. It is based on the length of the text, without tokenizing
+        it, so it is cheap enough to run on the event loop.
 
         Args:
             text (str): User input text.
 
         Returns:
-            List[str]: List of tokens.
+            int: Estimated number of tokens.
         """
-        input_ids = self.tokenizer(text)["input_ids"]
-        tokens = self.tokenizer.convert_ids_to_tokens(input_ids, skip_special_tokens=True)
-        # TODO: Make this robust to more models, not only BERT models.
-        string = (" ".join(tokens)).replace(" {}".format(self.prefix), "")
-        return string.split()
+        return min(-(-len(text) // CHARS_PER_TOKEN) + self.num_special_tokens, self.max_length)
 
-    def __call__(self, text: str):
+    def word_tokens(self, texts: List[str]) -> List[List[WordToken]]:
+        """Returns the full-word tokens of each text, together with their
+        character offsets.
+
+        Args:
+            texts (List[str]): List of input text strings.
+
+        Returns:
+            List[List[WordToken]]: List with a list of dictionaries per input
+            text, each with keys "word", "start", and "end".
+        """
+        with time_stage("word_tokens"):
+            return [
+                [
+                    WordToken({"word": text[start:end], "start": start, "end": end})
+                    for start, end in spans
+                ]
+                for text, spans in zip(texts, self._word_spans(texts))
+            ]
+
+    def warm_up(self, batch_sizes: List[int], n_tokens: List[int]) -> None:
+        """Runs a batch of each size, with texts of about each number of
+        tokens, through the pipeline, so that one-off costs (e.g. memory
+        allocation, kernel selection, the ONNX Runtime session) are not paid
+        by the first requests.
+
+        Args:
+            batch_sizes (List[int]): Batch sizes, i.e. number of texts.
+            n_tokens (List[int]): Approximate number of tokens per text.
+        """
+        for batch_size in batch_sizes:
+            for n in n_tokens:
+                self([" ".join(["the"] * max(n - 2, 1))] * batch_size)
+
+    def __call__(self, text: Union[str, List[str]], return_tokens: bool = False):
         """__call__ method to be implemented by subclasses.
 
         Args:
-            text (str): Input text string.
+            text (Union[str, List[str]]): Input text string, or list of input
+            text strings.
+            return_tokens (bool, optional): Whether to also return the
+            full-word tokens of each text. Defaults to False.
 
         Raises:
             NotImplementedError: Method to be implemented by subclasses.
         """
         raise NotImplementedError
 
-    def _map_all_np_keys(self, outputs: List[RawPrediction]) -> List[FinalPrediction]:
-        """Returns list of dictionaries, each corresponding to a final
-        prediction, after mapping numpy types to regular types, when necessary.
+    def padding_efficiency(self) -> float:
+        """Returns the padding efficiency of all batched inputs so far, i.e.
+        the number of real tokens divided by the number of computed tokens,
+        including padding.
+
+        Returns:
+            float: Padding efficiency, between 0 and 1.
+        """
+        if not self.padding_stats["computed_tokens"]:
+            return 1.0
+        return self.padding_stats["real_tokens"] / self.padding_stats["computed_tokens"]
+
+    def _batch_logits(self, encodings: BatchEncoding) -> List[np.ndarray]:
+        """Runs the model backend over a list of tokenized texts as a single
+        padded batch, and returns the logits of each text, without padding.
+        With length bucketing, texts are instead sorted by token length and
+        run in sub-batches of similar lengths, which reduces padding, and the
+        logits are returned in the original order.
 
         Args:
-            outputs (List[RawPrediction]): List of dictionaries, each
-            corresponding to a raw prediction.
+            encodings (BatchEncoding): Unpadded tokenizer outputs of the
+            texts.
 
         Returns:
-            List[FinalPrediction]: List of dictionaries, each corresponding to
-            a final prediction.
+            List[np.ndarray]: Logits of each text, with one row per token for
+            token classification, or a single row for text classification.
         """
-        if not self.np_keys:
-            self.np_keys = self._get_np_keys(outputs[0])
-        if self.np_keys:
-            outputs = [self._map_np_keys(o) for o in outputs]
-        return outputs
+        lengths = [len(ids) for ids in encodings["input_ids"]]
+        order, batch_size = self._batch_order(lengths)
+        for length in lengths:
+            INPUT_TOKENS.observe(length)
+
+        logits: List[np.ndarray] = [np.empty(0)] * len(lengths)
+        for i in range(0, len(order), batch_size):
+            batch = order[i : i + batch_size]
+            with time_stage("forward"):
+                model_inputs = self.tokenizer.pad(
+                    {k: [encodings[k][ix] for ix in batch] for k in self.backend.input_names},
+                    return_tensors="np",
+                )
+                batch_logits = self.backend(dict(model_inputs))
+
+            for row, ix in enumerate(batch):
+                if batch_logits.ndim == 2:
+                    logits[ix] = batch_logits[row]
+                elif self.tokenizer.padding_side == "left":
+                    logits[ix] = batch_logits[row, batch_logits.shape[1] - lengths[ix] :]
+                else:
+                    logits[ix] = batch_logits[row, : lengths[ix]]
+
+        self._update_padding_stats([lengths[ix] for ix in order], batch_size)
+        return logits
 
-    def _get_np_keys(self, dictionary: RawPrediction) -> List[str]:
-        """Returns keys of a dictionary that correspond to numpy types.
+    def _word_spans(self, texts: List[str]) -> List[List[Tuple[int, int]]]:
+        """Returns the character offsets of the full-word tokens of each text.
+        Texts are encoded as a batch by the fast tokenizer, and consecutive
+        subword tokens with the same word id are merged by taking the start of
+        the first one and the end of the last one. Unlike merging on the
+        subword prefix, it does not depend on the tokenizer, and it keeps
+        words that are mapped to the unknown token.
 
         Args:
-            dictionary (RawPrediction): Dictionary with data corresponding to
-            a raw prediction.
+            texts (List[str]): List of input text strings.
 
         Returns:
-            List[str]: List with string keys corresponding to numpy types.
+            List[List[Tuple[int, int]]]: List with a list of (start, end)
+            offsets per input text, one for each word.
         """
-        keys = [k for k, v in dictionary.items() if "numpy" in str(type(v))]
-        return keys
+        # Truncation is disabled explicitly, since the backend tokenizer can
+        # keep the truncation of earlier calls
+        encodings = self.tokenizer(
+            texts, add_special_tokens=False, truncation=False, return_offsets_mapping=True
+        )
+        spans = []
+        for ix, offsets in enumerate(encodings["offset_mapping"]):
+            text_spans: List[Tuple[int, int]] = []
+            previous_word_id = None
+            for word_id, (start, end) in zip(encodings.word_ids(ix), offsets):
+                if word_id is not None and word_id == previous_word_id:
+                    text_spans[-1] = (text_spans[-1][0], end)
+                else:
+                    text_spans.append((start, end))
+                previous_word_id = word_id
+            spans.append(text_spans)
+        return spans
 
-    def _map_np_keys(self, dictionary: RawPrediction) -> FinalPrediction:
-        """Casts values of a dictionary from numpy types to the corresponding
-        regular python types, using numpy's .item() on those values.
+    def _batch_order(self, lengths: List[int]) -> Tuple[List[int], int]:
+        """Returns the order in which batched texts are run, and the number of
+        texts per batch. With length bucketing, texts are sorted by token
+        length and run in sub-batches of bucket_batch_size texts, otherwise
+        they are run in their original order as a single batch.
 
         Args:
-            dictionary (RawPrediction): Dictionary with data corresponding to
-            a raw prediction.
+            lengths (List[int]): Token length of each text.
 
         Returns:
-            FinalPrediction: Dictionary with data corresponding to a final
-            prediction.
+            Tuple[List[int], int]: Indices of the texts in run order, and
+            number of texts per batch.
+        """
+        if self.bucketing:
+            return sorted(range(len(lengths)), key=lambda ix: lengths[ix]), self.bucket_batch_size
+        return list(range(len(lengths))), max(len(lengths), 1)
+
+    def _update_padding_stats(self, lengths: List[int], batch_size: int) -> None:
+        """Adds the real and computed (i.e. padded) token counts of texts run
+        in consecutive batches of batch_size.
+
+        Args:
+            lengths (List[int]): Token length of each text, in run order.
+            batch_size (int): Number of texts per batch.
         """
-        for k in self.np_keys:
-            dictionary[k] = dictionary[k].item()
-        return dictionary
+        for i in range(0, len(lengths), batch_size):
+            batch_lengths = lengths[i : i + batch_size]
+            self.padding_stats["real_tokens"] += sum(batch_lengths)
+            self.padding_stats["computed_tokens"] += max(batch_lengths) * len(batch_lengths)
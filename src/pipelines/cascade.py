@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Dict, List, Tuple, Union, cast
+
+from omegaconf import OmegaConf
+from omegaconf.dictconfig import DictConfig
+
+from src.custom_types import FinalPrediction
+from src.custom_types import WordToken
+from src.metrics import CASCADE_TEXTS
+
+if TYPE_CHECKING:
+    from src.pipelines.text_classification_pipeline import TextClassificationPipeline
+    from src.pipelines.token_classification_pipeline import TokenClassificationPipeline
+
+# Output of a pipeline for a text, i.e. its final predictions, and, with
+# return_tokens, its full-word tokens
+CascadeOutput = Union[List[FinalPrediction], Tuple[List[FinalPrediction], List[WordToken]]]
+
+
+def cascade_configs(config: DictConfig) -> Tuple[DictConfig, DictConfig]:
+    """Returns the configs of the small and large models of a cascade, i.e.
+    the config with cascade.model as model, and the config itself, both
+    without cascade.
+
+    Args:
+        config (DictConfig): OmegaConf config, with cascade enabled.
+
+    Returns:
+        Tuple[DictConfig, DictConfig]: Configs of the small and large
+        models.
+    """
+    large_config = cast(DictConfig, OmegaConf.merge(config, {"cascade": {"enabled": False}}))
+    small_config = cast(DictConfig, OmegaConf.merge(large_config, {"model": config.cascade.model}))
+    return small_config, large_config
+
+
+class CascadePipeline:
+    def __init__(
+        self,
+        small: Union[TextClassificationPipeline, TokenClassificationPipeline],
+        large: Union[TextClassificationPipeline, TokenClassificationPipeline],
+        threshold: float,
+    ):
+        """Initializes an instance of CascadePipeline. Texts are run through
+        a small model first, and only those it is not confident about are run
+        again through a large model. A text is confident when every final
+        prediction has a score of at least threshold, i.e. the top label for
+        text classification, or every entity for token classification.
+
+        Args:
+            small (Union[TextClassificationPipeline,
+            TokenClassificationPipeline]): Pipeline of the small model.
+            large (Union[TextClassificationPipeline,
+            TokenClassificationPipeline]): Pipeline of the large model.
+            threshold (float): Minimum score of the predictions of the small
+            model, below which texts are run through the large model.
+
+        Raises:
+            ValueError: Raises error when the pipelines are of different
+            types.
+        """
+        if small.pipeline_type != large.pipeline_type:
+            raise ValueError(
+                "Cascade models must have the same pipeline, not {} and {}".format(
+                    small.pipeline_type, large.pipeline_type
+                )
+            )
+        self.small = small
+        self.large = large
+        self.threshold = threshold
+        self.pipeline_type = large.pipeline_type
+
+        # Name of the cascade, which keys its predictions in the cache
+        self.model = "{} > {} @ {}".format(small.model, large.model, threshold)
+
+    @property
+    def padding_stats(self) -> Dict[str, int]:
+        """Real and computed token counts of the batched inputs of both
+        models, as in BasePipeline.padding_stats."""
+        return {
+            key: self.small.padding_stats[key] + self.large.padding_stats[key]
+            for key in ["real_tokens", "computed_tokens"]
+        }
+
+    def padding_efficiency(self) -> float:
+        """Returns the padding efficiency of the batched inputs of both
+        models so far.
+
+        Returns:
+            float: Padding efficiency, between 0 and 1.
+        """
+        padding_stats = self.padding_stats
+        if not padding_stats["computed_tokens"]:
+            return 1.0
+        return padding_stats["real_tokens"] / padding_stats["computed_tokens"]
+
+    def tokenize_text(self, text: Union[str, List[str]]) -> Union[List[str], List[List[str]]]:
+        """Tokenize text into full-word tokens, with the small model.
+
+        Args:
+            text (Union[str, List[str]]): User input text, or list of user
+            input texts.
+
+        Returns:
+            Union[List[str], List[List[str]]]: List of tokens, or one list of
+            tokens per input text.
+        """
+        return self.small.tokenize_text(text)
+
+    def estimate_tokens(self, text: str) -> int:
+        """Returns an estimate of the number of tokens the small model will
+        see for a given text, as BasePipeline.estimate_tokens.
+
+        Args:
+            text (str): User input text.
+
+        Returns:
+            int: Estimated number of tokens.
+        """
+        return self.small.estimate_tokens(text)
+
+    def warm_up(self, batch_sizes: List[int], n_tokens: List[int]) -> None:
+        """Warms up both models, as BasePipeline.warm_up.
+
+        Args:
+            batch_sizes (List[int]): Batch sizes, i.e. number of texts.
+            n_tokens (List[int]): Approximate number of tokens per text.
+        """
+        self.small.warm_up(batch_sizes, n_tokens)
+        self.large.warm_up(batch_sizes, n_tokens)
+
+    def is_confident(self, predictions: List[FinalPrediction]) -> bool:
+        """Returns whether the final predictions of a text all have a score
+        of at least threshold. Texts without predictions (e.g. without
+        entities) are confident.
+
+        Args:
+            predictions (List[FinalPrediction]): Final predictions of a text.
+
+        Returns:
+            bool: Whether the predictions are confident.
+        """
+        return all(float(prediction["score"]) >= self.threshold for prediction in predictions)
+
+    def __call__(
+        self, text: Union[str, List[str]], return_tokens: bool = False, return_models: bool = False
+    ) -> Union[
+        CascadeOutput,
+        List[CascadeOutput],
+        Tuple[CascadeOutput, str],
+        Tuple[List[CascadeOutput], List[str]],
+    ]:
+        """Returns the final predictions of the small model for the texts it
+        is confident about, and of the large model for the others, in the
+        same format as the pipelines. The texts run through the large model
+        are run as a single batch.
+
+        Args:
+            text (Union[str, List[str]]): Input text string, or list of input
+            text strings.
+            return_tokens (bool, optional): Whether to also return the
+            full-word tokens of each text, from the model that answered.
+            Defaults to False.
+            return_models (bool, optional): Whether to also return the name
+            of the model that answered each text, which is kept even for
+            texts without predictions. Defaults to False.
+
+        Returns:
+            Union[CascadeOutput, List[CascadeOutput], Tuple[CascadeOutput,
+            str], Tuple[List[CascadeOutput], List[str]]]: List of
+            dictionaries, each corresponding to a final prediction, or one
+            such list per input text. With return_tokens, each list of final
+            predictions comes in a tuple, together with the list of tokens.
+            With return_models, the output comes in a tuple, together with the
+            model that answered the text, or the list of models per text.
+        """
+        texts = [text] if isinstance(text, str) else text
+
+        # Pipelines return one output per text for a list of texts
+        outputs = list(cast(List[CascadeOutput], self.small(texts, return_tokens=return_tokens)))
+        unconfident = [
+            ix
+            for ix, output in enumerate(outputs)
+            if not self.is_confident(
+                cast(List[FinalPrediction], output[0] if return_tokens else output)
+            )
+        ]
+        if unconfident:
+            large_outputs = self.large([texts[ix] for ix in unconfident], return_tokens)
+            for ix, output in zip(unconfident, cast(List[CascadeOutput], large_outputs)):
+                outputs[ix] = output
+
+        models = [self.small.model] * len(texts)
+        for ix in unconfident:
+            models[ix] = self.large.model
+        CASCADE_TEXTS.labels("small").inc(len(texts) - len(unconfident))
+        CASCADE_TEXTS.labels("large").inc(len(unconfident))
+
+        if isinstance(text, str):
+            return (outputs[0], models[0]) if return_models else outputs[0]
+        return (outputs, models) if return_models else outputs
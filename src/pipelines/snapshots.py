@@ -0,0 +1,129 @@
+import argparse
+import logging
+import os
+import time
+from typing import List, Optional, cast
+
+from omegaconf import OmegaConf
+from omegaconf.dictconfig import DictConfig
+
+from src.pipelines.cascade import cascade_configs
+
+logger = logging.getLogger("logger")
+
+
+def snapshot_dir(model: str, snapshots_dir: str) -> str:
+    """Returns the directory of the local snapshot of a model.
+
+    Args:
+        model (str): Name of the model in the HuggingFace Hub.
+        snapshots_dir (str): Directory of the local snapshots.
+
+    Returns:
+        str: Directory of the snapshot, e.g. "dslim--bert-base-NER".
+    """
+    return os.path.join(os.path.expanduser(snapshots_dir), model.replace("/", "--"))
+
+
+def snapshot_path(model: str, snapshots_dir: Optional[str]) -> Optional[str]:
+    """Returns the directory of the local snapshot of a model, if it has
+    been fetched.
+
+    Args:
+        model (str): Name of the model in the HuggingFace Hub.
+        snapshots_dir (Optional[str]): Directory of the local snapshots.
+
+    Returns:
+        Optional[str]: Directory of the snapshot, or None when there is no
+        snapshot of the model.
+    """
+    if snapshots_dir is None:
+        return None
+    path = snapshot_dir(model, snapshots_dir)
+    return path if os.path.exists(os.path.join(path, "config.json")) else None
+
+
+def model_configs(config: DictConfig) -> List[DictConfig]:
+    """Returns the config of each model served with a config, i.e. the root
+    model and the models of the registry, merged with the root options. Each
+    cascade is split into the configs of its small and large models.
+
+    Args:
+        config (DictConfig): OmegaConf config.
+
+    Returns:
+        List[DictConfig]: List of model configs.
+    """
+    root_config = OmegaConf.masked_copy(config, [str(k) for k in config.keys() if k != "registry"])
+    models = config.get("registry", {}).get("models", {})
+    configs: List[DictConfig] = []
+    for model_config in [root_config] + [
+        cast(DictConfig, OmegaConf.merge(root_config, m)) for m in models.values()
+    ]:
+        if model_config.get("cascade", {}).get("enabled", False):
+            configs.extend(cascade_configs(model_config))
+        else:
+            configs.append(model_config)
+    return configs
+
+
+def fetch_snapshot(config: DictConfig) -> str:
+    """Downloads a model from the HuggingFace Hub (or reads it from the
+    HuggingFace cache), and saves the model and its tokenizer as a local
+    snapshot, in config.snapshots_dir. Weights are saved as safetensors
+    (with transformers >= 4.35), which are memory-mapped when loaded. With
+    the "onnx" backend, the model is also exported to ONNX, so that workers
+    start from the cached graph.
+
+    Args:
+        config (DictConfig): OmegaConf config of a model.
+
+    Returns:
+        str: Directory of the snapshot.
+    """
+    from transformers import pipeline
+
+    from src.pipelines.base_pipeline import PIPELINE_TO_TASK_MAP
+    from src.pipelines.utils import init_pipeline
+
+    path = snapshot_dir(config.model, config.snapshots_dir)
+    logger.info("Saving snapshot of {} in {}...".format(config.model, path))
+    hf_pipeline = pipeline(task=PIPELINE_TO_TASK_MAP[config.pipeline], model=config.model)
+    hf_pipeline.model.save_pretrained(path)
+    hf_pipeline.tokenizer.save_pretrained(path)
+
+    if config.get("backend", "torch") == "onnx":
+        init_pipeline(config)
+    return path
+
+
+def main(config_path: str, snapshots_dir: Optional[str]):
+    config = cast(DictConfig, OmegaConf.load(config_path))
+    if snapshots_dir is not None:
+        config.snapshots_dir = snapshots_dir
+    if config.get("snapshots_dir", None) is None:
+        raise ValueError("Set snapshots_dir in {}, or pass --snapshots_dir".format(config_path))
+
+    start = time.perf_counter()
+    for model_config in model_configs(config):
+        fetch_snapshot(model_config)
+    logger.info("Saved snapshots in {:.1f}s".format(time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(
+        description="Save local snapshots of the models of a config, so that they load without "
+        "the HuggingFace Hub"
+    )
+    parser.add_argument("config_path", type=str)
+    parser.add_argument(
+        "--snapshots_dir",
+        type=str,
+        default=None,
+        help="Directory of the snapshots. Defaults to snapshots_dir in the config",
+    )
+    args = parser.parse_args()
+
+    main(config_path=args.config_path, snapshots_dir=args.snapshots_dir)
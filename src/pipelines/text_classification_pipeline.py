@@ -1,38 +1,102 @@
-from typing import List, Union
+from typing import List, Tuple, Union, cast
 
+import numpy as np
 from omegaconf.dictconfig import DictConfig
-from omegaconf.listconfig import ListConfig
 
 from src.custom_types import FinalPrediction
+from src.custom_types import WordToken
+from src.metrics import time_stage
 from src.pipelines.base_pipeline import BasePipeline
 
 
 class TextClassificationPipeline(BasePipeline):
-    def __init__(self, config: Union[DictConfig, ListConfig]):
+    def __init__(self, config: DictConfig):
         """Initializes an instance of TextClassificationPipeline.
 
         Args:
-            config (Union[DictConfig, ListConfig]): OmegaConf config.
+            config (DictConfig): OmegaConf config.
         """
         super().__init__(config)
         self.pipeline_type = "Text Classification Pipeline"
 
-    def __call__(self, text: str) -> List[FinalPrediction]:
+        # Define the function applied to the logits, as HuggingFace's pipeline
+        model_config = self.pipeline.model.config
+        self.id2label = model_config.id2label
+        if model_config.problem_type == "regression":
+            self.score_function = "none"
+        elif model_config.problem_type == "multi_label_classification" or (
+            model_config.num_labels == 1
+        ):
+            self.score_function = "sigmoid"
+        elif model_config.problem_type == "single_label_classification" or (
+            model_config.num_labels > 1
+        ):
+            self.score_function = "softmax"
+        else:
+            self.score_function = getattr(model_config, "function_to_apply", "none")
+
+    def __call__(self, text: Union[str, List[str]], return_tokens: bool = False) -> Union[
+        List[FinalPrediction],
+        List[List[FinalPrediction]],
+        Tuple[List[FinalPrediction], List[WordToken]],
+        List[Tuple[List[FinalPrediction], List[WordToken]]],
+    ]:
         """Returns list of dictionaries, each corresponding to a final
-        prediction. It runs HuggingFace's corresponding pipeline, and maps
-        numpy types to regular types, when necessary.
+        prediction. It runs the model of HuggingFace's corresponding pipeline,
+        with the configured backend, and post-processes its logits as the
+        pipeline does, returning the top label and its score. A list of texts
+        is run through the model as a single batch. The full-word tokens can
+        also be returned, which are built with the tokenizer, since the model
+        does not output them.
 
         Args:
-            text (str): Input text string.
+            text (Union[str, List[str]]): Input text string, or list of input
+            text strings.
+            return_tokens (bool, optional): Whether to also return the
+            full-word tokens of each text. Defaults to False.
 
         Returns:
-            List[FinalPrediction]: List of dictionaries, each corresponding
-            to a final prediction.
+            Union[List[FinalPrediction], List[List[FinalPrediction]],
+            Tuple[List[FinalPrediction], List[WordToken]],
+            List[Tuple[List[FinalPrediction], List[WordToken]]]]: List of
+            dictionaries, each corresponding to a final prediction, or one
+            such list per input text. With return_tokens, each list of final
+            predictions comes in a tuple, together with the list of tokens.
         """
+        if isinstance(text, str):
+            return cast(list, self([text], return_tokens=return_tokens))[0]
+
+        outputs = []
+        if text:
+            with time_stage("tokenize"):
+                encodings = self.tokenizer(text, truncation=True)
+            logits = self._batch_logits(encodings)
+            with time_stage("postprocess"):
+                outputs = [[self._top_label(text_logits)] for text_logits in logits]
 
-        output = self.pipeline(text)
+        if return_tokens:
+            return list(zip(outputs, self.word_tokens(text)))
 
-        if output:
-            output = self._map_all_np_keys(output)
+        return outputs
 
-        return output
+    def _top_label(self, logits: np.ndarray) -> FinalPrediction:
+        """Returns the top label of a text, and its score, from the logits of
+        the model.
+
+        Args:
+            logits (np.ndarray): Logits of a text, with one value per label.
+
+        Returns:
+            FinalPrediction: Dictionary with keys "label" and "score".
+        """
+        if self.score_function == "sigmoid":
+            scores = 1 / (1 + np.exp(-logits))
+        elif self.score_function == "softmax":
+            scores = np.exp(logits - logits.max())
+            scores /= scores.sum()
+        else:
+            scores = logits
+        label_id = int(scores.argmax())
+        return FinalPrediction(
+            {"label": self.id2label[label_id], "score": float(scores[label_id])}
+        )
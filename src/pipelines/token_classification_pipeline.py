@@ -1,63 +1,413 @@
-from typing import List, Union
+from typing import List, NamedTuple, Optional, Tuple, Union, cast
 
+import numpy as np
 from omegaconf.dictconfig import DictConfig
-from omegaconf.listconfig import ListConfig
 
 from src.custom_types import FinalPrediction
-from src.custom_types import RawPrediction
+from src.custom_types import WordToken
+from src.metrics import time_stage
 from src.pipelines.base_pipeline import BasePipeline
 
+# Labels that HuggingFace's pipeline filters out of the predictions by default
+IGNORE_LABELS = ["O"]
+
+
+class TokenPredictions(NamedTuple):
+    """Predictions of the tokens of a text, without special tokens, as
+    arrays with one row per token."""
+
+    input_ids: np.ndarray
+    offsets: np.ndarray
+    label_ids: np.ndarray
+    scores: np.ndarray
+
 
 class TokenClassificationPipeline(BasePipeline):
-    def __init__(self, config: Union[DictConfig, ListConfig]):
+    def __init__(self, config: DictConfig):
         """Initializes an instance of TokenClassificationPipeline.
 
         Args:
-            config (Union[DictConfig, ListConfig]): OmegaConf config.
+            config (DictConfig): OmegaConf config.
         """
         super().__init__(config)
         self.pipeline_type = "Token Classification Pipeline"
 
-    def __call__(self, text: str) -> List[FinalPrediction]:
+        # Define sliding windows over texts longer than the model maximum length
+        windowing_config = config.get("windowing", {})
+        self.windowing = windowing_config.get("enabled", False)
+        self.window_size = windowing_config.get("window_size", None) or self._max_window_size()
+        self.window_stride = windowing_config.get("stride", 128)
+        if not 0 <= self.window_stride < self.window_size:
+            raise ValueError(
+                "Window stride ({}) must be non-negative and smaller than the window size "
+                "({})".format(self.window_stride, self.window_size)
+            )
+
+        # Define lookup tables by label id, to post-process predictions as arrays
+        id2label = self.pipeline.model.config.id2label
+        labels = [id2label[ix] for ix in range(len(id2label))]
+        tags = [label[2:] if label.startswith(("B-", "I-")) else label for label in labels]
+        tag_ids = {tag: ix for ix, tag in enumerate(dict.fromkeys(tags))}
+        self.entity_groups = [label.split("-", 1)[-1] for label in labels]
+        self.label_tags = np.array([tag_ids[tag] for tag in tags])
+        self.is_begin_label = np.array([label.startswith("B-") for label in labels])
+        self.is_ignored_label = np.array([label in IGNORE_LABELS for label in labels])
+
+        # Define lookup table by token id of subword tokens, e.g. "##t"
+        vocab = self.tokenizer.get_vocab()
+        self.is_subword = np.zeros(max(vocab.values()) + 1, dtype=bool)
+        for token, ix in vocab.items():
+            self.is_subword[ix] = token.startswith(self.prefix)
+
+    def __call__(self, text: Union[str, List[str]], return_tokens: bool = False) -> Union[
+        List[FinalPrediction],
+        List[List[FinalPrediction]],
+        Tuple[List[FinalPrediction], List[WordToken]],
+        List[Tuple[List[FinalPrediction], List[WordToken]]],
+    ]:
         """Returns list of dictionaries, each corresponding to a final
-        prediction. It runs HuggingFace's corresponding pipeline, and maps
-        numpy types to regular types, when necessary. It also groups
-        consecutive entities of the same type as a single entity.
+        prediction. It runs the model of HuggingFace's corresponding pipeline,
+        with the configured backend, and post-processes its logits as arrays,
+        grouping consecutive tokens of the same entity as a single entity.
+        Dictionaries are only created for the grouped entities. A list of texts
+        is run through the model as a single batch, and post-processed per
+        text. With windowing, texts longer than the window size are split into
+        overlapping windows, which are run as a single batch, and their
+        predictions are joined back before grouping entities. The full-word
+        tokens can also be returned, which are built from the tokens of the
+        same pass, or, for texts truncated to the model maximum length, from
+        the whole text.
 
         Args:
-            text (str): Input text string.
+            text (Union[str, List[str]]): Input text string, or list of input
+            text strings.
+            return_tokens (bool, optional): Whether to also return the
+            full-word tokens of each text. Defaults to False.
+
+        Returns:
+            Union[List[FinalPrediction], List[List[FinalPrediction]],
+            Tuple[List[FinalPrediction], List[WordToken]],
+            List[Tuple[List[FinalPrediction], List[WordToken]]]]: List of
+            dictionaries, each corresponding to a final prediction, or one
+            such list per input text. With return_tokens, each list of final
+            predictions comes in a tuple, together with the list of tokens.
+        """
+        if isinstance(text, str):
+            return cast(list, self([text], return_tokens=return_tokens))[0]
+
+        if self.windowing:
+            predictions = self._windowed_token_predictions(text)
+        else:
+            predictions = self._token_predictions(text)
+
+        with time_stage("group_entities"):
+            outputs = [self._group_entities(text_predictions) for text_predictions in predictions]
+
+        if return_tokens:
+            with time_stage("word_tokens"):
+                tokens = [
+                    self._word_tokens_from_predictions(t, text_predictions)
+                    for t, text_predictions in zip(text, predictions)
+                ]
+                # Truncated texts lack the tokens past the truncation, so they
+                # are tokenized again in full, as tokenize_text does
+                truncated = [
+                    ix
+                    for ix, (t, text_predictions) in enumerate(zip(text, predictions))
+                    if self._is_truncated(t, text_predictions)
+                ]
+                if truncated:
+                    full_tokens = self.word_tokens([text[ix] for ix in truncated])
+                    for ix, text_tokens in zip(truncated, full_tokens):
+                        tokens[ix] = text_tokens
+            return list(zip(outputs, tokens))
+
+        return outputs
+
+    def _token_predictions(self, texts: List[str]) -> List[TokenPredictions]:
+        """Runs the model backend over a list of texts as a single padded
+        batch (or in sub-batches of similar lengths, with length bucketing),
+        and returns the predicted label and score of each token of each text.
+        The score is the softmax probability of the predicted label.
+
+        Args:
+            texts (List[str]): List of input text strings.
+
+        Returns:
+            List[TokenPredictions]: Token predictions of each text.
+        """
+        if not texts:
+            return []
+
+        with time_stage("tokenize"):
+            encodings = self.tokenizer(
+                texts,
+                truncation=True,
+                return_offsets_mapping=True,
+                return_special_tokens_mask=True,
+            )
+        logits = self._batch_logits(encodings)
+
+        predictions = []
+        with time_stage("postprocess"):
+            for ix, text_logits in enumerate(logits):
+                # The maximum softmax probability is 1 / sum(exp(logits - max))
+                label_ids = text_logits.argmax(axis=-1)
+                shifted = text_logits - text_logits.max(axis=-1, keepdims=True)
+                scores = 1 / np.exp(shifted).sum(axis=-1)
+
+                keep = ~np.array(encodings["special_tokens_mask"][ix], dtype=bool)
+                predictions.append(
+                    TokenPredictions(
+                        input_ids=np.array(encodings["input_ids"][ix], dtype=np.int64)[keep],
+                        offsets=np.array(encodings["offset_mapping"][ix], dtype=np.int64).reshape(
+                            -1, 2
+                        )[keep],
+                        label_ids=label_ids[keep],
+                        scores=scores[keep],
+                    )
+                )
+        return predictions
+
+    def _group_entities(self, predictions: TokenPredictions) -> List[FinalPrediction]:
+        """Returns list of dictionaries, each corresponding to a final
+        prediction, by grouping consecutive tokens of the same entity, as
+        HuggingFace's pipeline group_entities. Tokens labelled as "O" are
+        dropped first, and a new entity starts at a "B-" token, or when the
+        entity type changes. The score of an entity is the mean of the scores
+        of its tokens.
+
+        Subword tokens (e.g. with "##") tagged with "B-" are taken as "I-".
+        This happens for words with diacritics, for instance António. In that
+        case "##t" could be tagged as "B-PER" instead of "I-PER", and would
+        otherwise split the entity in two.
+
+        Args:
+            predictions (TokenPredictions): Token predictions of a text.
 
         Returns:
             List[FinalPrediction]: List of dictionaries, each corresponding to
             a final prediction.
         """
+        keep = ~self.is_ignored_label[predictions.label_ids]
+        input_ids = predictions.input_ids[keep]
+        offsets = predictions.offsets[keep]
+        label_ids = predictions.label_ids[keep]
+        scores = predictions.scores[keep]
+        if not len(label_ids):
+            return []
+
+        tags = self.label_tags[label_ids]
+        is_begin = self.is_begin_label[label_ids] & ~self.is_subword[input_ids]
+        starts = np.flatnonzero(np.r_[True, is_begin[1:] | (tags[1:] != tags[:-1])])
+        ends = np.r_[starts[1:], len(label_ids)]
+        group_scores = np.add.reduceat(scores, starts) / (ends - starts)
+
+        return [
+            FinalPrediction(
+                {
+                    "entity_group": self.entity_groups[label_id],
+                    "score": score,
+                    "word": self.tokenizer.convert_tokens_to_string(
+                        cast(
+                            List[str],
+                            self.tokenizer.convert_ids_to_tokens(input_ids[start:end].tolist()),
+                        )
+                    ),
+                    "start": start_offset,
+                    "end": end_offset,
+                }
+            )
+            for start, end, label_id, score, start_offset, end_offset in zip(
+                starts.tolist(),
+                ends.tolist(),
+                label_ids[starts].tolist(),
+                group_scores.tolist(),
+                offsets[starts, 0].tolist(),
+                offsets[ends - 1, 1].tolist(),
+            )
+        ]
+
+    def _word_tokens_from_predictions(
+        self, text: str, predictions: TokenPredictions
+    ) -> List[WordToken]:
+        """Returns the full-word tokens of a text, from its token predictions.
+        A subword token (e.g. with "##") is merged into the previous one when
+        there is no gap between them. The word of each full-word token is
+        taken from the original text, using the character offsets.
+
+        Args:
+            text (str): Input text string.
+            predictions (TokenPredictions): Token predictions of the text.
+
+        Returns:
+            List[WordToken]: List of dictionaries, each with keys "word",
+            "start", and "end" of a full-word token.
+        """
+        offsets = predictions.offsets
+        if not len(offsets):
+            return []
+
+        is_continuation = self.is_subword[predictions.input_ids[1:]] & (
+            offsets[1:, 0] == offsets[:-1, 1]
+        )
+        starts = np.flatnonzero(np.r_[True, ~is_continuation])
+        ends = np.r_[starts[1:], len(offsets)] - 1
+        return [
+            WordToken({"word": text[start:end], "start": start, "end": end})
+            for start, end in zip(offsets[starts, 0].tolist(), offsets[ends, 1].tolist())
+        ]
+
+    def _is_truncated(self, text: str, predictions: TokenPredictions) -> bool:
+        """Returns whether the tokens of a text were truncated, i.e. whether
+        there is more than whitespace after the last token.
+
+        Args:
+            text (str): Input text string.
+            predictions (TokenPredictions): Token predictions of the text.
+
+        Returns:
+            bool: Whether the tokens of the text were truncated.
+        """
+        end = int(predictions.offsets[-1, 1]) if len(predictions.offsets) else 0
+        return bool(text[end:].strip())
 
-        output = self.pipeline(text)
+    def _windowed_token_predictions(self, texts: List[str]) -> List[TokenPredictions]:
+        """Returns the predictions of the tokens of each text, splitting those
+        longer than the window size into windows of window_size tokens, where
+        consecutive windows overlap by window_stride tokens. Windows start and
+        end on word boundaries, and all windows of all texts are run as a
+        single batch, so cost grows linearly with the length of the texts.
 
-        # Fix NER entities
-        self._fix_ner_entities(output)
+        Overlapping predictions are reconciled by keeping, for each token, the
+        prediction of the window where it is furthest from the edges, i.e.
+        each window keeps the tokens up to the middle of its overlaps. Offsets
+        are then remapped to the original text.
 
-        # Group words of the same entity
-        output = self.pipeline.group_entities(output)
+        Args:
+            texts (List[str]): List of input text strings.
 
-        if output:
-            output = self._map_all_np_keys(output)
+        Returns:
+            List[TokenPredictions]: Token predictions of each text.
+        """
+        with time_stage("windowing"):
+            # Truncation is disabled explicitly, since the backend tokenizer
+            # can keep the truncation of earlier calls
+            encodings = self.tokenizer(
+                texts, add_special_tokens=False, truncation=False, return_offsets_mapping=True
+            )
 
-        return output
+            # (text index, character shift, owned character range)
+            windows: List[Tuple[int, int, int, int]] = []
+            window_texts = []
+            for ix, text in enumerate(texts):
+                offsets, word_ids = encodings["offset_mapping"][ix], encodings.word_ids(ix)
+                if len(offsets) <= self.window_size:
+                    windows.append((ix, 0, 0, len(text) + 1))
+                    window_texts.append(text)
+                    continue
 
-    def _fix_ner_entities(self, predictions: List[RawPrediction]) -> None:
-        """Converts entities with "B-" into "I-" for words with "##". This
-        happens for words with diacritics, for instance António. In that case
-        "##t" would be tagged as "B-PER" instead of "I-PER", and would result
-        in wrong grouped entities when calling self.pipeline.group_entities.
-        We modify entities in-place, since python uses "Call by Sharing".
+                # Each window owns the tokens up to the middle of its overlaps
+                spans = self._window_spans(word_ids)
+                bounds = [0]
+                for (_, end), (next_start, _) in zip(spans[:-1], spans[1:]):
+                    bounds.append(self._split_overlap(word_ids, next_start, end))
+
+                for k, (start, end) in enumerate(spans):
+                    own_start = offsets[bounds[k]][0] if k > 0 else 0
+                    own_end = offsets[bounds[k + 1]][0] if k + 1 < len(spans) else len(text) + 1
+                    shift = offsets[start][0]
+                    windows.append((ix, shift, own_start, own_end))
+                    window_texts.append(text[shift : offsets[end - 1][1]])
+
+        parts: List[List[TokenPredictions]] = [[] for _ in texts]
+        window_predictions = self._token_predictions(window_texts)
+        for (ix, shift, own_start, own_end), predictions in zip(windows, window_predictions):
+            offsets = predictions.offsets + shift
+            keep = (own_start <= offsets[:, 0]) & (offsets[:, 0] < own_end)
+            parts[ix].append(
+                TokenPredictions(
+                    input_ids=predictions.input_ids[keep],
+                    offsets=offsets[keep],
+                    label_ids=predictions.label_ids[keep],
+                    scores=predictions.scores[keep],
+                )
+            )
+        return [
+            TokenPredictions(*(np.concatenate(arrays) for arrays in zip(*text_parts)))
+            for text_parts in parts
+        ]
+
+    def _window_spans(self, word_ids: List[Optional[int]]) -> List[Tuple[int, int]]:
+        """Returns the (start, end) token indices of the windows over a text,
+        each with at most window_size tokens, and overlapping the previous one
+        by about window_stride tokens. Windows start on word boundaries,
+        unless a single word is longer than the step between windows.
 
         Args:
-            predictions (List[RawPrediction]): List of dictionaries, each
-            corresponding to a raw prediction.
+            word_ids (List[Optional[int]]): Word id of each token of the text.
+
+        Returns:
+            List[Tuple[int, int]]: List with the start and end token indices
+            of each window.
+        """
+        n_tokens = len(word_ids)
+        step = self.window_size - self.window_stride
+        spans = []
+        start = 0
+        while True:
+            end = min(start + self.window_size, n_tokens)
+            if end < n_tokens and self._word_start(word_ids, end) > start:
+                end = self._word_start(word_ids, end)
+            spans.append((start, end))
+            if end == n_tokens:
+                return spans
+            next_start = self._word_start(word_ids, start + step)
+            start = next_start if next_start > start else start + step
+
+    def _split_overlap(self, word_ids: List[Optional[int]], start: int, end: int) -> int:
+        """Returns the token index where the overlap [start, end) of two
+        consecutive windows is split, i.e. the first token owned by the second
+        window. It is the word start closest to the middle of the overlap, so
+        that words are not split between windows, or the middle itself when a
+        single word spans the whole overlap.
+
+        Args:
+            word_ids (List[Optional[int]]): Word id of each token of the text.
+            start (int): Token index of the start of the second window.
+            end (int): Token index of the end of the first window.
+
+        Returns:
+            int: Token index of the split.
+        """
+        middle = (start + end) // 2
+        word_start = self._word_start(word_ids, middle)
+        if word_start >= start:
+            return word_start
+        word_end = middle
+        while word_end < end and word_ids[word_end] == word_ids[middle]:
+            word_end += 1
+        return word_end if word_end < end else middle
+
+    def _word_start(self, word_ids: List[Optional[int]], ix: int) -> int:
+        """Returns the index of the first token of the word of token ix.
+
+        Args:
+            word_ids (List[Optional[int]]): Word id of each token of the text.
+            ix (int): Token index.
+
+        Returns:
+            int: Token index of the start of the word.
+        """
+        while ix > 0 and word_ids[ix] is not None and word_ids[ix] == word_ids[ix - 1]:
+            ix -= 1
+        return ix
+
+    def _max_window_size(self) -> int:
+        """Returns the maximum number of text tokens the model takes at once,
+        i.e. the model maximum length without the special tokens.
+
+        Returns:
+            int: Maximum number of text tokens.
         """
-        # TODO: Add more checks about start position of B- being the same as
-        # the end position of the last entity, and having the same entity type
-        for d in predictions:
-            if self.prefix in d["word"] and "B-" in d["entity"]:
-                d["entity"] = d["entity"].replace("B-", "I-")
+        return self.max_length - self.num_special_tokens
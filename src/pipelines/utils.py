@@ -2,8 +2,9 @@ import logging
 from typing import Union
 
 from omegaconf.dictconfig import DictConfig
-from omegaconf.listconfig import ListConfig
 
+from src.pipelines.cascade import CascadePipeline
+from src.pipelines.cascade import cascade_configs
 from src.pipelines.text_classification_pipeline import (
     TextClassificationPipeline,
 )
@@ -15,12 +16,43 @@ logger = logging.getLogger("logger")
 
 
 def init_pipeline(
-    config: Union[DictConfig, ListConfig],
+    config: DictConfig,
+) -> Union[TextClassificationPipeline, TokenClassificationPipeline, CascadePipeline]:
+    """Initializes an HuggingFace pipeline. With cascade enabled, it
+    initializes the pipelines of the small and large models, as a cascade.
+
+    Args:
+        config (DictConfig): OmegaConf config.
+
+    Raises:
+        NotImplementedError: Raises error when using a non-implemented
+        pipeline.
+
+    Returns:
+        Union[TextClassificationPipeline, TokenClassificationPipeline,
+        CascadePipeline]: Instance of "full" pipeline.
+    """
+    if config.get("cascade", {}).get("enabled", False):
+        small_config, large_config = cascade_configs(config)
+        logger.info(
+            "Initializing cascade of {} and {}...".format(small_config.model, large_config.model)
+        )
+        return CascadePipeline(
+            _init_model_pipeline(small_config),
+            _init_model_pipeline(large_config),
+            threshold=config.cascade.get("threshold", 0.9),
+        )
+    return _init_model_pipeline(config)
+
+
+def _init_model_pipeline(
+    config: DictConfig,
 ) -> Union[TextClassificationPipeline, TokenClassificationPipeline]:
-    """Initializes an HuggingFace pipeline.
+    """Initializes the HuggingFace pipeline of a single model, ignoring the
+    cascade options.
 
     Args:
-        config (Union[DictConfig, ListConfig]): OmegaConf config.
+        config (DictConfig): OmegaConf config.
 
     Raises:
         NotImplementedError: Raises error when using a non-implemented
@@ -30,7 +62,7 @@ def init_pipeline(
         Union[TextClassificationPipeline, TokenClassificationPipeline]:
         Instance of "full" pipeline.
     """
-
+    pipeline: Union[TextClassificationPipeline, TokenClassificationPipeline]
     if config.pipeline == "TokenClassificationPipeline":
         logger.info("Initializing Token Classification pipeline...")
         pipeline = TokenClassificationPipeline(config)
@@ -0,0 +1,37 @@
+from typing import Any
+
+import orjson
+
+# Numpy scalars and arrays are serialized natively, without mapping them to
+# python types first, and integer keys (e.g. line numbers) are allowed
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def dumps(obj: Any, indent: bool = False, sort_keys: bool = False) -> bytes:
+    """Serializes an object into UTF-8 encoded json with orjson, including
+    numpy scalars and arrays (e.g. scores returned by the pipelines).
+
+    Args:
+        obj (Any): Object to serialize.
+        indent (bool, optional): Whether to indent the output with two
+        spaces. Defaults to False.
+        sort_keys (bool, optional): Whether to sort the keys of
+        dictionaries, e.g. to hash the output. Defaults to False.
+
+    Returns:
+        bytes: UTF-8 encoded json.
+    """
+    option = ORJSON_OPTIONS | (orjson.OPT_INDENT_2 if indent else 0)
+    return orjson.dumps(obj, option=option | (orjson.OPT_SORT_KEYS if sort_keys else 0))
+
+
+def loads(data: Any) -> Any:
+    """Deserializes json with orjson.
+
+    Args:
+        data (Any): Json string or bytes.
+
+    Returns:
+        Any: Deserialized object.
+    """
+    return orjson.loads(data)
@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from src.api.admission import AdmissionController
+
+
+def make_request(deadline_ms=None):
+    headers = [] if deadline_ms is None else [(b"x-deadline-ms", str(deadline_ms).encode())]
+    return Request({"type": "http", "headers": headers})
+
+
+class TestAdmissionController:
+    def setup_class(cls):
+        pass
+
+    def teardown_class(cls):
+        pass
+
+    def test_limit_texts(self):
+        admission = AdmissionController(max_text_chars=5, max_batch_texts=2)
+        assert admission.limit_texts(["short", "text"]) == ["short", "text"]
+
+        with pytest.raises(HTTPException) as e:
+            admission.limit_texts(["too long"])
+        assert e.value.status_code == 413
+
+        with pytest.raises(HTTPException) as e:
+            admission.limit_texts(["a", "b", "c"])
+        assert e.value.status_code == 413
+
+    def test_limit_stream_texts(self):
+        admission = AdmissionController(max_batch_texts=2, max_stream_texts=3)
+        assert admission.limit_texts(["a", "b", "c"], stream=True) == ["a", "b", "c"]
+        with pytest.raises(HTTPException) as e:
+            admission.limit_texts(["a", "b", "c", "d"], stream=True)
+        assert e.value.status_code == 413
+
+    def test_truncate_long_texts(self):
+        admission = AdmissionController(max_text_chars=5, truncate_long_texts=True)
+        assert admission.limit_texts(["too long", "text"]) == ["too l", "text"]
+
+    def test_admit_rejects_when_queue_is_full(self):
+        admission = AdmissionController(max_queued_texts=3, retry_after_seconds=2)
+        with admission.admit(2):
+            assert admission.queued_texts == 2
+            with admission.admit(1):
+                with pytest.raises(HTTPException) as e:
+                    with admission.admit(1):
+                        pass
+        assert e.value.status_code == 503
+        assert e.value.headers == {"Retry-After": "2"}
+        assert admission.queued_texts == 0
+
+    def test_admit_without_check(self):
+        admission = AdmissionController(max_queued_texts=3)
+        with admission.admit(3):
+            with pytest.raises(HTTPException):
+                admission.check(1)
+            with admission.admit(2, check=False):
+                assert admission.queued_texts == 5
+        assert admission.queued_texts == 0
+
+    def test_admit_larger_request_when_idle(self):
+        admission = AdmissionController(max_queued_texts=3)
+        with admission.admit(10):
+            assert admission.queued_texts == 10
+
+    def test_deadline(self):
+        admission = AdmissionController(default_deadline_ms=1000)
+
+        async def deadlines():
+            now = asyncio.get_event_loop().time()
+            return [
+                admission.deadline(make_request()) - now,
+                admission.deadline(make_request(50)) - now,
+                AdmissionController().deadline(make_request()),
+            ]
+
+        default, header, none = asyncio.run(deadlines())
+        assert default == pytest.approx(1, abs=0.01)
+        assert header == pytest.approx(0.05, abs=0.01)
+        assert none is None
+
+        for deadline_ms in ["soon", 0]:
+            with pytest.raises(HTTPException) as e:
+                admission.deadline(make_request(deadline_ms))
+            assert e.value.status_code == 400
+
+    def test_wait_drops_work_after_deadline(self):
+        admission = AdmissionController()
+        cancelled = []
+
+        async def queued_work():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        async def wait():
+            return await admission.wait(queued_work(), admission.deadline(make_request(10)))
+
+        with pytest.raises(HTTPException) as e:
+            asyncio.run(wait())
+        assert e.value.status_code == 504
+        assert cancelled
+
+    def test_wait_returns_result_before_deadline(self):
+        admission = AdmissionController()
+
+        async def work():
+            return "result"
+
+        async def wait():
+            return await admission.wait(work(), admission.deadline(make_request(1000)))
+
+        assert asyncio.run(wait()) == "result"
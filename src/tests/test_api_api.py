@@ -1,15 +1,20 @@
+import asyncio
 import json
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
 import numpy as np
 
 from fastapi.testclient import TestClient
 from omegaconf import OmegaConf
 
-from src.api.api import app
+from src.api.api import app, executor, registry, start_up, startup
 from src.pipelines.utils import init_pipeline
 
 # Initialize FastAPI TestClient
 client = TestClient(app)
 
+
 # Make tests async: https://fastapi.tiangolo.com/advanced/async-tests/
 def test_predict():
     response = client.post(
@@ -23,6 +28,55 @@ def test_predict():
     assert type(response["predictions"]) == list
 
 
+def test_predict_with_tokens():
+    text = "Lisbon is a pretty city."
+    response = client.post(
+        "/predict/",
+        json={"text": text, "return_tokens": True},
+    )
+    assert response.status_code == 200
+    response = response.json()
+    assert type(response["predictions"]) == list
+    assert [token["word"] for token in response["tokens"]] == [
+        "Lisbon",
+        "is",
+        "a",
+        "pretty",
+        "city",
+        ".",
+    ]
+    for token in response["tokens"]:
+        assert text[token["start"] : token["end"]] == token["word"]
+
+
+def test_predict_batch():
+    texts = ["Lisbon is a pretty city.", "Barack Obama was born in Hawaii.", ""]
+    response = client.post(
+        "/predict_batch/",
+        json={"texts": texts},
+    )
+    assert response.status_code == 200
+    response = response.json()
+    assert type(response["type"]) == str
+    assert type(response["model"]) == str
+    assert len(response["predictions"]) == len(texts)
+    # Scores may differ slightly due to padding, so only the remaining keys are compared
+    for text, predictions in zip(texts, response["predictions"]):
+        expected = client.post("/predict/", json={"text": text}).json()["predictions"]
+        assert [{k: v for k, v in p.items() if k != "score"} for p in predictions] == [
+            {k: v for k, v in p.items() if k != "score"} for p in expected
+        ]
+
+
+def test_predict_batch_empty():
+    response = client.post(
+        "/predict_batch/",
+        json={"texts": []},
+    )
+    assert response.status_code == 200
+    assert response.json()["predictions"] == []
+
+
 def test_tokenize_sentence():
     response = client.post(
         "/tokenize/",
@@ -30,3 +84,244 @@ def test_tokenize_sentence():
     )
     assert response.status_code == 200
     assert response.json() == {"tokens": ["Test", "sentence", "and", "stuff", "."]}
+
+
+def test_tokenize_concurrently_with_predict():
+    # Longer than the 512 tokens predictions are truncated to
+    long_text = " ".join(["Lisbon is a pretty city."] * 400)
+    texts = [long_text, "They are António Seráfim and Barack Obama!"]
+    pipeline = registry.load("default").pipeline
+    tokenizers = [pipeline.pipeline.tokenizer, pipeline._tokenizer_template]
+    max_lengths = [tokenizer.model_max_length for tokenizer in tokenizers]
+    for tokenizer in tokenizers:
+        tokenizer.model_max_length = 512
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(
+                *[client.post("/tokenize/", json={"text": long_text}) for _ in range(32)],
+                *[
+                    client.post("/predict/", json={"text": text, "return_tokens": True})
+                    for _ in range(32)
+                    for text in texts
+                ],
+            )
+
+    # Several executor threads run tokenization and inference at once
+    pool, max_workers = executor.executor, executor.max_workers
+    executor.executor, executor.max_workers = ThreadPoolExecutor(max_workers=4), 4
+    try:
+        expected_tokens = client.post("/tokenize/", json={"text": long_text}).json()["tokens"]
+        # With tokens, predictions skip the cache and run through the model
+        expected = [
+            client.post("/predict/", json={"text": text, "return_tokens": True}).json()
+            for text in texts
+        ]
+        responses = asyncio.run(run())
+    finally:
+        executor.executor.shutdown()
+        executor.executor, executor.max_workers = pool, max_workers
+        for tokenizer, max_length in zip(tokenizers, max_lengths):
+            tokenizer.model_max_length = max_length
+
+    assert len(expected_tokens) == 2400
+    for response in responses[:32]:
+        assert response.json()["tokens"] == expected_tokens
+    for ix, response in enumerate(responses[32:]):
+        assert response.status_code == 200
+        assert response.json() == expected[ix % len(texts)]
+
+
+def test_tokenize_batch():
+    response = client.post(
+        "/tokenize_batch/",
+        json={"texts": ["Test sentence and stuff.", "", "António Nunes!"]},
+    )
+    assert response.status_code == 200
+    assert response.json() == {
+        "tokens": [["Test", "sentence", "and", "stuff", "."], [], ["António", "Nunes", "!"]]
+    }
+
+
+def test_cache_stats():
+    response = client.get("/cache_stats/")
+    assert response.status_code == 200
+    response = response.json()
+    assert type(response["enabled"]) == bool
+    if response["enabled"]:
+        hits = response["hits"]
+        client.post("/predict/", json={"text": "A cached sentence."})
+        client.post("/predict/", json={"text": "A cached sentence."})
+        assert client.get("/cache_stats/").json()["hits"] > hits
+
+
+def test_metrics():
+    client.post("/predict/", json={"text": "Lisbon is a pretty city."})
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'hf_pipelines_requests_total{endpoint="/predict/",status_code="200"}' in response.text
+    assert 'hf_pipelines_stage_seconds_count{stage="serialize"}' in response.text
+    assert "hf_pipelines_in_flight_requests 0.0" in response.text
+
+
+def test_predict_model():
+    response = client.post("/predict/default", json={"text": "Lisbon is a pretty city."})
+    assert response.status_code == 200
+    assert (
+        response.json()
+        == client.post("/predict/", json={"text": "Lisbon is a pretty city."}).json()
+    )
+
+    response = client.post("/predict_batch/default", json={"texts": ["Lisbon is a pretty city."]})
+    assert response.status_code == 200
+    assert len(response.json()["predictions"]) == 1
+
+
+def test_predict_cascade():
+    small_model = "sshleifer/tiny-dbmdz-bert-large-cased-finetuned-conll03-english"
+    registry.configs["cascade"] = OmegaConf.merge(
+        registry.configs["default"],
+        {"cascade": {"enabled": True, "model": small_model, "threshold": 0.0}},
+    )
+    texts = ["Lisbon is a pretty city.", "Test sentence and stuff."]
+    try:
+        # The second requests hit the cache
+        for _ in range(2):
+            response = client.post("/predict/cascade", json={"text": texts[0]}).json()
+            assert response["answered_by"] == small_model
+            response = client.post("/predict_batch/cascade", json={"texts": texts}).json()
+            assert response["answered_by"] == [small_model, small_model]
+            response = client.post("/predict_batch_stream/cascade", json={"texts": texts})
+            lines = [json.loads(line) for line in response.text.splitlines()]
+            assert [line["answered_by"] for line in lines] == [small_model, small_model]
+        response = client.post("/predict/cascade", json={"text": texts[0], "return_tokens": True})
+        assert response.json()["answered_by"] == small_model
+    finally:
+        del registry.configs["cascade"]
+
+    assert "answered_by" not in client.post("/predict/", json={"text": texts[0]}).json()
+    assert "answered_by" not in client.post("/predict_batch/", json={"texts": texts}).json()
+
+
+def test_predict_unknown_model():
+    response = client.post("/predict/unknown", json={"text": "Lisbon is a pretty city."})
+    assert response.status_code == 404
+    response = client.post("/predict_batch/unknown", json={"texts": ["Lisbon is a pretty city."]})
+    assert response.status_code == 404
+
+
+def test_models():
+    response = client.get("/models/")
+    assert response.status_code == 200
+    response = response.json()
+    assert "default" in response["models"]
+    assert "default" in response["loaded"]
+    assert response["memory_mb"] > 0
+
+
+def test_healthz():
+    response = client.get("/healthz")
+    assert response.status_code == 200
+    assert response.json() == {"status": "ok"}
+
+
+def test_readyz():
+    # Startup events only run within a client context, whose exit would also
+    # shut down the executor, so the startup is run directly
+    async def start_and_wait():
+        await start_up()
+        assert client.get("/readyz").status_code in (200, 503)
+        await startup.task
+
+    asyncio.run(start_and_wait())
+    response = client.get("/readyz")
+    assert response.status_code == 200
+    response = response.json()
+    assert response["ready"] is True
+    assert response["error"] is None
+    assert "warm_up:default" in response["startup_seconds"]
+
+
+def test_predict_coalesced_result_matches():
+    # Identical requests give the same response, whether coalesced or not
+    text = "Identical text sent by many clients."
+    responses = [client.post("/predict/", json={"text": text}).json() for _ in range(2)]
+    assert responses[0] == responses[1]
+    response = client.get("/metrics")
+    assert "hf_pipelines_coalesced_requests_total" in response.text
+
+
+def test_predict_coalesced_tokens_match_text():
+    # Text classification keys collapse whitespace, but tokens have the
+    # offsets of each text
+    registry.configs["sentiment"] = OmegaConf.merge(
+        registry.configs["default"],
+        {
+            "pipeline": "TextClassificationPipeline",
+            "model": "sshleifer/tiny-distilbert-base-uncased-finetuned-sst-2-english",
+        },
+    )
+    texts = ["Lisbon  is a   pretty city.", "Lisbon is a pretty city."]
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(
+                *[
+                    client.post("/predict/sentiment", json={"text": text, "return_tokens": True})
+                    for text in texts
+                ]
+            )
+
+    try:
+        responses = asyncio.run(run())
+    finally:
+        del registry.configs["sentiment"]
+
+    for text, response in zip(texts, responses):
+        assert response.status_code == 200
+        for token in response.json()["tokens"]:
+            assert text[token["start"] : token["end"]] == token["word"]
+
+
+def test_admission_limits():
+    text = "a" * 100001
+    assert client.post("/predict/", json={"text": text}).status_code == 413
+    assert client.post("/predict_batch/", json={"texts": [text]}).status_code == 413
+    assert client.post("/predict_batch/", json={"texts": ["a"] * 1025}).status_code == 413
+    response = client.post(
+        "/predict/", json={"text": "Lisbon is a pretty city."}, headers={"X-Deadline-Ms": "soon"}
+    )
+    assert response.status_code == 400
+    response = client.post(
+        "/predict/", json={"text": "Lisbon is a pretty city."}, headers={"X-Deadline-Ms": "60000"}
+    )
+    assert response.status_code == 200
+    response = client.get("/metrics")
+    assert "hf_pipelines_rejected_requests_total" in response.text
+    assert "hf_pipelines_queued_texts" in response.text
+
+
+def test_predict_batch_stream():
+    texts = ["Lisbon is a pretty city.", "Test sentence and stuff.", "Lisbon is a pretty city."]
+    response = client.post("/predict_batch_stream/", json={"texts": texts})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["index"] for line in lines] == [0, 1, 2]
+    expected = client.post("/predict_batch/", json={"texts": texts}).json()["predictions"]
+    for line, predictions in zip(lines, expected):
+        assert [p["entity_group"] for p in line["predictions"]] == [
+            p["entity_group"] for p in predictions
+        ]
+        assert np.allclose(
+            [p["score"] for p in line["predictions"]], [p["score"] for p in predictions]
+        )
+
+    response = client.post("/predict_batch_stream/", json={"texts": []})
+    assert response.status_code == 200
+    assert response.text == ""
+    response = client.post("/predict_batch_stream/unknown", json={"texts": texts})
+    assert response.status_code == 404
@@ -0,0 +1,106 @@
+import asyncio
+
+from omegaconf import OmegaConf
+
+from src.api.batching import BatchScheduler
+from src.pipelines.cascade import CascadePipeline
+from src.pipelines.text_classification_pipeline import TextClassificationPipeline
+
+MODEL_NAME = "sshleifer/tiny-distilbert-base-uncased-finetuned-sst-2-english"
+PIPELINE_NAME = "TextClassificationPipeline"
+
+TEXTS = [
+    "Lisbon is a great and amazing city!",
+    "This is bad.",
+    "A much longer sentence, that should need a few more tokens than the others.",
+    "Okay.",
+]
+
+
+class RecordingPipeline:
+    """Wraps a pipeline, and records each batch it runs."""
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.batches = []
+
+    def estimate_tokens(self, text):
+        return self.pipeline.estimate_tokens(text)
+
+    def __call__(self, texts, return_tokens=False):
+        self.batches.append(texts)
+        return self.pipeline(texts, return_tokens=return_tokens)
+
+
+async def submit_all(scheduler, texts):
+    return await asyncio.gather(*[scheduler.submit(text) for text in texts])
+
+
+class TestBatchScheduler:
+    def setup_class(cls):
+        config = OmegaConf.create({"pipeline": PIPELINE_NAME, "model": MODEL_NAME})
+        cls.pipeline = TextClassificationPipeline(config)
+
+    def teardown_class(cls):
+        pass
+
+    def test_results_match_unbatched_calls(self):
+        scheduler = BatchScheduler(self.pipeline, max_wait_ms=50)
+        outputs = asyncio.run(submit_all(scheduler, TEXTS))
+        for text, output in zip(TEXTS, outputs):
+            expected = self.pipeline(text)
+            assert output[0]["label"] == expected[0]["label"]
+            assert abs(output[0]["score"] - expected[0]["score"]) < 1e-4
+
+    def test_concurrent_requests_are_batched(self):
+        pipeline = RecordingPipeline(self.pipeline)
+        scheduler = BatchScheduler(pipeline, max_wait_ms=50)
+        asyncio.run(submit_all(scheduler, TEXTS))
+        assert [len(batch) for batch in pipeline.batches] == [len(TEXTS)]
+
+    def test_return_tokens(self):
+        async def run():
+            return await asyncio.gather(
+                scheduler.submit(TEXTS[0], return_tokens=True), scheduler.submit(TEXTS[1])
+            )
+
+        scheduler = BatchScheduler(self.pipeline, max_wait_ms=50)
+        with_tokens, without_tokens = asyncio.run(run())
+        predictions, tokens = with_tokens
+        assert predictions[0]["label"] == self.pipeline(TEXTS[0])[0]["label"]
+        assert tokens == self.pipeline.word_tokens([TEXTS[0]])[0]
+        assert without_tokens[0]["label"] == self.pipeline(TEXTS[1])[0]["label"]
+
+    def test_return_models(self):
+        async def run():
+            return await asyncio.gather(
+                scheduler.submit(TEXTS[0], return_tokens=True), scheduler.submit(TEXTS[1])
+            )
+
+        cascade = CascadePipeline(self.pipeline, self.pipeline, threshold=0.0)
+        scheduler = BatchScheduler(cascade, max_wait_ms=50, return_models=True)
+        with_tokens, without_tokens = asyncio.run(run())
+        (predictions, tokens), model = with_tokens
+        assert model == MODEL_NAME
+        assert predictions[0]["label"] == self.pipeline(TEXTS[0])[0]["label"]
+        assert tokens == self.pipeline.word_tokens([TEXTS[0]])[0]
+        predictions, model = without_tokens
+        assert model == MODEL_NAME
+        assert predictions[0]["label"] == self.pipeline(TEXTS[1])[0]["label"]
+
+    def test_max_batch_size(self):
+        pipeline = RecordingPipeline(self.pipeline)
+        scheduler = BatchScheduler(pipeline, max_batch_size=3, max_wait_ms=50)
+        asyncio.run(submit_all(scheduler, TEXTS))
+        assert [len(batch) for batch in pipeline.batches] == [3, 1]
+
+    def test_max_batch_tokens(self):
+        pipeline = RecordingPipeline(self.pipeline)
+        max_batch_tokens = max(self.pipeline.estimate_tokens(text) for text in TEXTS)
+        scheduler = BatchScheduler(pipeline, max_batch_tokens=max_batch_tokens, max_wait_ms=50)
+        outputs = asyncio.run(submit_all(scheduler, TEXTS))
+        assert len(outputs) == len(TEXTS)
+        assert sum(len(batch) for batch in pipeline.batches) == len(TEXTS)
+        for batch in pipeline.batches:
+            n_tokens = max(self.pipeline.estimate_tokens(text) for text in batch)
+            assert len(batch) == 1 or n_tokens * len(batch) <= max_batch_tokens
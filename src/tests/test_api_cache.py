@@ -0,0 +1,113 @@
+import sys
+
+from omegaconf import OmegaConf
+
+from src.api.cache import PredictionCache
+
+MODEL_NAME = "dslim/bert-base-NER"
+PIPELINE_TYPE = "Token Classification Pipeline"
+
+PREDICTIONS = [{"entity_group": "LOC", "score": 0.99, "word": "Lisbon", "start": 0, "end": 6}]
+
+
+class TestPredictionCache:
+    def setup_class(cls):
+        pass
+
+    def teardown_class(cls):
+        pass
+
+    def test_key(self):
+        key = PredictionCache.key(MODEL_NAME, PIPELINE_TYPE, "Lisbon")
+        assert key == PredictionCache.key(MODEL_NAME, PIPELINE_TYPE, "Lisbon")
+        assert key != PredictionCache.key("other-model", PIPELINE_TYPE, "Lisbon")
+        assert key != PredictionCache.key(MODEL_NAME, PIPELINE_TYPE, " Lisbon")
+
+    def test_key_with_config_hash(self):
+        key = PredictionCache.key(MODEL_NAME, PIPELINE_TYPE, "Lisbon", config_hash="a")
+        assert key != PredictionCache.key(MODEL_NAME, PIPELINE_TYPE, "Lisbon", config_hash="b")
+
+    def test_config_hash(self):
+        config = OmegaConf.create(
+            {"model": MODEL_NAME, "quantize": None, "batching": {"max_batch_size": 32}}
+        )
+        config_hash = PredictionCache.config_hash(config)
+        # Serving options do not change predictions
+        serving = OmegaConf.merge(config, {"batching": {"max_batch_size": 8}})
+        assert PredictionCache.config_hash(serving) == config_hash
+        quantized = OmegaConf.merge(config, {"quantize": "dynamic-int8"})
+        assert PredictionCache.config_hash(quantized) != config_hash
+
+    def test_key_normalizes_text_classification_whitespace(self):
+        pipeline_type = "Text Classification Pipeline"
+        assert PredictionCache.key(MODEL_NAME, pipeline_type, " Great  city!\n") == (
+            PredictionCache.key(MODEL_NAME, pipeline_type, "Great city!")
+        )
+
+    def test_get_and_set(self, tmp_path):
+        cache = PredictionCache(str(tmp_path / "cache.sqlite"))
+        key = PredictionCache.key(MODEL_NAME, PIPELINE_TYPE, "Lisbon")
+        assert cache.get(key) is None
+        cache.set(key, PREDICTIONS)
+        assert cache.get(key) == PREDICTIONS
+        assert cache.stats() == {"hits": 1, "misses": 1, "entries": 1}
+
+    def test_shared_between_instances(self, tmp_path):
+        path = str(tmp_path / "cache.sqlite")
+        key = PredictionCache.key(MODEL_NAME, PIPELINE_TYPE, "Lisbon")
+        PredictionCache(path).set(key, PREDICTIONS)
+        other_cache = PredictionCache(path)
+        assert other_cache.get(key) == PREDICTIONS
+        assert other_cache.stats()["hits"] == 1
+
+    def test_ttl(self, tmp_path):
+        cache = PredictionCache(str(tmp_path / "cache.sqlite"), ttl_seconds=0)
+        key = PredictionCache.key(MODEL_NAME, PIPELINE_TYPE, "Lisbon")
+        cache.set(key, PREDICTIONS)
+        assert cache.get(key) is None
+        cache.evict()
+        assert cache.stats()["entries"] == 0
+
+    def test_max_entries(self, tmp_path):
+        cache = PredictionCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+        keys = [PredictionCache.key(MODEL_NAME, PIPELINE_TYPE, str(i)) for i in range(3)]
+        for key in keys:
+            cache.set(key, PREDICTIONS)
+        cache.evict()
+        assert cache.stats()["entries"] == 2
+        assert cache.get(keys[0]) is None
+        assert cache.get(keys[2]) == PREDICTIONS
+
+    def test_unavailable_cache_is_a_miss(self, tmp_path):
+        cache = PredictionCache(str(tmp_path / "missing_dir" / "cache.sqlite"))
+        key = PredictionCache.key(MODEL_NAME, PIPELINE_TYPE, "Lisbon")
+        cache.set(key, PREDICTIONS)
+        assert cache.get(key) is None
+        assert cache.stats() == {"hits": 0, "misses": 1, "entries": None}
+
+    def test_stats_are_per_instance(self, tmp_path):
+        path = str(tmp_path / "cache.sqlite")
+        cache = PredictionCache(path)
+        key = PredictionCache.key(MODEL_NAME, PIPELINE_TYPE, "Lisbon")
+        cache.set(key, PREDICTIONS)
+        cache.get(key)
+        assert PredictionCache(path).stats() == {"hits": 0, "misses": 0, "entries": 1}
+
+    def test_get_many_and_set_many(self, tmp_path):
+        cache = PredictionCache(str(tmp_path / "cache.sqlite"))
+        # More keys than a single query takes
+        keys = [PredictionCache.key(MODEL_NAME, PIPELINE_TYPE, str(i)) for i in range(1200)]
+        cache.set_many({key: PREDICTIONS for key in keys[:1000]})
+        found = cache.get_many(keys + keys[:1])
+        assert set(found) == set(keys[:1000])
+        assert all(predictions == PREDICTIONS for predictions in found.values())
+        assert cache.stats() == {"hits": 1000, "misses": 200, "entries": 1000}
+
+    def test_memo_without_expiry(self, tmp_path):
+        cache = PredictionCache(
+            str(tmp_path / "cache.sqlite"), max_entries=sys.maxsize, ttl_seconds=float("inf")
+        )
+        key = PredictionCache.key(MODEL_NAME, PIPELINE_TYPE, "Lisbon")
+        cache.set_many({key: PREDICTIONS})
+        cache.evict()
+        assert cache.get_many([key]) == {key: PREDICTIONS}
@@ -0,0 +1,129 @@
+import asyncio
+
+import pytest
+
+from src.api.coalescing import SingleFlight
+
+
+class CountingCall:
+    """Call that counts how many times it starts, and waits for a release."""
+
+    def __init__(self, result="result", error=None):
+        self.result = result
+        self.error = error
+        self.starts = 0
+        self.cancelled = False
+        self.release = None
+
+    async def __call__(self):
+        self.starts += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class TestSingleFlight:
+    def setup_class(cls):
+        pass
+
+    def teardown_class(cls):
+        pass
+
+    def test_identical_calls_are_coalesced(self):
+        single_flight = SingleFlight()
+        call = CountingCall()
+
+        async def run_all():
+            call.release = asyncio.Event()
+            tasks = [asyncio.ensure_future(single_flight.run("key", call)) for _ in range(5)]
+            await asyncio.sleep(0.01)
+            assert single_flight.in_flight() == 1
+            call.release.set()
+            return await asyncio.gather(*tasks)
+
+        assert asyncio.run(run_all()) == ["result"] * 5
+        assert call.starts == 1
+        assert single_flight.in_flight() == 0
+
+    def test_different_keys_are_not_coalesced(self):
+        single_flight = SingleFlight()
+        call = CountingCall()
+
+        async def run_all():
+            call.release = asyncio.Event()
+            call.release.set()
+            return await asyncio.gather(
+                single_flight.run("key", call), single_flight.run("other-key", call)
+            )
+
+        assert asyncio.run(run_all()) == ["result", "result"]
+        assert call.starts == 2
+
+    def test_calls_after_completion_start_again(self):
+        single_flight = SingleFlight()
+        call = CountingCall()
+
+        async def run_twice():
+            call.release = asyncio.Event()
+            call.release.set()
+            await single_flight.run("key", call)
+            await single_flight.run("key", call)
+
+        asyncio.run(run_twice())
+        assert call.starts == 2
+
+    def test_errors_are_shared(self):
+        single_flight = SingleFlight()
+        call = CountingCall(error=ValueError("inference failed"))
+
+        async def run_all():
+            call.release = asyncio.Event()
+            tasks = [asyncio.ensure_future(single_flight.run("key", call)) for _ in range(3)]
+            await asyncio.sleep(0.01)
+            call.release.set()
+            return await asyncio.gather(*tasks, return_exceptions=True)
+
+        errors = asyncio.run(run_all())
+        assert all(isinstance(e, ValueError) for e in errors)
+        assert call.starts == 1
+
+    def test_cancelled_caller_does_not_cancel_others(self):
+        single_flight = SingleFlight()
+        call = CountingCall()
+
+        async def cancel_one():
+            call.release = asyncio.Event()
+            first = asyncio.ensure_future(single_flight.run("key", call))
+            second = asyncio.ensure_future(single_flight.run("key", call))
+            await asyncio.sleep(0.01)
+            first.cancel()
+            await asyncio.sleep(0.01)
+            call.release.set()
+            with pytest.raises(asyncio.CancelledError):
+                await first
+            return await second
+
+        assert asyncio.run(cancel_one()) == "result"
+        assert not call.cancelled
+
+    def test_call_is_cancelled_with_all_callers(self):
+        single_flight = SingleFlight()
+        call = CountingCall()
+
+        async def cancel_all():
+            call.release = asyncio.Event()
+            tasks = [asyncio.ensure_future(single_flight.run("key", call)) for _ in range(2)]
+            await asyncio.sleep(0.01)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await asyncio.sleep(0.01)
+            assert single_flight.in_flight() == 0
+
+        asyncio.run(cancel_all())
+        assert call.cancelled
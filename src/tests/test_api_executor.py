@@ -0,0 +1,67 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from src.api.executor import InferenceExecutor, cancel_on_disconnect
+
+
+class DisconnectedRequest:
+    """Stands in for a Starlette request whose client has disconnected."""
+
+    async def is_disconnected(self):
+        return True
+
+
+class ConnectedRequest:
+    """Stands in for a Starlette request whose client is still connected."""
+
+    async def is_disconnected(self):
+        return False
+
+
+class TestInferenceExecutor:
+    def setup_class(cls):
+        cls.executor = InferenceExecutor(max_workers=2)
+
+    def teardown_class(cls):
+        cls.executor.shutdown()
+
+    def test_run_in_thread_pool(self):
+        thread_name = asyncio.run(self.executor.run(lambda: threading.current_thread().name))
+        assert thread_name.startswith("inference")
+
+    def test_run_does_not_block_event_loop(self):
+        async def run():
+            ticks = []
+
+            async def tick():
+                for _ in range(5):
+                    ticks.append(time.perf_counter())
+                    await asyncio.sleep(0.01)
+
+            await asyncio.gather(self.executor.run(time.sleep, 0.2), tick())
+            return ticks
+
+        ticks = asyncio.run(run())
+        assert len(ticks) == 5
+        assert ticks[-1] - ticks[0] < 0.2
+
+    def test_cancel_on_disconnect_returns_result(self):
+        async def run():
+            return await cancel_on_disconnect(ConnectedRequest(), self.executor.run(sum, [1, 2]))
+
+        assert asyncio.run(run()) == 3
+
+    def test_cancel_on_disconnect_cancels_awaitable(self):
+        async def run():
+            future = asyncio.get_event_loop().create_future()
+            with pytest.raises(HTTPException) as e:
+                await cancel_on_disconnect(DisconnectedRequest(), future, poll_interval=0.01)
+            return e.value.status_code, future.cancelled()
+
+        status_code, cancelled = asyncio.run(run())
+        assert status_code == 499
+        assert cancelled
@@ -0,0 +1,29 @@
+from src.api.gunicorn_conf import n_core_sets, plan_worker_cpus
+
+
+class TestGunicornConf:
+    def setup_class(cls):
+        pass
+
+    def teardown_class(cls):
+        pass
+
+    def test_plan_worker_cpus(self):
+        cpus = list(range(16))
+        assert plan_worker_cpus(cpus, 4) == [
+            [0, 1, 2, 3],
+            [4, 5, 6, 7],
+            [8, 9, 10, 11],
+            [12, 13, 14, 15],
+        ]
+        assert plan_worker_cpus(cpus, 4, threads_per_worker=2) == [[0, 1], [2, 3], [4, 5], [6, 7]]
+        assert plan_worker_cpus([2, 3, 5], 1) == [[2, 3, 5]]
+
+    def test_plan_worker_cpus_more_workers_than_cores(self):
+        assert plan_worker_cpus([0, 1], 3) == [[0], [1], [0]]
+
+    def test_n_core_sets(self):
+        assert n_core_sets(list(range(16))) == 16
+        assert n_core_sets(list(range(16)), threads_per_worker=4) == 4
+        assert n_core_sets(list(range(6)), threads_per_worker=4) == 1
+        assert n_core_sets([0], threads_per_worker=4) == 1
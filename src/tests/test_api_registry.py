@@ -0,0 +1,170 @@
+import asyncio
+
+import pytest
+from omegaconf import OmegaConf
+
+from src.api.registry import DEFAULT_MODEL, ModelRegistry, pipeline_memory_bytes
+
+TOKEN_MODEL_NAME = "dslim/bert-base-NER"
+TEXT_MODEL_NAME = "sshleifer/tiny-distilbert-base-uncased-finetuned-sst-2-english"
+
+
+def registry_config(memory_budget_mb=None):
+    return OmegaConf.create(
+        {
+            "pipeline": "TokenClassificationPipeline",
+            "model": TOKEN_MODEL_NAME,
+            "batching": {"max_batch_size": 8},
+            "registry": {
+                "memory_budget_mb": memory_budget_mb,
+                "models": {
+                    "sentiment": {
+                        "pipeline": "TextClassificationPipeline",
+                        "model": TEXT_MODEL_NAME,
+                    },
+                    "sentiment-small-batches": {
+                        "pipeline": "TextClassificationPipeline",
+                        "model": TEXT_MODEL_NAME,
+                        "batching": {"max_batch_size": 2},
+                    },
+                    "sentiment-large-batches": {
+                        "pipeline": "TextClassificationPipeline",
+                        "model": TEXT_MODEL_NAME,
+                        "batching": {"max_batch_size": 64},
+                    },
+                },
+            },
+        }
+    )
+
+
+class CountingRegistry(ModelRegistry):
+    """Model registry that counts the pipelines it initializes."""
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.inits = []
+
+    def _init_pipeline(self, name):
+        self.inits.append(name)
+        return super()._init_pipeline(name)
+
+
+class TestModelRegistry:
+    def setup_class(cls):
+        pass
+
+    def teardown_class(cls):
+        pass
+
+    def test_configs(self):
+        registry = ModelRegistry(registry_config())
+        assert registry.names() == [
+            DEFAULT_MODEL,
+            "sentiment",
+            "sentiment-small-batches",
+            "sentiment-large-batches",
+        ]
+        assert registry.configs[DEFAULT_MODEL].model == TOKEN_MODEL_NAME
+        assert "registry" not in registry.configs[DEFAULT_MODEL]
+        # Models inherit the root options, and override them
+        assert registry.configs["sentiment"].model == TEXT_MODEL_NAME
+        assert registry.configs["sentiment"].batching.max_batch_size == 8
+        assert registry.configs["sentiment-small-batches"].batching.max_batch_size == 2
+        assert registry.memory_budget is None
+        assert ModelRegistry(registry_config(512)).memory_budget == 512 * 1024**2
+
+    def test_reserved_name(self):
+        config = registry_config()
+        config.registry.models[DEFAULT_MODEL] = {"model": TEXT_MODEL_NAME}
+        with pytest.raises(ValueError):
+            ModelRegistry(config)
+
+    def test_unknown_model(self):
+        registry = ModelRegistry(registry_config())
+        with pytest.raises(KeyError):
+            registry.load("unknown")
+        with pytest.raises(KeyError):
+            asyncio.run(registry.get("unknown"))
+
+    def test_lazy_load(self):
+        registry = ModelRegistry(registry_config())
+        assert registry.loaded() == []
+        entry = asyncio.run(registry.get("sentiment"))
+        assert registry.loaded() == ["sentiment"]
+        assert entry.pipeline.model == TEXT_MODEL_NAME
+        assert entry.scheduler.pipeline is entry.pipeline
+        assert entry.memory_bytes == pipeline_memory_bytes(entry.pipeline) > 0
+
+    def test_concurrent_requests_load_once(self):
+        registry = CountingRegistry(registry_config())
+
+        async def get_all():
+            return await asyncio.gather(*[registry.get("sentiment") for _ in range(4)])
+
+        entries = asyncio.run(get_all())
+        assert registry.inits == ["sentiment"]
+        assert all(entry is entries[0] for entry in entries)
+
+    def test_eviction(self):
+        registry = CountingRegistry(registry_config())
+        entry = registry.load("sentiment")
+        # Budget that fits one of the text classifiers only
+        registry.memory_budget = entry.memory_bytes * 1.5
+
+        registry.load("sentiment-small-batches")
+        assert registry.loaded() == ["sentiment-small-batches"]
+
+        # Evicted models are loaded again on their next request
+        registry.load("sentiment")
+        assert registry.loaded() == ["sentiment"]
+        assert registry.inits == ["sentiment", "sentiment-small-batches", "sentiment"]
+
+    def test_models_in_use_are_not_evicted(self):
+        registry = ModelRegistry(registry_config())
+        entry = registry.load("sentiment")
+        registry.memory_budget = entry.memory_bytes * 1.5
+
+        async def use_while_loading():
+            async with registry.use("sentiment"):
+                await registry.get("sentiment-small-batches")
+                assert registry.loaded() == ["sentiment", "sentiment-small-batches"]
+
+        asyncio.run(use_while_loading())
+        assert registry.loaded() == ["sentiment-small-batches"]
+
+    def test_least_recently_used_is_evicted(self):
+        registry = ModelRegistry(registry_config())
+        entry = registry.load("sentiment")
+        registry.load("sentiment-small-batches")
+        registry.memory_budget = entry.memory_bytes * 2.5
+
+        registry.load("sentiment")
+        registry.load("sentiment-large-batches")
+        assert registry.loaded() == ["sentiment", "sentiment-large-batches"]
+
+    def test_config_hash(self):
+        config = registry_config()
+        config.registry.models["sentiment-int8"] = {
+            "pipeline": "TextClassificationPipeline",
+            "model": TEXT_MODEL_NAME,
+            "quantize": "dynamic-int8",
+        }
+        registry = ModelRegistry(config)
+        config_hash = registry.load("sentiment").config_hash
+        # Models that share the model, but not its options, do not share
+        # cached predictions
+        assert registry.load("sentiment-int8").config_hash != config_hash
+        assert registry.load("sentiment-small-batches").config_hash == config_hash
+
+    def test_use(self):
+        registry = ModelRegistry(registry_config())
+
+        async def predict():
+            async with registry.use("sentiment") as entry:
+                assert entry.in_use == 1
+                return await entry.scheduler.submit("Lisbon is a pretty city.")
+
+        output = asyncio.run(predict())
+        assert output[0]["label"] in ["POSITIVE", "NEGATIVE"]
+        assert registry._entries["sentiment"].in_use == 0
@@ -0,0 +1,64 @@
+import asyncio
+
+import numpy as np
+
+from src.api.responses import NDJSONResponse, NumpyJSONResponse
+
+
+class TestNumpyJSONResponse:
+    def setup_class(cls):
+        pass
+
+    def teardown_class(cls):
+        pass
+
+    def test_render(self):
+        response = NumpyJSONResponse(
+            {"predictions": [{"word": "Lisbon", "score": np.float32(0.5), "start": np.int64(0)}]}
+        )
+        assert response.media_type == "application/json"
+        assert response.body == '{"predictions":[{"word":"Lisbon","score":0.5,"start":0}]}'.encode(
+            "utf-8"
+        )
+
+
+class TestNDJSONResponse:
+    def setup_class(cls):
+        pass
+
+    def teardown_class(cls):
+        pass
+
+    def test_render_lines(self):
+        async def chunks():
+            yield [{"index": 0, "score": np.float32(0.5)}, {"index": 1, "score": np.float32(1)}]
+            yield [{"index": 2, "score": np.float32(0)}]
+
+        async def render():
+            response = NDJSONResponse(chunks())
+            return [chunk async for chunk in response.body_iterator]
+
+        assert asyncio.run(render()) == [
+            b'{"index":0,"score":0.5}\n{"index":1,"score":1.0}\n',
+            b'{"index":2,"score":0.0}\n',
+        ]
+        assert NDJSONResponse(chunks()).media_type == "application/x-ndjson"
+
+    def test_content_is_closed_early(self):
+        closed = []
+
+        async def chunks():
+            try:
+                for ix in range(10):
+                    yield [{"index": ix}]
+            finally:
+                closed.append(True)
+
+        async def render_first():
+            body_iterator = NDJSONResponse(chunks()).body_iterator
+            first = await body_iterator.__anext__()
+            await body_iterator.aclose()
+            return first
+
+        assert asyncio.run(render_first()) == b'{"index":0}\n'
+        assert closed
@@ -0,0 +1,70 @@
+import asyncio
+
+from omegaconf import OmegaConf
+
+from src.api.executor import InferenceExecutor
+from src.api.registry import DEFAULT_MODEL, ModelRegistry
+from src.api.startup import Startup
+
+MODEL_NAME = "sshleifer/tiny-distilbert-base-uncased-finetuned-sst-2-english"
+PIPELINE_NAME = "TextClassificationPipeline"
+
+
+def registry_config():
+    return OmegaConf.create(
+        {
+            "pipeline": PIPELINE_NAME,
+            "model": MODEL_NAME,
+            "registry": {
+                "models": {"sentiment": {"pipeline": PIPELINE_NAME, "model": MODEL_NAME}}
+            },
+        }
+    )
+
+
+class TestStartup:
+    def setup_class(cls):
+        cls.executor = InferenceExecutor()
+
+    def teardown_class(cls):
+        cls.executor.shutdown()
+
+    def test_phase(self):
+        startup = Startup()
+        with startup.phase("config"):
+            pass
+        assert list(startup.timings) == ["config"]
+        assert startup.timings["config"] >= 0
+
+    def test_run(self):
+        startup = Startup()
+        registry = ModelRegistry(registry_config(), executor=self.executor)
+        asyncio.run(startup.run(registry, self.executor, ["sentiment"], [1, 2], [8]))
+        assert startup.ready
+        assert startup.error is None
+        # The root model is always loaded, and only the listed models warmed up
+        assert set(registry.loaded()) == {DEFAULT_MODEL, "sentiment"}
+        assert list(startup.timings) == [
+            "load:{}".format(DEFAULT_MODEL),
+            "load:sentiment",
+            "warm_up:sentiment",
+            "total",
+        ]
+
+    def test_run_keeps_timings_of_loaded_models(self):
+        startup = Startup()
+        registry = ModelRegistry(registry_config(), executor=self.executor)
+        with startup.phase("load:{}".format(DEFAULT_MODEL)):
+            registry.load(DEFAULT_MODEL)
+        load_seconds = startup.timings["load:{}".format(DEFAULT_MODEL)]
+        asyncio.run(startup.run(registry, self.executor, [DEFAULT_MODEL], [1], [8]))
+        assert startup.ready
+        assert startup.timings["load:{}".format(DEFAULT_MODEL)] == load_seconds
+        assert "warm_up:{}".format(DEFAULT_MODEL) in startup.timings
+
+    def test_run_failure(self):
+        startup = Startup()
+        registry = ModelRegistry(registry_config(), executor=self.executor)
+        asyncio.run(startup.run(registry, self.executor, ["unknown"], [1], [8]))
+        assert not startup.ready
+        assert "unknown" in startup.error
@@ -0,0 +1,60 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from prometheus_client import REGISTRY
+
+from src.metrics import latest_metrics
+from src.metrics import time_stage
+
+ROOT_PATH = os.path.dirname(os.path.abspath(__file__)).split("src")[0]
+
+
+def sample_count(stage: str) -> float:
+    return REGISTRY.get_sample_value("hf_pipelines_stage_seconds_count", {"stage": stage}) or 0
+
+
+class TestMetrics:
+    def setup_class(cls):
+        cls.metrics_dir = tempfile.mkdtemp()
+
+    def teardown_class(cls):
+        shutil.rmtree(cls.metrics_dir)
+
+    def test_time_stage(self):
+        count = sample_count("forward")
+        with time_stage("forward"):
+            pass
+        assert sample_count("forward") == count + 1
+
+    def test_latest_metrics(self):
+        with time_stage("tokenize"):
+            pass
+        out = latest_metrics().decode("utf-8")
+        assert 'hf_pipelines_stage_seconds_count{stage="tokenize"}' in out
+        assert "hf_pipelines_requests_total" in out or "# TYPE hf_pipelines_requests" in out
+        assert "hf_pipelines_input_tokens_bucket" in out
+        assert "hf_pipelines_in_flight_requests" in out
+
+    def test_latest_metrics_across_processes(self):
+        # Each process (e.g. gunicorn worker) writes its own metrics files
+        env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": self.metrics_dir}
+        observe = "from src.metrics import time_stage\nwith time_stage('forward'):\n    pass"
+        for _ in range(2):
+            subprocess.run([sys.executable, "-c", observe], cwd=ROOT_PATH, env=env, check=True)
+
+        out = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "from src.metrics import latest_metrics\n"
+                "print(latest_metrics().decode('utf-8'))",
+            ],
+            cwd=ROOT_PATH,
+            env=env,
+            check=True,
+            capture_output=True,
+        ).stdout.decode("utf-8")
+        assert 'hf_pipelines_stage_seconds_count{stage="forward"} 2.0' in out
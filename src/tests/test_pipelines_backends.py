@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pytest
+import torch
+from transformers import pipeline
+
+from src.pipelines.backends import OnnxBackend
+from src.pipelines.backends import TorchBackend
+from src.pipelines.backends import init_backend
+from src.pipelines.backends import model_input_names
+
+MODEL_NAME = "dslim/bert-base-NER"
+
+
+class TestBackends:
+    def setup_class(cls):
+        cls.cache_dir = tempfile.mkdtemp()
+        cls.pipeline = pipeline(task="ner", model=MODEL_NAME)
+        cls.input_names = model_input_names(
+            cls.pipeline.model, cls.pipeline.tokenizer.model_input_names
+        )
+        cls.torch_backend = init_backend(
+            "torch", cls.pipeline.model, cls.input_names, MODEL_NAME, cls.cache_dir
+        )
+        cls.onnx_backend = init_backend(
+            "onnx", cls.pipeline.model, cls.input_names, MODEL_NAME, cls.cache_dir
+        )
+
+    def teardown_class(cls):
+        shutil.rmtree(cls.cache_dir)
+
+    def test_model_input_names(self):
+        # Same order as the arguments of BertForTokenClassification.forward
+        assert self.input_names == ["input_ids", "attention_mask", "token_type_ids"]
+
+    def test_init_backend(self):
+        assert isinstance(self.torch_backend, TorchBackend)
+        assert isinstance(self.onnx_backend, OnnxBackend)
+        with pytest.raises(ValueError):
+            init_backend("tf", self.pipeline.model, self.input_names, MODEL_NAME, self.cache_dir)
+
+    def test_onnx_graph_is_cached(self):
+        assert os.path.exists(self.onnx_backend.path)
+        assert self.onnx_backend.path.startswith(os.path.join(self.cache_dir, "dslim--bert"))
+        assert not [f for f in os.listdir(os.path.dirname(self.onnx_backend.path)) if "tmp" in f]
+
+        mtime = os.path.getmtime(self.onnx_backend.path)
+        backend = OnnxBackend(self.pipeline.model, self.input_names, MODEL_NAME, self.cache_dir)
+        assert backend.path == self.onnx_backend.path
+        assert os.path.getmtime(backend.path) == mtime
+
+    def test_onnx_export_without_dynamo(self, monkeypatch):
+        # Versions of torch before 2.5 have no dynamo argument
+        calls = []
+
+        def export(model, args, f, input_names=None, output_names=None, **kwargs):
+            calls.append(kwargs)
+            open(f, "wb").close()
+
+        monkeypatch.setattr(torch.onnx, "export", export)
+        path = os.path.join(self.cache_dir, "no-dynamo", "model.onnx")
+        self.onnx_backend.export(self.pipeline.model, path)
+        assert os.path.exists(path)
+        assert "dynamo" not in calls[0]
+
+    def test_onnx_matches_torch(self):
+        texts = ["They are António Seráfim and Barack Obama!", "Lisbon", "A" * 30]
+        model_inputs = self.pipeline.tokenizer(texts, padding=True, return_tensors="np")
+        torch_logits = self.torch_backend(model_inputs)
+        onnx_logits = self.onnx_backend(model_inputs)
+        assert onnx_logits.dtype == np.float32
+        assert onnx_logits.shape == torch_logits.shape
+
+        # Padded positions are not compared
+        mask = model_inputs["attention_mask"].astype(bool)
+        assert np.abs(onnx_logits - torch_logits)[mask].max() < 1e-4
+
+    def test_onnx_dynamic_int8_quantization(self):
+        backend = init_backend(
+            "onnx",
+            self.pipeline.model,
+            self.input_names,
+            MODEL_NAME,
+            self.cache_dir,
+            "dynamic-int8",
+        )
+        assert backend.path.endswith("-int8.onnx")
+        assert os.path.getsize(backend.path) < os.path.getsize(self.onnx_backend.path)
+
+        model_inputs = self.pipeline.tokenizer(["Lisbon is a great city!"], return_tensors="np")
+        assert backend(model_inputs).shape == self.onnx_backend(model_inputs).shape
@@ -1,7 +1,11 @@
-import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
+import torch
 from omegaconf import OmegaConf
+from torch.ao.nn.quantized.dynamic import Linear as DynamicQuantizedLinear
 
+from src.pipelines.backends import TorchBackend
 from src.pipelines.base_pipeline import BasePipeline
 
 MODEL_NAME = "sshleifer/tiny-distilbert-base-cased"
@@ -25,6 +29,34 @@ class TestBaselinePipeline:
     def test_prefix_is_correct(self):
         assert self.pipeline.prefix == "##"
 
+    def test_backend_is_torch_by_default(self):
+        assert self.pipeline.backend_name == "torch"
+        assert isinstance(self.pipeline.backend, TorchBackend)
+        assert self.pipeline.backend.input_names[:2] == ["input_ids", "attention_mask"]
+
+    def test_unsupported_backend_raises_value_error(self):
+        config = OmegaConf.create(
+            {"pipeline": PIPELINE_NAME, "model": MODEL_NAME, "backend": "tensorflow"}
+        )
+        with pytest.raises(ValueError):
+            BasePipeline(config)
+
+    def test_dynamic_int8_quantization(self):
+        config = OmegaConf.create(
+            {"pipeline": PIPELINE_NAME, "model": MODEL_NAME, "quantize": "dynamic-int8"}
+        )
+        pipeline = BasePipeline(config)
+        modules = list(pipeline.backend.model.modules())
+        assert not [m for m in modules if type(m) == torch.nn.Linear]
+        assert [m for m in modules if isinstance(m, DynamicQuantizedLinear)]
+
+    def test_unsupported_quantization_raises_value_error(self):
+        config = OmegaConf.create(
+            {"pipeline": PIPELINE_NAME, "model": MODEL_NAME, "quantize": "int4"}
+        )
+        with pytest.raises(ValueError):
+            BasePipeline(config)
+
     def test_call_raises_not_implemented_error(self):
         with pytest.raises(NotImplementedError):
             self.pipeline("x")
@@ -35,39 +67,77 @@ class TestBaselinePipeline:
         assert self.pipeline.tokenize_text("sgoiw dfdfer") == ["sgoiw", "dfdfer"]
         assert self.pipeline.tokenize_text("## uaih .!!") == ["#", "#", "uaih", ".", "!", "!"]
 
-    def test_map_all_np_keys(self):
-        out = self.pipeline._map_all_np_keys(
-            [
-                {"x": "test1", "y": np.int64(42), "z": np.float64(42.0)},
-                {"x": "test2", "y": np.int64(22), "z": np.float64(22.0)},
-                {"x": "test3", "y": np.int64(12), "z": np.float64(12.0)},
-            ]
-        )
-        assert out[0]["x"] == "test1"
-        assert out[0]["y"] == 42
-        assert out[0]["z"] == 42.0
-        assert type(out[0]["x"]) == str
-        assert type(out[0]["y"]) == int
-        assert type(out[0]["z"]) == float
-        assert out[1]["x"] == "test2"
-        assert out[1]["y"] == 22
-        assert out[1]["z"] == 22.0
-        assert type(out[1]["x"]) == str
-        assert type(out[1]["y"]) == int
-        assert type(out[1]["z"]) == float
-        assert out[2]["x"] == "test3"
-        assert out[2]["y"] == 12
-        assert out[2]["z"] == 12.0
-        assert type(out[2]["x"]) == str
-        assert type(out[2]["y"]) == int
-        assert type(out[2]["z"]) == float
-
-    def test_get_np_keys(self):
-        out = self.pipeline._get_np_keys({"x": "test", "y": np.int64(42), "z": np.float64(42.0)})
-        assert out == ["y", "z"]
-
-    def test_map_np_keys(self):
-        out = self.pipeline._map_np_keys({"x": "test", "y": np.int64(42), "z": np.float64(42.0)})
-        assert type(out["x"]) == str
-        assert type(out["y"]) == int
-        assert type(out["z"]) == float
+    def test_tokenize_text_batch(self):
+        texts = ["Example sentence!", "", "António  Nunes!"]
+        assert self.pipeline.tokenize_text(texts) == [
+            ["Example", "sentence", "!"],
+            [],
+            ["António", "Nunes", "!"],
+        ]
+
+    def test_tokenize_long_text_after_truncation(self):
+        config = OmegaConf.create({"pipeline": PIPELINE_NAME, "model": MODEL_NAME})
+        pipeline = BasePipeline(config)
+        pipeline.tokenizer("Example sentence!", truncation=True)
+        text = " ".join(["word"] * 3000)
+        # Truncation state that earlier truncated calls can leave on the
+        # backend tokenizer
+        pipeline.tokenizer._tokenizer.enable_truncation(512)
+        assert len(pipeline.tokenize_text(text)) == 3000
+        assert len(pipeline.word_tokens([text, "Example sentence!"])[0]) == 3000
+
+    def test_estimate_tokens(self):
+        # 17 characters are estimated as 5 tokens, besides the special tokens
+        assert self.pipeline.estimate_tokens("Example sentence!") == 7
+        assert self.pipeline.estimate_tokens("") == 2
+        assert self.pipeline.estimate_tokens(" ".join(["word"] * 3000)) == 512
+
+    def test_tokenizer_per_thread(self):
+        assert self.pipeline.tokenizer is self.pipeline.pipeline.tokenizer
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            tokenizers = list(pool.map(lambda _: self.pipeline.tokenizer, range(2)))
+        assert all(tokenizer is not self.pipeline.tokenizer for tokenizer in tokenizers)
+        # Other threads get the same tokenizer on each use
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            assert pool.submit(lambda: self.pipeline.tokenizer is self.pipeline.tokenizer).result()
+
+    def test_tokenizer_across_threads(self):
+        # Truncated and untruncated calls in other threads must not interfere
+        long_text = " ".join(["Lisbon is a pretty city."] * 400)
+        expected = self.pipeline.tokenize_text(long_text)
+        tokenizers = [self.pipeline.pipeline.tokenizer, self.pipeline._tokenizer_template]
+        max_lengths = [tokenizer.model_max_length for tokenizer in tokenizers]
+        for tokenizer in tokenizers:
+            tokenizer.model_max_length = 16
+
+        def count_tokens(text):
+            return len(self.pipeline.tokenizer(text, truncation=True)["input_ids"])
+
+        try:
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                futures = [
+                    (
+                        (pool.submit(self.pipeline.tokenize_text, long_text), expected)
+                        if ix % 2
+                        else (pool.submit(count_tokens, long_text), 16)
+                    )
+                    for ix in range(100)
+                ]
+                assert all(future.result() == result for future, result in futures)
+        finally:
+            for tokenizer, max_length in zip(tokenizers, max_lengths):
+                tokenizer.model_max_length = max_length
+
+    def test_padding_efficiency(self):
+        self.pipeline.padding_stats = {"real_tokens": 0, "computed_tokens": 0}
+        assert self.pipeline.padding_efficiency() == 1.0
+        self.pipeline._update_padding_stats([2, 4, 3, 3], batch_size=2)
+        assert self.pipeline.padding_stats == {"real_tokens": 12, "computed_tokens": 14}
+        assert self.pipeline.padding_efficiency() == 12 / 14
+
+    def test_word_tokens(self):
+        texts = ["António Nunes!", "## uaih .!!"]
+        out = self.pipeline.word_tokens(texts)
+        assert [t["word"] for t in out[0]] == ["António", "Nunes", "!"]
+        assert [t["word"] for t in out[1]] == ["#", "#", "uaih", ".", "!", "!"]
+        assert out[0][1] == {"word": "Nunes", "start": 8, "end": 13}
@@ -0,0 +1,150 @@
+import pytest
+from omegaconf import OmegaConf
+
+from src.pipelines.cascade import CascadePipeline, cascade_configs
+from src.pipelines.utils import init_pipeline
+
+SMALL_MODEL_NAME = "sshleifer/tiny-dbmdz-bert-large-cased-finetuned-conll03-english"
+LARGE_MODEL_NAME = "dslim/bert-base-NER"
+PIPELINE_NAME = "TokenClassificationPipeline"
+
+
+class ScoredPipeline:
+    """Pipeline that predicts one label per text, scored by a lookup table,
+    and records the texts it is called with."""
+
+    def __init__(self, model, scores):
+        self.model = model
+        self.pipeline_type = "Text Classification Pipeline"
+        self.scores = scores
+        self.calls = []
+
+    def __call__(self, texts, return_tokens=False):
+        self.calls.append(list(texts))
+        outputs = [[{"label": self.model, "score": self.scores[t]}] for t in texts]
+        if return_tokens:
+            return [(o, [{"word": t, "start": 0, "end": len(t)}]) for o, t in zip(outputs, texts)]
+        return outputs
+
+
+class EmptyPipeline(ScoredPipeline):
+    """Pipeline without predictions for any text."""
+
+    def __init__(self, model):
+        super().__init__(model, {})
+
+    def __call__(self, texts, return_tokens=False):
+        self.calls.append(list(texts))
+        return [[] for _ in texts]
+
+
+class TestCascadePipeline:
+    def setup_class(cls):
+        config = OmegaConf.create(
+            {
+                "pipeline": PIPELINE_NAME,
+                "model": LARGE_MODEL_NAME,
+                "cascade": {"enabled": True, "model": SMALL_MODEL_NAME, "threshold": 0.5},
+            }
+        )
+        cls.pipeline = init_pipeline(config)
+
+    def teardown_class(cls):
+        pass
+
+    def test_cascade_configs(self):
+        config = OmegaConf.create(
+            {
+                "pipeline": PIPELINE_NAME,
+                "model": LARGE_MODEL_NAME,
+                "cascade": {"enabled": True, "model": SMALL_MODEL_NAME},
+            }
+        )
+        small_config, large_config = cascade_configs(config)
+        assert small_config.model == SMALL_MODEL_NAME
+        assert large_config.model == LARGE_MODEL_NAME
+        assert not small_config.cascade.enabled and not large_config.cascade.enabled
+
+    def test_unconfident_texts_run_through_large_model(self):
+        scores = {"easy": 0.99, "hard": 0.6, "borderline": 0.9}
+        small = ScoredPipeline("small", scores)
+        large = ScoredPipeline("large", scores)
+        pipeline = CascadePipeline(small, large, threshold=0.9)
+
+        out = pipeline(["easy", "hard", "borderline"])
+        assert small.calls == [["easy", "hard", "borderline"]]
+        assert large.calls == [["hard"]]
+        assert [o[0]["label"] for o in out] == ["small", "large", "small"]
+        assert all(list(o[0].keys()) == ["label", "score"] for o in out)
+
+    def test_call_with_tokens(self):
+        scores = {"easy": 0.99, "hard": 0.6}
+        pipeline = CascadePipeline(
+            ScoredPipeline("small", scores), ScoredPipeline("large", scores), threshold=0.9
+        )
+        predictions, tokens = pipeline("hard", return_tokens=True)
+        assert predictions[0]["label"] == "large"
+        assert tokens == [{"word": "hard", "start": 0, "end": 4}]
+
+    def test_call_with_models(self):
+        scores = {"easy": 0.99, "hard": 0.6}
+        pipeline = CascadePipeline(
+            ScoredPipeline("small", scores), ScoredPipeline("large", scores), threshold=0.9
+        )
+        out, models = pipeline(["easy", "hard"], return_models=True)
+        assert [o[0]["label"] for o in out] == ["small", "large"]
+        assert models == ["small", "large"]
+        assert pipeline("hard", return_models=True) == (
+            [{"label": "large", "score": 0.6}],
+            "large",
+        )
+
+        (predictions, tokens), model = pipeline("hard", return_tokens=True, return_models=True)
+        assert model == "large"
+        assert tokens == [{"word": "hard", "start": 0, "end": 4}]
+
+    def test_models_of_texts_without_predictions(self):
+        pipeline = CascadePipeline(EmptyPipeline("small"), EmptyPipeline("large"), threshold=0.9)
+        out, models = pipeline(["", "x"], return_models=True)
+        assert out == [[], []]
+        assert models == ["small", "small"]
+
+    def test_texts_without_predictions_are_confident(self):
+        pipeline = CascadePipeline(
+            ScoredPipeline("small", {}), ScoredPipeline("large", {}), threshold=0.9
+        )
+        assert pipeline.is_confident([])
+
+    def test_different_pipelines_raise_value_error(self):
+        large = ScoredPipeline("large", {})
+        large.pipeline_type = "Token Classification Pipeline"
+        with pytest.raises(ValueError):
+            CascadePipeline(ScoredPipeline("small", {}), large, threshold=0.9)
+
+    def test_init_pipeline(self):
+        assert isinstance(self.pipeline, CascadePipeline)
+        assert self.pipeline.small.model == SMALL_MODEL_NAME
+        assert self.pipeline.large.model == LARGE_MODEL_NAME
+        assert self.pipeline.pipeline_type == "Token Classification Pipeline"
+
+    def test_call(self):
+        texts = ["They are António Seráfim and Barack Obama!", "Lisbon is a great city!"]
+        out = self.pipeline(texts)
+        assert len(out) == 2
+        for text, predictions in zip(texts, out):
+            expected = self.pipeline.small(text)
+            if not self.pipeline.is_confident(expected):
+                expected = self.pipeline.large(text)
+            spans = [(p["entity_group"], p["start"], p["end"]) for p in predictions]
+            assert spans == [(p["entity_group"], p["start"], p["end"]) for p in expected]
+            scores = [p["score"] for p in predictions]
+            assert scores == pytest.approx([p["score"] for p in expected], abs=1e-5)
+            assert "model" not in predictions[0]
+        assert self.pipeline(texts, return_models=True)[1] == [
+            (
+                SMALL_MODEL_NAME
+                if self.pipeline.is_confident(self.pipeline.small(text))
+                else LARGE_MODEL_NAME
+            )
+            for text in texts
+        ]
@@ -0,0 +1,93 @@
+import os
+import shutil
+import tempfile
+
+from omegaconf import OmegaConf
+
+from src.pipelines.backends import local_revision
+from src.pipelines.snapshots import fetch_snapshot, model_configs, snapshot_dir, snapshot_path
+from src.pipelines.text_classification_pipeline import TextClassificationPipeline
+
+MODEL_NAME = "sshleifer/tiny-distilbert-base-uncased-finetuned-sst-2-english"
+PIPELINE_NAME = "TextClassificationPipeline"
+
+
+class TestSnapshots:
+    def setup_class(cls):
+        cls.snapshots_dir = tempfile.mkdtemp()
+        cls.config = OmegaConf.create(
+            {"pipeline": PIPELINE_NAME, "model": MODEL_NAME, "snapshots_dir": cls.snapshots_dir}
+        )
+        cls.path = fetch_snapshot(cls.config)
+
+    def teardown_class(cls):
+        shutil.rmtree(cls.snapshots_dir)
+
+    def test_snapshot_dir(self):
+        assert snapshot_dir("dslim/bert-base-NER", "/models") == "/models/dslim--bert-base-NER"
+
+    def test_snapshot_path(self):
+        assert self.path == snapshot_dir(MODEL_NAME, self.snapshots_dir)
+        assert snapshot_path(MODEL_NAME, self.snapshots_dir) == self.path
+        assert snapshot_path(MODEL_NAME, None) is None
+        assert snapshot_path("dslim/bert-base-NER", self.snapshots_dir) is None
+
+    def test_snapshot_is_saved_as_safetensors(self):
+        assert os.path.exists(os.path.join(self.path, "model.safetensors"))
+        assert os.path.exists(os.path.join(self.path, "tokenizer_config.json"))
+
+    def test_pipeline_loads_snapshot(self):
+        pipeline = TextClassificationPipeline(self.config)
+        assert pipeline.pipeline.model.name_or_path == self.path
+        # The model keeps its hub name, e.g. in responses and cache keys
+        assert pipeline.model == MODEL_NAME
+
+        expected = TextClassificationPipeline(
+            OmegaConf.create({"pipeline": PIPELINE_NAME, "model": MODEL_NAME})
+        )
+        text = "Lisbon is a pretty city."
+        assert pipeline(text)[0]["label"] == expected(text)[0]["label"]
+        assert abs(pipeline(text)[0]["score"] - expected(text)[0]["score"]) < 1e-6
+
+    def test_onnx_graph_follows_snapshot_revision(self):
+        onnx_config = OmegaConf.merge(
+            self.config, {"backend": "onnx", "onnx": {"cache_dir": self.snapshots_dir}}
+        )
+        pipeline = TextClassificationPipeline(onnx_config)
+        revision = local_revision(self.path)
+        assert os.path.basename(pipeline.backend.path).startswith(revision)
+
+        # A refreshed snapshot has a new revision, and is exported again
+        copy = os.path.join(self.snapshots_dir, "copy")
+        shutil.copytree(self.path, copy)
+        assert local_revision(copy) == revision
+        with open(os.path.join(copy, "config.json"), "a") as f:
+            f.write("\n")
+        assert local_revision(copy) != revision
+
+    def test_model_configs(self):
+        config = OmegaConf.create(
+            {
+                "pipeline": PIPELINE_NAME,
+                "model": MODEL_NAME,
+                "backend": "onnx",
+                "registry": {
+                    "models": {
+                        "ner": {"pipeline": "TokenClassificationPipeline", "model": "dslim/ner"}
+                    }
+                },
+            }
+        )
+        configs = model_configs(config)
+        assert [c.model for c in configs] == [MODEL_NAME, "dslim/ner"]
+        assert all(c.backend == "onnx" and "registry" not in c for c in configs)
+
+        config.cascade = {"enabled": True, "model": "dslim/small-ner"}
+        configs = model_configs(config)
+        assert [c.model for c in configs] == [
+            "dslim/small-ner",
+            MODEL_NAME,
+            "dslim/small-ner",
+            "dslim/ner",
+        ]
+        assert not any(c.cascade.enabled for c in configs)
@@ -1,3 +1,6 @@
+import shutil
+import tempfile
+
 from omegaconf import OmegaConf
 
 from src.pipelines.text_classification_pipeline import TextClassificationPipeline
@@ -11,8 +14,19 @@ class TestTextClassificationPipeline:
         config = OmegaConf.create({"pipeline": PIPELINE_NAME, "model": MODEL_NAME})
         cls.pipeline = TextClassificationPipeline(config)
 
+        cls.onnx_cache_dir = tempfile.mkdtemp()
+        config = OmegaConf.create(
+            {
+                "pipeline": PIPELINE_NAME,
+                "model": MODEL_NAME,
+                "backend": "onnx",
+                "onnx": {"cache_dir": cls.onnx_cache_dir},
+            }
+        )
+        cls.onnx_pipeline = TextClassificationPipeline(config)
+
     def teardown_class(cls):
-        pass
+        shutil.rmtree(cls.onnx_cache_dir)
 
     def test_correct_pipeline_type(self):
         assert self.pipeline.pipeline_type == "Text Classification Pipeline"
@@ -23,3 +37,59 @@ class TestTextClassificationPipeline:
         assert list(out[0].keys()) == ["label", "score"]
         assert out[0]["label"] in ["POSITIVE", "NEGATIVE"]
         assert type(out[0]["score"]) == float
+
+    def test_call_with_list(self):
+        texts = ["Lisbon is a great and amazing city!", "This is bad."]
+        out = self.pipeline(texts)
+        assert len(out) == 2
+        for text, text_out in zip(texts, out):
+            assert len(text_out) == 1
+            assert list(text_out[0].keys()) == ["label", "score"]
+            assert text_out[0]["label"] == self.pipeline(text)[0]["label"]
+            assert type(text_out[0]["score"]) == float
+
+    def test_call_matches_hf_pipeline(self):
+        texts = ["Lisbon is a great and amazing city!", "This is bad."]
+        for out, expected in zip(self.pipeline(texts), self.pipeline.pipeline(texts)):
+            assert out[0]["label"] == expected["label"]
+            assert abs(out[0]["score"] - expected["score"]) < 1e-6
+
+    def test_call_with_onnx_backend(self):
+        texts = ["Lisbon is a great and amazing city!", "This is bad.", "Okay."]
+        for out, expected in zip(self.onnx_pipeline(texts), self.pipeline(texts)):
+            assert out[0]["label"] == expected[0]["label"]
+            assert abs(out[0]["score"] - expected[0]["score"]) < 1e-5
+            assert type(out[0]["score"]) == float
+
+    def test_call_with_empty_list(self):
+        assert self.pipeline([]) == []
+
+    def test_call_with_bucketing(self):
+        config = OmegaConf.create(
+            {
+                "pipeline": PIPELINE_NAME,
+                "model": MODEL_NAME,
+                "bucketing": {"enabled": True, "batch_size": 2},
+            }
+        )
+        pipeline = TextClassificationPipeline(config)
+        texts = [
+            "A much longer sentence, that should need a few more tokens than the others.",
+            "Bad.",
+            "Lisbon is a great and amazing city!",
+            "Okay.",
+        ]
+        out = pipeline(texts)
+        assert [o[0]["label"] for o in out] == [self.pipeline(text)[0]["label"] for text in texts]
+
+        # Bucketing pairs the two short and the two long texts
+        self.pipeline.padding_stats = {"real_tokens": 0, "computed_tokens": 0}
+        self.pipeline(texts)
+        assert pipeline.padding_stats["real_tokens"] == self.pipeline.padding_stats["real_tokens"]
+        assert pipeline.padding_efficiency() > self.pipeline.padding_efficiency()
+
+    def test_warm_up(self):
+        self.pipeline.padding_stats = {"real_tokens": 0, "computed_tokens": 0}
+        self.pipeline.warm_up(batch_sizes=[1, 2], n_tokens=[8, 32])
+        # A batch of each size, with texts of each length
+        assert self.pipeline.padding_stats["real_tokens"] == (1 + 2) * (8 + 32)
@@ -1,6 +1,11 @@
+import shutil
+import tempfile
+
+import numpy as np
 from omegaconf import OmegaConf
 
 from src.pipelines.token_classification_pipeline import TokenClassificationPipeline
+from src.pipelines.token_classification_pipeline import TokenPredictions
 
 MODEL_NAME = "dslim/bert-base-NER"
 PIPELINE_NAME = "TokenClassificationPipeline"
@@ -11,8 +16,25 @@ class TestTokenClassificationPipeline:
         config = OmegaConf.create({"pipeline": PIPELINE_NAME, "model": MODEL_NAME})
         cls.pipeline = TokenClassificationPipeline(config)
 
+        windowing = {"enabled": True, "window_size": 8, "stride": 4}
+        config = OmegaConf.create(
+            {"pipeline": PIPELINE_NAME, "model": MODEL_NAME, "windowing": windowing}
+        )
+        cls.windowed_pipeline = TokenClassificationPipeline(config)
+
+        cls.onnx_cache_dir = tempfile.mkdtemp()
+        config = OmegaConf.create(
+            {
+                "pipeline": PIPELINE_NAME,
+                "model": MODEL_NAME,
+                "backend": "onnx",
+                "onnx": {"cache_dir": cls.onnx_cache_dir},
+            }
+        )
+        cls.onnx_pipeline = TokenClassificationPipeline(config)
+
     def teardown_class(cls):
-        pass
+        shutil.rmtree(cls.onnx_cache_dir)
 
     def test_correct_pipeline_type(self):
         assert self.pipeline.pipeline_type == "Token Classification Pipeline"
@@ -34,3 +56,155 @@ class TestTokenClassificationPipeline:
         assert len(out) == 2
         assert out[0]["word"] == "António Seráfim"
         assert out[1]["word"] == "Barack Obama"
+
+    def test_call_with_list(self):
+        texts = ["Lisbon is a great city!", "They are António Seráfim and Barack Obama!"]
+        out = self.pipeline(texts)
+        assert len(out) == 2
+        for text, text_out in zip(texts, out):
+            assert [o["word"] for o in text_out] == [o["word"] for o in self.pipeline(text)]
+            for o in text_out:
+                assert type(o["score"]) == float
+                assert type(o["start"]) == int
+                assert type(o["end"]) == int
+
+    def test_call_with_tokens(self):
+        text = "They are António Seráfim and Barack Obama!"
+        out, tokens = self.pipeline(text, return_tokens=True)
+        assert out == self.pipeline(text)
+        assert [t["word"] for t in tokens] == self.pipeline.tokenize_text(text)
+        for t in tokens:
+            assert text[t["start"] : t["end"]] == t["word"]
+
+        out = self.pipeline([text, "Lisbon is a great city!"], return_tokens=True)
+        assert len(out) == 2
+        assert out[0][1] == tokens
+
+    def test_call_with_tokens_of_truncated_text(self):
+        # Predictions are truncated to the model maximum length, but tokens
+        # cover the whole text
+        text = " ".join(["Lisbon is a great city!"] * 200)
+        max_length = self.pipeline.tokenizer.model_max_length
+        self.pipeline.tokenizer.model_max_length = 512
+        try:
+            _, tokens = self.pipeline(text, return_tokens=True)
+        finally:
+            self.pipeline.tokenizer.model_max_length = max_length
+        assert len(tokens) == 1200
+        assert [t["word"] for t in tokens] == self.pipeline.tokenize_text(text)
+        assert tokens == self.pipeline.word_tokens([text])[0]
+
+    def test_call_matches_hf_pipeline(self):
+        text = "They are António Seráfim and Barack Obama!"
+        predictions = self.pipeline.pipeline(text)
+        for d in predictions:
+            if d["word"].startswith("##") and d["entity"].startswith("B-"):
+                d["entity"] = d["entity"].replace("B-", "I-")
+        expected = self.pipeline.pipeline.group_entities(predictions)
+
+        out = self.pipeline(text)
+        assert len(out) == len(expected)
+        for o, e in zip(out, expected):
+            assert o["entity_group"] == e["entity_group"]
+            assert o["word"] == e["word"]
+            assert o["start"] == e["start"]
+            assert o["end"] == e["end"]
+            assert abs(o["score"] - e["score"]) < 1e-5
+
+    def test_group_entities(self):
+        label2id = self.pipeline.pipeline.model.config.label2id
+        ids = self.pipeline.tokenizer.convert_tokens_to_ids(
+            ["Ant", "##on", "##io", "is", "Lisbon"]
+        )
+        predictions = TokenPredictions(
+            input_ids=np.array(ids),
+            offsets=np.array([[0, 3], [3, 5], [5, 7], [8, 10], [11, 17]]),
+            label_ids=np.array(
+                [label2id[label] for label in ["B-PER", "B-PER", "I-PER", "O", "B-LOC"]]
+            ),
+            scores=np.array([0.9, 0.6, 0.3, 0.9, 0.5]),
+        )
+        out = self.pipeline._group_entities(predictions)
+        assert [(o["entity_group"], o["start"], o["end"]) for o in out] == [
+            ("PER", 0, 7),
+            ("LOC", 11, 17),
+        ]
+        assert abs(out[0]["score"] - 0.6) < 1e-6
+        assert type(out[0]["score"]) == float
+        assert type(out[0]["start"]) == int
+
+    def test_window_spans(self):
+        text = "They are António Seráfim and Barack Obama! Lisbon is a great city. " * 3
+        word_ids = self.pipeline.tokenizer._tokenizer.encode(
+            text, add_special_tokens=False
+        ).word_ids
+        spans = self.windowed_pipeline._window_spans(word_ids)
+        assert spans[0][0] == 0
+        assert spans[-1][1] == len(word_ids)
+        for (start, end), (next_start, next_end) in zip(spans[:-1], spans[1:]):
+            assert end - start <= 8
+            assert start < next_start < end
+            assert word_ids[next_start] != word_ids[next_start - 1]
+
+    def test_call_with_windows(self):
+        text = "They are António Seráfim and Barack Obama! Lisbon is a great city. " * 3
+        windowed = self.windowed_pipeline._windowed_token_predictions([text])[0]
+        full = self.pipeline._token_predictions([text])[0]
+        assert (windowed.input_ids == full.input_ids).all()
+        assert (windowed.offsets == full.offsets).all()
+
+        out, tokens = self.windowed_pipeline(text, return_tokens=True)
+        assert [t["word"] for t in tokens] == self.pipeline.tokenize_text(text)
+        for o in out:
+            assert type(o["score"]) == float
+            assert 0 <= o["start"] < o["end"] <= len(text)
+
+        # Short texts are run as a single window
+        short_text = "Lisbon is a great city!"
+        assert self.windowed_pipeline(short_text) == self.pipeline(short_text)
+
+    def test_call_with_long_text(self):
+        config = OmegaConf.create(
+            {"pipeline": PIPELINE_NAME, "model": MODEL_NAME, "windowing": {"enabled": True}}
+        )
+        pipeline = TokenClassificationPipeline(config)
+        assert pipeline.window_size == 510
+
+        text = " ".join(["They are António Seráfim and Barack Obama!"] * 150)
+        out = pipeline([text, "Lisbon is a great city!"])
+        assert len(out) == 2
+        for o in out[0]:
+            assert 0 <= o["start"] < o["end"] <= len(text)
+
+    def test_call_with_long_text_after_short_batch(self):
+        config = OmegaConf.create(
+            {"pipeline": PIPELINE_NAME, "model": MODEL_NAME, "windowing": {"enabled": True}}
+        )
+        pipeline = TokenClassificationPipeline(config)
+        pipeline(["Lisbon is a great city!", "They are António Seráfim!"])
+        # Truncation state that earlier truncated calls can leave on the
+        # backend tokenizer
+        pipeline.tokenizer._tokenizer.enable_truncation(512)
+
+        sentence = "They are António Seráfim and Barack Obama!"
+        text = " ".join([sentence] * 150)
+        predictions = pipeline._windowed_token_predictions([text])[0]
+        assert predictions.offsets[-1, 1] == len(text)
+        _, tokens = pipeline(text, return_tokens=True)
+        assert len(tokens) == 150 * len(pipeline.tokenize_text(sentence))
+        assert tokens[-1]["end"] == len(text)
+
+    def test_call_with_onnx_backend(self):
+        texts = ["They are António Seráfim and Barack Obama!", "Lisbon is a great city!"]
+        for predictions, expected in zip(
+            self.onnx_pipeline._token_predictions(texts), self.pipeline._token_predictions(texts)
+        ):
+            assert (predictions.label_ids == expected.label_ids).all()
+            assert np.abs(predictions.scores - expected.scores).max() < 1e-5
+
+        for out, expected in zip(self.onnx_pipeline(texts), self.pipeline(texts)):
+            assert [(o["entity_group"], o["word"], o["start"], o["end"]) for o in out] == [
+                (e["entity_group"], e["word"], e["start"], e["end"]) for e in expected
+            ]
+            for o in out:
+                assert type(o["score"]) == float
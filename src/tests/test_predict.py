@@ -0,0 +1,208 @@
+import io
+import json
+
+from omegaconf import OmegaConf
+
+from predict import (
+    load_checkpoint,
+    memo_hash,
+    predict_deduped,
+    predict_sharded,
+    predict_stream,
+    read_batches,
+    save_checkpoint,
+    shard_byte_ranges,
+)
+from src.api.cache import PredictionCache
+from src.pipelines.utils import init_pipeline
+
+MODEL_NAME = "sshleifer/tiny-distilbert-base-uncased-finetuned-sst-2-english"
+PIPELINE_NAME = "TextClassificationPipeline"
+
+LINES = [
+    "Lisbon is a great and amazing city!",
+    "This is bad.",
+    "Olá, António!",
+    "",
+    "The last line.",
+]
+
+
+class RecordingPipeline:
+    """Wraps a pipeline, and records the texts it runs."""
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.model = pipeline.model
+        self.pipeline_type = pipeline.pipeline_type
+        self.padding_stats = pipeline.padding_stats
+        self.texts = []
+
+    def __call__(self, texts):
+        self.texts += texts
+        return self.pipeline(texts)
+
+
+def read_jsonl(path):
+    with open(path, encoding="utf-8") as fp:
+        return [json.loads(line) for line in fp]
+
+
+class TestPredict:
+    def setup_class(cls):
+        cls.config = OmegaConf.create({"pipeline": PIPELINE_NAME, "model": MODEL_NAME})
+        cls.pipeline = init_pipeline(cls.config)
+
+    def teardown_class(cls):
+        pass
+
+    def test_read_batches(self):
+        data = "\n".join(LINES).encode("utf-8") + b"\n"
+        batches = list(read_batches(io.BytesIO(data), batch_size=2))
+        assert [lines for lines, _ in batches] == [LINES[0:2], LINES[2:4], LINES[4:5]]
+        assert batches[-1][1] == len(data)
+
+        # Offsets point to the start of the next batch
+        fp = io.BytesIO(data)
+        fp.seek(batches[0][1])
+        assert next(read_batches(fp, batch_size=2))[0] == LINES[2:4]
+
+    def test_checkpoint(self, tmp_path):
+        checkpoint_path = str(tmp_path / "out.jsonl.ckpt")
+        assert load_checkpoint(checkpoint_path) == {
+            "line": 0,
+            "input_offset": 0,
+            "output_offset": 0,
+        }
+        save_checkpoint(checkpoint_path, {"line": 3, "input_offset": 10, "output_offset": 20})
+        assert load_checkpoint(checkpoint_path) == {
+            "line": 3,
+            "input_offset": 10,
+            "output_offset": 20,
+        }
+
+    def test_predict_stream(self, tmp_path):
+        input_file = tmp_path / "input.txt"
+        input_file.write_text("\n".join(LINES) + "\n", encoding="utf-8")
+
+        out_path = predict_stream(self.pipeline, str(input_file), batch_size=2, resume=False)
+        predictions = read_jsonl(out_path)
+        assert [p["line"] for p in predictions] == list(range(len(LINES)))
+        for line, prediction in zip(LINES, predictions):
+            assert prediction["predictions"][0]["label"] == self.pipeline(line)[0]["label"]
+
+    def test_predict_stream_resume(self, tmp_path):
+        input_file = tmp_path / "input.txt"
+        input_file.write_text("\n".join(LINES) + "\n", encoding="utf-8")
+        out_path = predict_stream(self.pipeline, str(input_file), batch_size=2, resume=False)
+        expected = read_jsonl(out_path)
+
+        # Simulate a crash after the first batch, with a partially written line
+        with open(out_path, "rb") as fp:
+            first_batch = fp.readline() + fp.readline()
+        with open(out_path, "wb") as fp:
+            fp.write(first_batch + b'{"line": 2, "predi')
+        save_checkpoint(
+            out_path + ".ckpt",
+            {
+                "line": 2,
+                "input_offset": len("\n".join(LINES[:2]).encode("utf-8")) + 1,
+                "output_offset": len(first_batch),
+            },
+        )
+
+        predict_stream(self.pipeline, str(input_file), batch_size=2, resume=True)
+        assert [p["line"] for p in read_jsonl(out_path)] == [p["line"] for p in expected]
+        assert [p["predictions"][0]["label"] for p in read_jsonl(out_path)] == [
+            p["predictions"][0]["label"] for p in expected
+        ]
+
+    def test_shard_byte_ranges(self, tmp_path):
+        input_file = tmp_path / "input.txt"
+        input_file.write_text("\n".join(LINES) + "\n", encoding="utf-8")
+        data = input_file.read_bytes()
+
+        for n_shards in [1, 2, 3, 10]:
+            byte_ranges = shard_byte_ranges(str(input_file), n_shards)
+            assert len(byte_ranges) == n_shards
+            assert byte_ranges[0][0] == 0
+            assert byte_ranges[-1][1] == len(data)
+            lines = []
+            for start, end in byte_ranges:
+                assert start == 0 or data[start - 1 : start] == b"\n"
+                lines.extend(data[start:end].decode("utf-8").splitlines())
+            assert lines == LINES
+
+    def test_predict_sharded(self, tmp_path):
+        input_file = tmp_path / "input.txt"
+        input_file.write_text("\n".join(LINES) + "\n", encoding="utf-8")
+
+        out_path = predict_sharded(self.config, str(input_file), workers=2, batch_size=2)
+        predictions = read_jsonl(out_path)
+        assert [p["line"] for p in predictions] == list(range(len(LINES)))
+        for line, prediction in zip(LINES, predictions):
+            assert prediction["predictions"][0]["label"] == self.pipeline(line)[0]["label"]
+
+        # Shard files are removed after merging
+        assert sorted(path.name for path in tmp_path.iterdir()) == ["input.jsonl", "input.txt"]
+
+    def test_predict_deduped(self, tmp_path):
+        # Duplicates, including up to whitespace, which text classification ignores
+        lines = LINES + ["This is bad.", "This  is bad.", LINES[0], ""]
+        input_file = tmp_path / "input.txt"
+        input_file.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+        pipeline = RecordingPipeline(self.pipeline)
+        out_path, stats = predict_deduped(pipeline, str(input_file), batch_size=2)
+        assert sorted(pipeline.texts) == sorted(LINES)
+        # Sorted by length
+        assert [len(t) for t in pipeline.texts] == sorted(len(t) for t in LINES)
+        assert stats["lines"] == len(lines)
+        assert stats["unique"] == stats["predicted"] == len(LINES)
+        assert stats["dedupe_ratio"] == 1 - len(LINES) / len(lines)
+
+        predictions = read_jsonl(out_path)
+        assert [p["line"] for p in predictions] == list(range(len(lines)))
+        for line, prediction in zip(lines, predictions):
+            assert prediction["predictions"][0]["label"] == self.pipeline(line)[0]["label"]
+
+    def test_predict_deduped_memo(self, tmp_path):
+        input_file = tmp_path / "input.txt"
+        input_file.write_text("\n".join(LINES) + "\n", encoding="utf-8")
+        memo = PredictionCache(str(tmp_path / "memo.sqlite"))
+        out_path, _ = predict_deduped(self.pipeline, str(input_file), batch_size=2, memo=memo)
+        expected = read_jsonl(out_path)
+
+        # A later run reuses the predictions of the memo
+        input_file.write_text("\n".join(LINES + ["A new line."]) + "\n", encoding="utf-8")
+        pipeline = RecordingPipeline(self.pipeline)
+        out_path, stats = predict_deduped(pipeline, str(input_file), batch_size=2, memo=memo)
+        assert pipeline.texts == ["A new line."]
+        assert stats["memo_hits"] == len(LINES)
+        assert stats["predicted"] == 1
+        assert read_jsonl(out_path)[: len(LINES)] == expected
+
+        # Another model config does not reuse them
+        pipeline = RecordingPipeline(self.pipeline)
+        config_hash = memo_hash(
+            OmegaConf.merge(self.config, {"quantize": "dynamic-int8"}), self.pipeline
+        )
+        _, stats = predict_deduped(
+            pipeline, str(input_file), batch_size=2, memo=memo, config_hash=config_hash
+        )
+        assert stats["memo_hits"] == 0
+        assert sorted(pipeline.texts) == sorted(LINES + ["A new line."])
+
+    def test_memo_hash(self, monkeypatch):
+        config_hash = memo_hash(self.config, self.pipeline)
+        assert memo_hash(OmegaConf.create(self.config), self.pipeline) == config_hash
+        # Options that only change how predictions are served are ignored
+        config = OmegaConf.merge(self.config, {"batching": {"max_batch_size": 2}})
+        assert memo_hash(config, self.pipeline) == config_hash
+        config = OmegaConf.merge(self.config, {"quantize": "dynamic-int8"})
+        assert memo_hash(config, self.pipeline) != config_hash
+
+        # An updated model does not reuse the memo either
+        model_config = self.pipeline.pipeline.model.config
+        monkeypatch.setattr(model_config, "_commit_hash", "updated", raising=False)
+        assert memo_hash(self.config, self.pipeline) != config_hash
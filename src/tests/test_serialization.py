@@ -0,0 +1,31 @@
+import numpy as np
+
+from src.serialization import dumps, loads
+
+
+class TestSerialization:
+    def setup_class(cls):
+        pass
+
+    def teardown_class(cls):
+        pass
+
+    def test_dumps_numpy(self):
+        out = dumps(
+            [
+                {"x": "António", "y": np.int64(42), "z": np.float32(0.5)},
+                {"x": "test2", "y": np.int64(22), "z": np.float64(22.0)},
+            ]
+        )
+        assert type(out) == bytes
+        assert loads(out) == [
+            {"x": "António", "y": 42, "z": 0.5},
+            {"x": "test2", "y": 22, "z": 22.0},
+        ]
+        assert loads(dumps({"scores": np.array([[1, 2], [3, 4]])})) == {"scores": [[1, 2], [3, 4]]}
+
+    def test_dumps_int_keys(self):
+        assert loads(dumps({0: [], 1: [{"y": np.int64(1)}]})) == {"0": [], "1": [{"y": 1}]}
+
+    def test_dumps_indent(self):
+        assert dumps({"x": 1}, indent=True) == b'{\n  "x": 1\n}'